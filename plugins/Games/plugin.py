@@ -157,7 +157,7 @@ class Games(callbacks.Plugin):
         in the channel itself.
         """
         i = 0
-        for m in reversed(irc.state.history):
+        for m in irc.state.history.search(channel=channel):
             if m.command != 'PRIVMSG':
                 continue
             if not m.prefix:
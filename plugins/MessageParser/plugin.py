@@ -42,6 +42,7 @@ import re
 import os
 import sys
 import time
+import collections
 
 try:
     from supybot.i18n import PluginInternationalization
@@ -70,6 +71,34 @@ import supybot.world as world
 import supybot.log as log
 
 
+class Triggers(object):
+    """The compiled triggers of a database."""
+    def __init__(self, rows):
+        # List of (regexp, compiled regexp, action, whether the regexp is in
+        # the prefilter)
+        self.triggers = []
+        # Non-matching messages (ie. most of them) cost a single scan,
+        # instead of one per trigger.
+        self.prefilter = callbacks.RegexpPrefilter()
+        for (regexp, action) in rows:
+            try:
+                r = re.compile(regexp)
+            except re.error as e:
+                log.warning('MessageParser: ignoring invalid regexp %r: %s',
+                            regexp, e)
+                continue
+            prefiltered = self.prefilter.add(r, 0)
+            self.triggers.append((regexp, r, action, prefiltered))
+
+    def finditer(self, s):
+        """Yields (regexp, action, match) for each match of each trigger."""
+        mayMatch = self.prefilter.search(s)
+        for (regexp, r, action, prefiltered) in self.triggers:
+            if mayMatch or not prefiltered:
+                for match in r.finditer(s):
+                    yield (regexp, action, match)
+
+
 class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
     """This plugin can set regexp triggers to activate the bot.
     Use 'add' command to add regexp trigger, 'remove' to remove."""
@@ -77,6 +106,21 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
     def __init__(self, irc):
         callbacks.Plugin.__init__(self, irc)
         plugins.ChannelDBHandler.__init__(self)
+        self._lock = threading.Lock()
+        # Cache of the Triggers of each database, cleared when one of them
+        # is written to.
+        self._triggers = ircutils.IrcDict()
+        self._triggersVersion = 0
+        # (channel, regexp) -> number of times it was triggered since the
+        # usage counts were last written to the databases.
+        self._pendingRanks = collections.Counter()
+        world.flushers.append(self._flushRanks)
+
+    def die(self):
+        if self._flushRanks in world.flushers:
+            world.flushers.remove(self._flushRanks)
+        self._flushRanks()
+        callbacks.Plugin.die(self)
 
     def makeDb(self, filename):
         """Create the database and connect to it."""
@@ -115,16 +159,47 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         db.isolation_level = None
         return db
 
+    def _getTriggers(self, channel):
+        with self._lock:
+            triggers = self._triggers.get(channel)
+            version = self._triggersVersion
+        if triggers is None:
+            db = self.getDb(channel)
+            cursor = db.cursor()
+            cursor.execute("SELECT regexp, action FROM triggers")
+            triggers = Triggers(cursor.fetchall())
+            with self._lock:
+                # Unless the database was written to in the meantime
+                if version == self._triggersVersion:
+                    self._triggers[channel] = triggers
+        return triggers
+
+    def _invalidateTriggers(self):
+        with self._lock:
+            self._triggers.clear()
+            self._triggersVersion += 1
+
     def _updateRank(self, network, channel, regexp):
         subfolder = None if channel == 'global' else channel
         if self.registryValue('keepRankInfo', subfolder, network):
+            with self._lock:
+                self._pendingRanks[(channel, regexp)] += 1
+
+    def _flushRanks(self):
+        """Writes the usage counts of the triggers to the databases."""
+        with self._lock:
+            pending = self._pendingRanks
+            self._pendingRanks = collections.Counter()
+        byChannel = {}
+        for ((channel, regexp), count) in pending.items():
+            byChannel.setdefault(channel, []).append((count, regexp))
+        for (channel, updates) in byChannel.items():
             db = self.getDb(channel)
             cursor = db.cursor()
-            cursor.execute("""SELECT usage_count
-                      FROM triggers
-                      WHERE regexp=?""", (regexp,))
-            old_count = cursor.fetchall()[0][0]
-            cursor.execute("UPDATE triggers SET usage_count=? WHERE regexp=?", (old_count + 1, regexp,))
+            cursor.execute("BEGIN")
+            cursor.executemany("""UPDATE triggers
+                                  SET usage_count=usage_count+?
+                                  WHERE regexp=?""", updates)
             db.commit()
 
     def _runCommandFunction(self, irc, msg, command):
@@ -161,17 +236,14 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
             actions = []
             results = []
             for channel in set(map(plugins.getChannel, (channel, 'global'))):
-                db = self.getDb(channel)
-                cursor = db.cursor()
-                cursor.execute("SELECT regexp, action FROM triggers")
-                # Fetch results and prepend channel name or 'global'. This
-                # prevents duplicating the following lines.
-                results.extend([(channel,)+x for x in cursor.fetchall()])
+                triggers = self._getTriggers(channel)
+                if triggers.triggers:
+                    results.append((channel, triggers))
             if len(results) == 0:
                 return
             max_triggers = self.registryValue('maxTriggers', channel, irc.network)
-            for (channel, regexp, action) in results:
-                for match in re.finditer(regexp, msg.args[1]):
+            for (channel, triggers) in results:
+                for (regexp, action, match) in triggers.finditer(msg.args[1]):
                     if match is not None:
                         thisaction = action
                         self._updateRank(irc.network, channel, regexp)
@@ -207,6 +279,8 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         if not self._checkManageCapabilities(irc, msg, channel):
             capabilities = self.registryValue('requireManageCapability')
             irc.errorNoCapability(capabilities, Raise=True)
+        # The usage count of the trigger is kept if it is overwritten
+        self._flushRanks()
         db = self.getDb(channel)
         cursor = db.cursor()
         cursor.execute("SELECT id, usage_count, locked FROM triggers WHERE regexp=?", (regexp,))
@@ -230,6 +304,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
                               (NULL, ?, ?, ?, ?, ?, ?)""",
                             (regexp, name, int(time.time()), usage_count, action, locked,))
             db.commit()
+            self._invalidateTriggers()
             irc.replySuccess()
         else:
             irc.error(_('That trigger is locked.'))
@@ -269,6 +344,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
 
         cursor.execute("""DELETE FROM triggers WHERE id=?""", (id,))
         db.commit()
+        self._invalidateTriggers()
         irc.replySuccess()
     remove = wrap(remove, ['channelOrGlobal',
                             getopts({'id': '',}),
@@ -358,6 +434,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         itself.
         If option --id specified, will retrieve by regexp id, not content.
         """
+        self._flushRanks()
         db = self.getDb(channel)
         cursor = db.cursor()
         target = 'regexp'
@@ -421,6 +498,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         message isn't sent in the channel itself.
         """
         numregexps = self.registryValue('rankListLength', channel, irc.network)
+        self._flushRanks()
         db = self.getDb(channel)
         cursor = db.cursor()
         cursor.execute("""SELECT regexp, usage_count
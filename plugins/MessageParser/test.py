@@ -149,6 +149,23 @@ class MessageParserTestCase(ChannelPluginTestCase):
         self.getMsg(' ')
         self.assertRegexp('messageparser rank', r'#1 "aoeu" \(1\), #2 "stuff" \(0\)')
 
+    def testRankIsFlushed(self):
+        self.assertNotError('messageparser add "stuff" "echo i saw some stuff"')
+        cb = self.irc.getCallback('MessageParser')
+        db = cb.getDb(self.channel)
+        def usageCount():
+            cursor = db.cursor()
+            cursor.execute("SELECT usage_count FROM triggers WHERE regexp=?",
+                           ('stuff',))
+            return cursor.fetchall()[0][0]
+        self.feedMsg('this message has some stuff in it')
+        self.getMsg(' ')
+        self.feedMsg('more stuff')
+        self.getMsg(' ')
+        self.assertEqual(usageCount(), 0)
+        world.flush()
+        self.assertEqual(usageCount(), 2)
+
     def testList(self):
         self.assertRegexp('messageparser list',
                           r'There are no regexp triggers in the database\.')
@@ -63,6 +63,10 @@ conf.registerGlobalValue(Misc, 'timestampFormat',
     for the time module to see what formats are accepted. If you set this
     variable to the empty string, the timestamp will not be shown.""")))
 conf.registerGroup(Misc, 'last')
+conf.registerGlobalValue(Misc.last, 'regexpTimeout',
+    registry.PositiveFloat(1.0, _("""Determines the maximum time, in seconds,
+    the regular expressions given to last with --regexp may take to search
+    the whole history of the bot.""")))
 conf.registerGroup(Misc.last, 'nested')
 conf.registerChannelValue(Misc.last.nested,
     'includeTimestamp', registry.Boolean(False, _("""Determines whether or not
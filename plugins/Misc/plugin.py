@@ -68,9 +68,6 @@ def getPluginsInDirectory(directory):
                 plugins.append(filename)
     return plugins
 
-class RegexpTimeout(Exception):
-    pass
-
 class Misc(callbacks.Plugin):
     """Miscellaneous commands to access Supybot core. This is a core
     Supybot plugin that should not be removed!"""
@@ -373,9 +370,9 @@ class Misc(callbacks.Plugin):
         userHostmask = msg.prefix.split('!', 1)[1]
         if nick:
             try:
-                (private, L) = irc._mores[nick]
-                if not private:
-                    irc._mores[userHostmask] = L[:]
+                replies = irc._mores[nick]
+                if not replies.private:
+                    irc._mores[userHostmask] = replies.copy()
                 else:
                     irc.error(_('%s has no public mores.') % nick)
                     return
@@ -383,15 +380,13 @@ class Misc(callbacks.Plugin):
                 irc.error(_('Sorry, I can\'t find any mores for %s') % nick)
                 return
         try:
-            L = irc._mores[userHostmask]
+            replies = irc._mores[userHostmask]
         except KeyError:
             irc.error(_('You haven\'t asked me a command; perhaps you want '
                       'to see someone else\'s more.  To do so, call this '
                       'command with that person\'s nick.'), Raise=True)
         number = self.registryValue('mores', msg.channel, irc.network)
-        msgs = L[-number:]
-        msgs.reverse()
-        L[-number:] = []
+        msgs = replies.pop(number)
         if msgs:
             for msg in msgs:
                 irc.queueMsg(msg)
@@ -417,8 +412,10 @@ class Misc(callbacks.Plugin):
         given in is searched.
         """
         predicates = {}
+        regexps = []
         nolimit = False
         skipfirst = True
+        channel = msg.channel
         if msg.channel:
             predicates['in'] = lambda m: ircutils.strEqual(m.args[0],
                                                            msg.channel)
@@ -433,6 +430,7 @@ class Misc(callbacks.Plugin):
                 def f(m, arg=arg):
                     return ircutils.strEqual(m.args[0], arg)
                 predicates['in'] = f
+                channel = arg
                 if arg != msg.channel:
                     skipfirst = False
             elif option == 'on':
@@ -448,26 +446,11 @@ class Misc(callbacks.Plugin):
                     return arg.lower() not in m.args[1].lower()
                 predicates.setdefault('without', []).append(f)
             elif option == 'regexp':
-                def f(m, arg=arg):
-                    def f1(s, arg):
-                        """Since we can't enqueue match objects into the multiprocessing queue,
-                        we'll just wrap the function to return bools."""
-                        if process(arg.search, s, timeout=0.1) is not None:
-                            return True
-                        else:
-                            return False
-                    if ircmsgs.isAction(m):
-                        m1 = ircmsgs.unAction(m)
-                    else:
-                        m1 = m.args[1]
-                    return regexp_wrapper(m1, reobj=arg, timeout=0.1,
-                                          plugin_name=self.name(),
-                                          fcn_name='last')
-                predicates.setdefault('regexp', []).append(f)
+                regexps.append(arg)
             elif option == 'nolimit':
                 nolimit = True
         iterable = filter(functools.partial(self._validLastMsg, irc),
-                          reversed(irc.state.history))
+                          irc.state.history.search(channel=channel))
         if skipfirst:
             # Drop the first message only if our current channel is the same as
             # the channel we've been instructed to look at.
@@ -497,15 +480,26 @@ class Misc(callbacks.Plugin):
             showNick = False
         else:
             showNick = True
-        for m in iterable:
+        def matchesPredicates(m):
             for predicate in predicates:
-                try:
-                    if not predicate(m):
-                        break
-                except RegexpTimeout:
-                    irc.error(_('The regular expression timed out.'))
-                    return
-            else:
+                if not predicate(m):
+                    return False
+            return True
+        iterable = filter(matchesPredicates, iterable)
+        indexes = None
+        if regexps:
+            # Search all the candidates at once, instead of running a
+            # subprocess for each of them.
+            candidates = list(iterable)
+            texts = [ircmsgs.unAction(m) if ircmsgs.isAction(m) else m.args[1]
+                     for m in candidates]
+            indexes = regexp_filter(texts, regexps,
+                                    timeout=self.registryValue(
+                                        'last.regexpTimeout'),
+                                    plugin_name=self.name(), fcn_name='last')
+            iterable = (candidates[i] for i in indexes)
+        try:
+            for m in iterable:
                 if nolimit:
                     resp.append(ircmsgs.prettyPrint(m,
                                                     timestampFormat=tsf,
@@ -515,6 +509,12 @@ class Misc(callbacks.Plugin):
                                                   timestampFormat=tsf,
                                                   showNick=showNick))
                     return
+        except commands.ProcessTimeoutError:
+            irc.error(_('The regular expression timed out.'))
+            return
+        finally:
+            if indexes is not None:
+                indexes.close()
         if not resp:
             irc.error(_('I couldn\'t find a message matching that criteria in '
                       'my history of %s messages.') % len(irc.state.history))
@@ -183,6 +183,25 @@ class MiscTestCase(ChannelPluginTestCase):
         finally:
             conf.supybot.plugins.Misc.timestampFormat.setValue(orig)
 
+    def testLastRegexp(self):
+        with conf.supybot.plugins.Misc.timestampFormat.context(''):
+            self.feedMsg('foo bar baz')
+            self.feedMsg('quux')
+            self.feedMsg('bar qux')
+            self.assertResponse('last --nolimit --regexp m/bar/ --regexp m/z/',
+                                '<%s> foo bar baz' % self.nick)
+            self.assertResponse('last --nolimit --regexp "m/^bar|baz$/"',
+                                '<%s> bar qux and <%s> foo bar baz' %
+                                (self.nick, self.nick))
+            self.assertRegexp('last --regexp m/nothing/', 'couldn\'t find')
+
+    @unittest.skipIf(world.disableMultiprocessing,
+                     "Test requires multiprocessing to be enabled")
+    def testLastRegexpTimeout(self):
+        with conf.supybot.plugins.Misc.last.regexpTimeout.context(0.2):
+            self.feedMsg('a'*30)
+            self.assertRegexp(r'last --regexp m/(a*)*b/', 'timed out')
+
     def testNestedLastTimestampConfig(self):
         tsConfig = conf.supybot.plugins.Misc.last.nested.includeTimestamp
         orig = tsConfig()
@@ -220,6 +239,23 @@ class MiscTestCase(ChannelPluginTestCase):
         self.assertResponse('more',
                             "Error: That's all, there is no more.")
 
+    def testMoreInReplyTo(self):
+        inReplyTo = []
+        class InReplyToRecorder(irclib.IrcCallback):
+            def outFilter(self, irc, msg):
+                inReplyTo.append(msg.tagged('inReplyTo'))
+                return msg
+        recorder = InReplyToRecorder()
+        self.irc.addCallback(recorder)
+        try:
+            self.assertRegexp('echo %s' % ('abc '*400), 'more messages')
+            self.assertRegexp('more', 'more messages')
+        finally:
+            self.irc.removeCallback(recorder.name())
+        self.assertEqual(len(inReplyTo), 2)
+        self.assertTrue(inReplyTo[0].args[1].endswith('echo ' + 'abc '*400))
+        self.assertIs(inReplyTo[1], inReplyTo[0])
+
     def testMoreMores(self):
         with conf.supybot.plugins.Misc.mores.context(2):
             self.assertResponse('echo %s' % ('abc '*400),
@@ -236,6 +272,23 @@ class MiscTestCase(ChannelPluginTestCase):
             self.assertResponse('more',
                                 "Error: That's all, there is no more.")
 
+    def testMoresExpire(self):
+        with conf.supybot.reply.mores.timeout.context(10):
+            self.assertRegexp('echo %s' % ('abc '*400), 'more')
+            timeFastForward(5)
+            self.assertRegexp('more', 'more')
+            timeFastForward(6)
+            self.assertRegexp('more', 'haven\'t asked me a command')
+
+    def testMoresMaximumStored(self):
+        # Each reply is stored by user hostmask and by nick
+        with conf.supybot.reply.mores.maximumStored.context(2):
+            self.assertRegexp('echo %s' % ('abc '*400), 'more')
+            self.assertRegexp('echo %s' % ('def '*400), 'more',
+                              frm='other!other@other')
+            self.assertRegexp('more', 'haven\'t asked me a command')
+            self.assertRegexp('more', 'def', frm='other!other@other')
+
     def testClearMores(self):
         self.assertRegexp('echo %s' % ('abc'*700), 'more')
         self.assertRegexp('more', 'more')
@@ -291,7 +291,7 @@ class QuoteGrabs(callbacks.Plugin):
             msgid = msg.server_tags.get('+draft/reply')
         else:
             msgid = None
-        for m in reversed(irc.state.history):
+        for m in irc.state.history.search(channel=chan, nick=nick):
             if msgid and m.server_tags.get('msgid') != msgid:
                 continue
             if m.command == 'PRIVMSG' and ircutils.nickEqual(m.nick, nick) \
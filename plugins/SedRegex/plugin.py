@@ -30,7 +30,7 @@
 ###
 
 from supybot.commands import *
-from supybot.commands import ProcessTimeoutError
+from supybot.commands import ProcessTimeoutError, processIter
 import supybot.plugins as plugins
 import supybot.ircmsgs as ircmsgs
 import supybot.callbacks as callbacks
@@ -57,8 +57,13 @@ from .constants import SED_REGEX, TAG_SEEN, TAG_IS_REGEX
 # Replace newlines and friends with things like literal "\n" (backslash and "n")
 axe_spaces = utils.str.MultipleReplacer({'\n': '\\n', '\t': '\\t', '\r': '\\r'})
 
-class SearchNotFoundError(Exception):
-    pass
+def _replace_first(texts, pattern, replacement, count):
+    """Yields the index of the first of the texts matching the pattern, with
+    the text after the substitution."""
+    for (i, text) in enumerate(texts):
+        if pattern.search(text):
+            yield (i, pattern.sub(replacement, text, count))
+            return
 
 class SedRegex(callbacks.PluginRegexp):
     """History replacer using sed-style regex syntax."""
@@ -132,7 +137,7 @@ class SedRegex(callbacks.PluginRegexp):
         if not self.registryValue('enable', msg.channel, irc.network):
             return
         self.log.debug("SedRegex: running on %s/%s for %s", irc.network, msg.channel, regex)
-        iterable = reversed(irc.state.history)
+        iterable = irc.state.history.search(channel=msg.channel)
         msg.tag(TAG_IS_REGEX)
 
         try:
@@ -152,25 +157,53 @@ class SedRegex(callbacks.PluginRegexp):
             return
 
         regex_timeout = self.registryValue('processTimeout')
+        candidates = list(self._candidates(irc, msg, target, iterable))
+        if self.registryValue('boldReplacementText',
+                              msg.channel, irc.network):
+            replacement = ircutils.bold(replacement)
+        # Only the regexp runs in a subprocess, on all the candidates at once.
+        results = processIter(_replace_first,
+                [text for (m, action, text) in candidates],
+                pattern, replacement, count,
+                timeout=regex_timeout, pn=self.name(), cn='replacer')
         try:
-            message = process(self._replacer_process, irc, msg,
-                    target, pattern, replacement, count, iterable,
-                    timeout=regex_timeout, pn=self.name(), cn='replacer')
+            result = next(results, None)
         except ProcessTimeoutError:
             irc.error(_("Search timed out."))
-        except SearchNotFoundError:
-            irc.error(_("Search not found in the last %i IRC messages on this network.") %
-                len(irc.state.history))
+            return
         except Exception as e:
             self.log.warning(_("SedRegex replacer error: %s"), e, exc_info=True)
             if self.registryValue('displayErrors', msg.channel, irc.network):
                 irc.error('%s.%s: %s' % (e.__class__.__module__,
                     e.__class__.__name__, e))
+            return
+        finally:
+            results.close()
+
+        if result is None:
+            self.log.debug(_("SedRegex: Search %r not found in the last %i messages of %s."),
+                             msg.args[1], len(irc.state.history), msg.args[0])
+            irc.error(_("Search not found in the last %i IRC messages on this network.") %
+                len(irc.state.history))
+            return
+
+        (i, subst) = result
+        (m, action, text) = candidates[i]
+        if m.nick == msg.nick:
+            messageprefix = msg.nick
         else:
-            irc.reply(message, prefixNick=False)
+            messageprefix = '%s thinks %s' % (msg.nick, m.nick)
+        if action:  # If the message was an ACTION, prepend the nick back.
+            subst = '* %s %s' % (m.nick, subst)
+        subst = axe_spaces(subst)
+        irc.reply(_("%s meant to say: %s") % (messageprefix, subst),
+                  prefixNick=False)
     replacer.__doc__ = SED_REGEX.pattern
 
-    def _replacer_process(self, irc, msg, target, pattern, replacement, count, messages):
+    def _candidates(self, irc, msg, target, messages):
+        """Yields (message, isAction, text) for the messages the
+        substitution may apply to, most recent first."""
+        ignoreRegex = self.registryValue('ignoreRegex', msg.channel, irc.network)
         for m in messages:
             if m.command in ('PRIVMSG', 'NOTICE') and \
                     ircutils.strEqual(m.args[0], msg.args[0]) and m.tagged('receivedBy') == irc:
@@ -195,35 +228,11 @@ class SedRegex(callbacks.PluginRegexp):
                     if SED_REGEX.match(m.args[1]):
                         m.tag(TAG_IS_REGEX)
                 # Ignore messages containing a regexp if ignoreRegex is on.
-                if self.registryValue('ignoreRegex', msg.channel, irc.network) and m.tagged(TAG_IS_REGEX):
+                if ignoreRegex and m.tagged(TAG_IS_REGEX):
                     self.log.debug("Skipping message %s because it is tagged as isRegex", m.args[1])
                     continue
-                if m.nick == msg.nick:
-                    messageprefix = msg.nick
-                else:
-                    messageprefix = '%s thinks %s' % (msg.nick, m.nick)
-
-                try:
-                    replace_result = pattern.search(text)
-                    if replace_result:
-                        if self.registryValue('boldReplacementText',
-                                              msg.channel, irc.network):
-                            replacement = ircutils.bold(replacement)
-                        subst = pattern.sub(replacement, text, count)
-                        if action:  # If the message was an ACTION, prepend the nick back.
-                            subst = '* %s %s' % (m.nick, subst)
-
-                        subst = axe_spaces(subst)
-
-                        return _("%s meant to say: %s") % \
-                            (messageprefix, subst)
-                except Exception as e:
-                    self.log.warning(_("SedRegex error: %s"), e, exc_info=True)
-                    raise
-
-        self.log.debug(_("SedRegex: Search %r not found in the last %i messages of %s."),
-                         msg.args[1], len(irc.state.history), msg.args[0])
-        raise SearchNotFoundError()
+
+                yield (m, action, text)
 
 Class = SedRegex
 
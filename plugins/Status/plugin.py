@@ -38,6 +38,8 @@ import subprocess
 import supybot.conf as conf
 import supybot.utils as utils
 import supybot.world as world
+import supybot.commands as commands
+import supybot.schedule as schedule
 from supybot.commands import *
 import supybot.callbacks as callbacks
 from supybot.i18n import PluginInternationalization, internationalizeDocstring
@@ -100,18 +102,29 @@ class Status(callbacks.Plugin):
         irc.reply(s)
     threads = wrap(threads)
 
+    @internationalizeDocstring
     def processes(self, irc, msg, args):
         """takes no arguments
 
         Returns the number of processes that have been spawned, and list of
-        ones that are still active.
+        ones that are still active, as well as statistics about the pool of
+        processes running functions for plugins.
         """
         ps = [multiprocessing.current_process().name]
         ps = ps + [p.name for p in multiprocessing.active_children()]
-        s = format('I have spawned %n; %n %b still currently active: %L.',
+        s = format(_('I have spawned %n; %n %b still currently active: %L.'),
                    (world.processesSpawned, 'process'),
                    (len(ps), 'process'),
                    len(ps), ps)
+        stats = commands.processPoolsStats()
+        s += '  ' + format(_('My pools of processes have run %n (%i timed '
+                             'out) and forked %n; %n currently waiting for '
+                             'one of their %n (at most %i).'),
+                           (stats['tasks'], 'function'), stats['timeouts'],
+                           (stats['forks'], 'process'),
+                           (stats['waiting'], 'call'),
+                           (stats['processes'], 'process'),
+                           stats['maxWaiting'])
         irc.reply(s)
     processes = wrap(processes)
 
@@ -132,6 +145,29 @@ class Status(callbacks.Plugin):
                   self.sentMsgs, self.sentBytes, irc.server, timeElapsed))
     net = wrap(net)
 
+    @internationalizeDocstring
+    def queue(self, irc, msg, args):
+        """takes no arguments
+
+        Returns the number of messages waiting to be sent to this network,
+        and the targets with the most of them.
+        """
+        stats = irc.getRealIrc().queue.targetStats()
+        total = sum(count for (count, wait) in stats.values())
+        s = format(_('%n waiting to be sent to %s.'),
+                   (total, 'message'), irc.network)
+        L = sorted(((count, wait, target or _('no target'))
+                    for (target, (count, wait)) in stats.items()),
+                   reverse=True)
+        if L:
+            s += '  ' + format(_('Most of them are for %L.'),
+                               [format(_('%s (%n, the oldest for %.1f '
+                                         'seconds)'),
+                                       target, (count, 'message'), wait)
+                                for (count, wait, target) in L[:3]])
+        irc.reply(s)
+    queue = wrap(queue)
+
     @internationalizeDocstring
     def cpu(self, irc, msg, args):
         """takes no arguments
@@ -208,6 +244,67 @@ class Status(callbacks.Plugin):
         irc.reply(s)
     cmd = wrap(cmd)
 
+    @internationalizeDocstring
+    def mores(self, irc, msg, args):
+        """takes no arguments
+
+        Returns the number of replies kept for the 'more' command, and the
+        memory they use.
+        """
+        (replies, size) = \
+            callbacks.NestedCommandsIrcProxy._mores.memoryUsage()
+        irc.reply(format(_('I am keeping %n for the more command, using '
+                           'about %S.'), (replies, 'reply'), size))
+    mores = wrap(mores)
+
+    @internationalizeDocstring
+    def regexps(self, irc, msg, args):
+        """takes no arguments
+
+        Returns the number of times each regexp-based callback of the loaded
+        plugins matched, and the number of messages skipped because they
+        could not match any of them.
+        """
+        L = []
+        for cb in irc.callbacks:
+            if isinstance(cb, callbacks.PluginRegexp):
+                for res in (cb.res, cb.addressedRes, cb.unaddressedRes):
+                    for (r, name) in res:
+                        L.append(format('%s.%s: %i', cb.name(), name,
+                                        cb.regexpMatches[name]))
+        stats = callbacks.regexpPrefilter.stats()
+        s = format(_('%i of %n matched none of the regexps, and were '
+                     'skipped.'), stats['skipped'], (stats['scans'], 'string'))
+        if L:
+            s = '%s  %s' % ('; '.join(L), s)
+        irc.reply(s)
+    regexps = wrap(regexps)
+
+    @internationalizeDocstring
+    def schedule(self, irc, msg, args):
+        """takes no arguments
+
+        Returns the number of events waiting to be run by the scheduler, and
+        how late the events it ran were, on average and at most; and the
+        events run by the main loop which took the longest time to run (and
+        therefore delayed the others).
+        """
+        stats = schedule.schedule.stats()
+        s = format(_('%n waiting to be run; %n run, %.3f seconds late on '
+                     'average and %.3f seconds at most.'),
+                   (stats['pending'], 'event'), (stats['ran'], 'event'),
+                   stats['averageLateness'], stats['maxLateness'])
+        L = [(eventStats['maxDuration'], label)
+             for (label, eventStats) in schedule.schedule.eventStats().items()
+             if eventStats['executor'] == 'inline']
+        L.sort(reverse=True)
+        if L:
+            s += '  ' + format(_('Longest events: %L.'),
+                               [format(_('%s (%.3f seconds)'), label, duration)
+                                for (duration, label) in L[:3]])
+        irc.reply(s)
+    schedule = wrap(schedule)
+
     @internationalizeDocstring
     def commands(self, irc, msg, args):
         """takes no arguments
@@ -34,7 +34,7 @@ import sys
 import supybot.world as world
 
 class StatusTestCase(PluginTestCase):
-    plugins = ('Status',)
+    plugins = ('Status', 'Utilities')
     def testNet(self):
         self.assertNotError('net')
 
@@ -55,6 +55,34 @@ class StatusTestCase(PluginTestCase):
             conf.supybot.plugins.Status.cpu.get('children').setValue(original)
             
 
+    def testQueue(self):
+        self.assertRegexp('queue', r'[0-9]+ messages? waiting to be sent to '
+                                   r'test\.')
+        self.irc.queue.enqueue(ircmsgs.privmsg('#foo', 'a'))
+        self.irc.queue.enqueue(ircmsgs.privmsg('#foo', 'b'))
+        try:
+            self.irc.feedMsg(ircmsgs.privmsg(self.irc.nick, 'queue',
+                                             prefix=self.prefix))
+            msgs = [self.irc.takeMsg() for i in range(3)]
+        finally:
+            self.irc.queue.reset()
+        replies = [m.args[1] for m in msgs if m.args[0] != '#foo']
+        self.assertEqual(len(replies), 1)
+        self.assertIn('for #foo (2 messages, the oldest for', replies[0])
+
+    def testMores(self):
+        callbacks.NestedCommandsIrcProxy._mores.clear()
+        self.assertRegexp('mores', 'keeping 0 replies')
+        self.assertNotError('echo %s' % ('foo ' * 300))
+        self.assertRegexp('mores', 'keeping 1 reply .* about [0-9.]+ ?[kK]?B')
+
+    def testRegexps(self):
+        self.assertRegexp('regexps', r'[0-9]+ of [0-9]+ strings? matched none')
+
+    def testSchedule(self):
+        self.assertRegexp('schedule', r'[0-9]+ events? waiting to be run; '
+                                      r'[0-9]+ events? run')
+
     def testUptime(self):
         self.assertNotError('uptime')
 
@@ -74,6 +102,7 @@ class StatusTestCase(PluginTestCase):
 
     def testProcesses(self):
         self.assertNotError('processes')
+        self.assertRegexp('processes', 'pools of processes have run')
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
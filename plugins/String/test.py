@@ -32,6 +32,7 @@ import re
 
 from supybot.test import *
 import supybot.utils as utils
+import supybot.commands as commands
 
 nicks = ['fatjim','scn','moshez','LordVan','MetaCosm','pythong','fishfart',
          'alb','d0rt','jemfinch','StyxAlso','fors','deltab','gd',
@@ -120,6 +121,14 @@ class StringTestCase(PluginTestCase):
         self.assertResponse('re m/a\\S+y/g "the bot angryman is hairy"',
                             'angry and airy')
 
+    def testReUsesProcessPool(self):
+        if world.disableMultiprocessing:
+            self.skipTest('Test requires multiprocessing to be enabled')
+        tasks = commands.processPoolsStats()['tasks']
+        self.assertResponse('re s/user/luser/g user user', 'luser luser')
+        self.assertResponse('re m/u\\S+/g user user', 'user and user')
+        self.assertEqual(commands.processPoolsStats()['tasks'], tasks + 2)
+
     def testReNotEmptyString(self):
         self.assertError('re s//foo/g blah')
 
@@ -0,0 +1,48 @@
+"""Common setup for the benchmarks in this directory.
+
+Importing this module before any supybot module makes the bot use a
+throwaway configuration (in a temporary directory, with logging to stdout
+disabled), so benchmarks can be run from anywhere without creating conf/,
+data/, or logs/ directories.
+"""
+
+import os
+import time
+import atexit
+import shutil
+import tempfile
+
+baseDir = tempfile.mkdtemp(prefix='supybot-benchmark-')
+atexit.register(shutil.rmtree, baseDir, True)
+
+registryFilename = os.path.join(baseDir, 'benchmark.conf')
+with open(registryFilename, 'w') as fd:
+    fd.write("""
+supybot.directories.data: %(base_dir)s/data
+supybot.directories.conf: %(base_dir)s/conf
+supybot.directories.log: %(base_dir)s/logs
+supybot.log.stdout: False
+supybot.log.level: CRITICAL
+supybot.protocols.irc.throttleTime: 0
+supybot.networks.test.server: should.not.need.this
+supybot.nick: test
+""" % {'base_dir': baseDir})
+
+import supybot.registry as registry
+registry.open_registry(registryFilename)
+
+import supybot.conf as conf
+conf.supybot.flush.setValue(False)
+
+class timer(object):
+    """Context manager printing how long its body took to run."""
+    def __init__(self, label):
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.perf_counter() - self.start
+        print('%-50s %8.3fs' % (self.label, self.elapsed))
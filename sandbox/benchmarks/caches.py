@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""Replays hostmask-check traffic (messages from users with a skewed
+activity, checked against bans and registered hostmasks) through
+ircutils.hostmaskPatternEqual, using either the old clear-on-full CacheDict
+or LRUCache for its caches.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/caches.py [hostmasks] [checks]
+"""
+
+import sys
+import random
+
+from benchlib import timer
+
+import supybot.ircutils as ircutils
+import supybot.utils.structures as structures
+
+class CountingCacheDict(structures.CacheDict):
+    """CacheDict with the statistics of LRUCache."""
+    __slots__ = ('hits', 'misses')
+    def __init__(self, max):
+        structures.CacheDict.__init__(self, max)
+        self.hits = self.misses = 0
+
+    def __getitem__(self, key):
+        try:
+            value = structures.CacheDict.__getitem__(self, key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        return value
+
+def makeTraffic(hostmasks, checks):
+    """Returns a list of (pattern, hostmask) checks: each message is checked
+    against a few bans, and against the hostmasks registered by its
+    sender."""
+    bans = ['*!*@*.isp%s.example.net' % i for i in range(10)]
+    bans += ['spammer%s*!*@*' % i for i in range(10)]
+    users = [('nick%s!~user%s@host%s.isp%s.example.org' % (i, i, i, i % 50),
+              ['nick%s!*@*' % i, '*!~user%s@*.example.org' % i])
+             for i in range(hostmasks)]
+    # Few users send most of the messages.
+    weights = [1 / (i + 1) for i in range(hostmasks)]
+    traffic = []
+    for (sender, patterns) in random.choices(users, weights, k=checks):
+        for pattern in bans + patterns:
+            traffic.append((pattern, sender))
+    return traffic
+
+def replay(traffic):
+    for (pattern, hostmask) in traffic:
+        ircutils.hostmaskPatternEqual(pattern, hostmask)
+
+def main():
+    hostmasks = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    checks = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    random.seed(0)
+    traffic = makeTraffic(hostmasks, checks)
+    for cls in (CountingCacheDict, structures.LRUCache):
+        ircutils._patternCache = cls(1000)
+        ircutils._hostmaskPatternEqualCache = cls(1000)
+        with timer('%s, %s checks' % (cls.__name__, len(traffic))):
+            replay(traffic)
+        for name in ('_patternCache', '_hostmaskPatternEqualCache'):
+            cache = getattr(ircutils, name)
+            print('    %-30s %8d hits %8d misses' %
+                  (name, cache.hits, cache.misses))
+
+if __name__ == '__main__':
+    main()
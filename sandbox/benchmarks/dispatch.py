@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""Benchmarks Irc.feedMsg on a busy channel, with many plugins loaded, with
+and without the table of which plugins handle which commands.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/dispatch.py [capture file] [lines]
+
+The capture file contains one raw IRC line per line, as sent by the server
+(eg. a raw log of a connection).  If it is not given, synthetic lines are
+used instead.  At most [lines] lines are fed (default: 2000).
+
+Up to 50 of the plugins in plugins/ are loaded; those which can not be
+loaded here (eg. because of a missing dependency) are skipped.
+"""
+
+import os
+import sys
+
+from benchlib import timer
+
+import supybot.conf as conf
+import supybot.plugin as plugin
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+
+MAX_PLUGINS = 50
+
+def syntheticLines(n):
+    for i in range(n):
+        nick = 'nick%s' % (i % 200)
+        prefix = '%s!~user%s@host-%s.example.org' % (nick, i % 200, i % 97)
+        kind = i % 50
+        if kind == 0:
+            yield ':%s JOIN #channel' % prefix
+        elif kind == 1:
+            yield ':%s PART #channel :bye' % prefix
+        elif kind == 2:
+            yield ':%s NICK %s_' % (prefix, nick)
+        elif kind == 3:
+            yield ':%s MODE #channel +v %s' % (prefix, nick)
+        elif kind < 10:
+            yield ':%s NOTICE #channel :line number %s' % (prefix, i)
+        else:
+            yield ':%s PRIVMSG #channel :line number %s' % (prefix, i)
+
+def captureLines(filename, n):
+    with open(filename, errors='replace') as fd:
+        for (i, line) in enumerate(fd):
+            if i >= n:
+                break
+            line = line.rstrip('\r\n')
+            if line:
+                yield line
+
+def loadPlugins(irc):
+    directory = os.path.join(os.path.dirname(__file__), '..', '..', 'plugins')
+    conf.supybot.directories.plugins.setValue([directory])
+    loaded = []
+    for name in sorted(os.listdir(directory)):
+        if len(loaded) >= MAX_PLUGINS:
+            break
+        if not os.path.isfile(os.path.join(directory, name, 'plugin.py')):
+            continue
+        try:
+            module = plugin.loadPluginModule(name)
+            plugin.loadPluginClass(irc, module)
+        except Exception:
+            continue
+        loaded.append(name)
+    return loaded
+
+def feed(irc, msgs):
+    for msg in msgs:
+        irc.feedMsg(msg)
+        while irc.takeMsg():
+            pass
+
+class NoDispatchTable(irclib._DispatchTable):
+    """Calls all the callbacks on all the messages, like Irc.feedMsg did
+    before it used _DispatchTable."""
+    __slots__ = ()
+    def __init__(self, callbacks, version=None):
+        super(NoDispatchTable, self).__init__(callbacks, version)
+        self.inFilters = self.callbacks
+
+    @staticmethod
+    def _handlerNames(cb):
+        return None
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else None
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    if filename:
+        lines = list(captureLines(filename, n))
+    else:
+        lines = list(syntheticLines(n))
+    msgs = []
+    for line in lines:
+        try:
+            msgs.append(ircmsgs.IrcMsg(line))
+        except ircmsgs.MalformedIrcMsg:
+            pass
+
+    irc = irclib.Irc('test')
+    loaded = loadPlugins(irc)
+    print('%s plugins loaded, %s messages' % (len(loaded), len(msgs)))
+    irc.feedMsg(ircmsgs.IrcMsg(':test!test@host JOIN #channel'))
+
+    with timer('feedMsg, all callbacks'):
+        irclib._DispatchTable, original = NoDispatchTable, irclib._DispatchTable
+        irc._dispatchTable = None
+        try:
+            feed(irc, msgs)
+        finally:
+            irclib._DispatchTable = original
+            irc._dispatchTable = None
+    with timer('feedMsg, dispatch table'):
+        feed(irc, msgs)
+    table = irc._getDispatchTable()
+    for command in ('PRIVMSG', 'NOTICE', 'JOIN', 'MODE'):
+        print('%-8s %s callbacks of %s' % (command, len(table.get(command)),
+                                           len(table.callbacks)))
+    irc._reallyDie()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""Benchmarks looking up messages of a channel and/or of a nick in the
+history of a network, with irclib.History's indexes and by walking the
+whole history as plugins used to, and the cost of the indexes when
+appending messages.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/history.py [length] [lookups]
+
+Defaults to a history of 10000 messages in 50 channels from 500 nicks, and
+1000 lookups.
+"""
+
+import sys
+import random
+import tracemalloc
+
+from benchlib import timer
+
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+import supybot.ircutils as ircutils
+from supybot.utils.structures import RingBuffer
+
+def makeMsgs(n):
+    msgs = []
+    for i in range(n):
+        msg = ircmsgs.privmsg('#chan%s' % (i % 50), 'message %s' % i,
+                              prefix='nick%s!user@host' % (i * 7 % 500))
+        msg.channel = msg.args[0]
+        msgs.append(msg)
+    return msgs
+
+def oldSearch(history, channel, nick):
+    """Finds the last message of nick in channel, like plugins did before
+    History.search."""
+    for m in reversed(history):
+        if ircutils.strEqual(m.args[0], channel) and \
+                ircutils.nickEqual(m.nick, nick):
+            return m
+
+def newSearch(history, channel, nick):
+    for m in history.search(channel, nick):
+        return m
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    random.seed(0)
+    msgs = makeMsgs(n)
+    queries = [('#chan%s' % random.randrange(50),
+                'nick%s' % random.randrange(500)) for i in range(lookups)]
+    print('%s messages, %s lookups' % (n, lookups))
+    for (label, cls) in (('RingBuffer', RingBuffer),
+                         ('History', irclib.History)):
+        history = cls(n, msgs)
+        with timer('%s: append x %s' % (label, 3 * n)):
+            for i in range(3):
+                history.extend(msgs)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        history = cls(n, msgs)
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('%-50s %8.1fMB' % ('%s: memory (without the messages)' % label,
+                                 (after-before)/2**20))
+    with timer('scan the history x %s' % lookups):
+        old = [oldSearch(history, c, nick) for (c, nick) in queries]
+    with timer('History.search x %s' % lookups):
+        new = [newSearch(history, c, nick) for (c, nick) in queries]
+    assert old == new
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""Benchmarks ircdb.IgnoresDB.checkIgnored with many ignores, like after
+mass-ignoring spam bots.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/ignores.py [ignores] [lookups]
+"""
+
+import sys
+import time
+import random
+
+from benchlib import timer
+
+import supybot.ircdb as ircdb
+import supybot.ircutils as ircutils
+
+def makeIgnores(n):
+    ignores = ircdb.IgnoresDB()
+    now = time.time()
+    for i in range(n):
+        if i % 3 == 0:
+            hostmask = '*!*@spam%s.example.net' % i
+        elif i % 3 == 1:
+            hostmask = 'bot%s!*@*' % i
+        else:
+            hostmask = '*!~bot%s@192.0.%s.%s' % (i, i // 256 % 256, i % 256)
+        # Some of them expire during the benchmark.
+        expiration = now + random.randint(0, 3) if i % 10 == 0 else 0
+        ignores.add(hostmask, expiration)
+    return ignores
+
+def makePrefixes(n, lookups):
+    prefixes = []
+    for i in range(lookups):
+        j = random.randint(0, n)
+        if i % 4 == 0:
+            prefixes.append('nick%s!user@spam%s.example.net' % (i, j))
+        elif i % 4 == 1:
+            prefixes.append('bot%s!user@host%s' % (j, i))
+        else:
+            # Most messages are not from ignored users.
+            prefixes.append('nick%s!user%s@host%s.example.com' % (i, i, i))
+    return prefixes
+
+def linearCheckIgnored(ignores, prefix):
+    """checkIgnored without the index, as a baseline."""
+    for hostmask in ignores.hostmasks:
+        if ircutils.hostmaskPatternEqual(hostmask, prefix):
+            return True
+    return False
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    random.seed(0)
+    with timer('add %s ignores' % n):
+        ignores = makeIgnores(n)
+    prefixes = makePrefixes(n, lookups)
+    with timer('checkIgnored x %s' % lookups):
+        ignored = sum(map(ignores.checkIgnored, prefixes))
+    print('%s prefixes ignored, %s ignores left' %
+          (ignored, len(ignores.hostmasks)))
+    # This is way too slow to run on all the prefixes.
+    linear = min(lookups, 10)
+    with timer('linear scan x %s' % linear):
+        for prefix in prefixes[:linear]:
+            linearCheckIgnored(ignores, prefix)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""Benchmarks ircdb.UsersDictionary.getUserId on a large synthetic user
+database.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/ircdb.py [users] [lookups]
+"""
+
+import sys
+import random
+
+from benchlib import timer
+
+import supybot.ircdb as ircdb
+
+def makeUsers(n):
+    """Fills a UsersDictionary with n users, each with a mix of exact,
+    host-wildcard, nick-wildcard and IP range hostmasks."""
+    users = ircdb.UsersDictionary()
+    for id in range(1, n+1):
+        u = ircdb.IrcUser(name='user%s' % id)
+        u.id = id
+        u.addHostmask('user%s!ident%s@host%s.example.org' % (id, id, id))
+        if id % 2 == 0:
+            u.addHostmask('*!*@*.user%s.customer.example.net' % id)
+        if id % 3 == 0:
+            u.addHostmask('user%s|*!*@*' % id)
+        if id % 5 == 0:
+            u.addHostmask('*!ident%s@10.%s.%s.*' %
+                          (id, id // 256 % 256, id % 256))
+        # setUser() checks for collisions with all the other users, which
+        # would make this quadratic.
+        users.users[id] = u
+        users._hostmaskIndex.update(id, u)
+        users.nextId = id
+    return users
+
+def makeHostmasks(n, lookups):
+    hostmasks = []
+    for i in range(lookups):
+        id = random.randint(1, n)
+        kind = i % 5
+        if kind == 0:
+            hostmasks.append('user%s!ident%s@host%s.example.org' %
+                             (id, id, id))
+        elif kind == 1:
+            hostmasks.append('nick%s!foo@a%s.user%s.customer.example.net' %
+                             (i, i, id))
+        elif kind == 2:
+            hostmasks.append('user%s|away%s!foo@bar' % (id, i))
+        elif kind == 3:
+            hostmasks.append('nick%s!ident%s@10.%s.%s.%s' %
+                             (i, id, id // 256 % 256, id % 256, i % 256))
+        else:
+            # Unregistered users are the most common case in channels.
+            hostmasks.append('stranger%s!foo@unknown%s.example.com' % (i, i))
+    return hostmasks
+
+def lookup(getUserId, hostmasks):
+    found = 0
+    for hostmask in hostmasks:
+        try:
+            getUserId(hostmask)
+            found += 1
+        except KeyError:
+            pass
+    return found
+
+def linearGetUserId(users):
+    """getUserId without the index, as a baseline."""
+    def getUserId(hostmask):
+        ids = [id for (id, u) in users.users.items()
+               if u.checkHostmask(hostmask)]
+        if not ids:
+            raise KeyError(hostmask)
+        return ids[0]
+    return getUserId
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    random.seed(0)
+    with timer('build %s users' % n):
+        users = makeUsers(n)
+    hostmasks = makeHostmasks(n, lookups)
+    # Warm up the combined regexps, which are compiled lazily.
+    lookup(users.getUserId, hostmasks[:10])
+    with timer('getUserId x %s' % lookups):
+        found = lookup(users.getUserId, hostmasks)
+    print('%s hostmasks found' % found)
+    with timer('getUserId x %s (again, partly cached)' % lookups):
+        lookup(users.getUserId, hostmasks)
+    # This is way too slow to run on all the hostmasks.
+    linear = 3
+    with timer('linear scan x %s' % linear):
+        lookup(linearGetUserId(users), hostmasks[:linear])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+"""Benchmarks irclib.IrcMsgQueue by enqueuing and draining many messages.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/ircmsgqueue.py [number of messages]
+"""
+
+import sys
+
+from benchlib import timer
+
+import supybot.conf as conf
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+
+def makeMsgs(n):
+    msgs = []
+    for i in range(n):
+        if i % 10 == 0:
+            msgs.append(ircmsgs.voice('#channel', 'nick%s' % i))
+        else:
+            msgs.append(ircmsgs.privmsg('#channel', 'line %s' % i))
+    return msgs
+
+def bench(msgs, duplicates):
+    q = irclib.IrcMsgQueue()
+    with conf.supybot.protocols.irc.queuing.duplicates.context(duplicates):
+        with timer('enqueue (duplicates=%s)' % duplicates):
+            for msg in msgs:
+                q.enqueue(msg)
+        with timer('drain (duplicates=%s)' % duplicates):
+            while q:
+                q.dequeue()
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    msgs = makeMsgs(n)
+    print('%s messages' % n)
+    bench(msgs, False)
+    bench(msgs, True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""Benchmarks parsing raw lines into ircmsgs.IrcMsg objects, and the memory
+used by keeping them (like IrcState.history does).
+
+Usage: PYTHONPATH=. sandbox/benchmarks/ircmsgs.py [capture file] [lines]
+
+The capture file contains one raw IRC line per line, as sent by the server
+(eg. a raw log of a connection).  If it is not given, synthetic lines are
+used instead.  At most [lines] lines are parsed (default: 1000000).
+"""
+
+import sys
+import tracemalloc
+
+from benchlib import timer
+
+import supybot.ircmsgs as ircmsgs
+
+def syntheticLines(n):
+    for i in range(n):
+        nick = 'nick%s' % (i % 1000)
+        prefix = '%s!~user%s@host-%s.example.org' % (nick, i % 1000, i % 97)
+        if i % 5 == 0:
+            yield ('@time=2020-01-01T00:00:%02d.000Z;account=%s '
+                   ':%s PRIVMSG #channel%s :line number %s' %
+                   (i % 60, nick, prefix, i % 20, i))
+        elif i % 5 == 1:
+            yield ':%s JOIN #channel%s' % (prefix, i % 20)
+        else:
+            yield ':%s PRIVMSG #channel%s :line number %s' % \
+                (prefix, i % 20, i)
+
+def captureLines(filename, n):
+    with open(filename, errors='replace') as fd:
+        for (i, line) in enumerate(fd):
+            if i >= n:
+                break
+            line = line.rstrip('\r\n')
+            if line:
+                yield line
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else None
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+    if filename:
+        lines = list(captureLines(filename, n))
+    else:
+        lines = list(syntheticLines(n))
+    print('%s lines' % len(lines))
+
+    with timer('parse'):
+        for line in lines:
+            try:
+                ircmsgs.IrcMsg(line)
+            except ircmsgs.MalformedIrcMsg:
+                pass
+
+    with timer('parse and access nick/time/server_tags'):
+        for line in lines:
+            try:
+                msg = ircmsgs.IrcMsg(line)
+            except ircmsgs.MalformedIrcMsg:
+                continue
+            (msg.nick, msg.time, msg.server_tags)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    msgs = []
+    for line in lines:
+        try:
+            msgs.append(ircmsgs.IrcMsg(line))
+        except ircmsgs.MalformedIrcMsg:
+            pass
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('%-50s %8.1fMB (%d bytes/message)' % (
+        'memory of the parsed messages', (after-before)/2**20,
+        (after-before)/max(1, len(msgs))))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""Benchmarks the memory used by the ChannelStates of a network with large
+channels sharing many of their users, and the time to fill them, compared
+to when each channel had its own sets of nicks.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/ircstate.py [users] [channels]
+
+Defaults to 40000 users, each in 3 of 10 channels, a tenth of them voiced
+and a hundredth of them ops.
+
+Then times QUITs and NICKs on a network of 500 channels, each user being in
+3 of them, compared to when IrcState looked for the user in every channel.
+"""
+
+import sys
+import tracemalloc
+
+from benchlib import timer
+
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+import supybot.ircutils as ircutils
+
+class OldChannelState(object):
+    """The nicks of irclib.ChannelState, as they were stored before the
+    NickTable."""
+    def __init__(self, nickTable=None):
+        self.ops = ircutils.IrcSet()
+        self.users = ircutils.IrcSet()
+        self.voices = ircutils.IrcSet()
+        self.halfops = ircutils.IrcSet()
+
+    def addUser(self, user):
+        nick = user.lstrip('@%+')
+        if user[0] == '@':
+            self.ops.add(nick)
+        elif user[0] == '+':
+            self.voices.add(nick)
+        self.users.add(nick)
+
+def makeNames(users, channels):
+    names = [[] for i in range(channels)]
+    for i in range(users):
+        if i % 100 == 0:
+            prefix = '@'
+        elif i % 10 == 0:
+            prefix = '+'
+        else:
+            prefix = ''
+        for j in range(3):
+            names[(i + j * 3) % channels].append('%sUser%s' % (prefix, i))
+    return names
+
+def fill(cls, names):
+    table = irclib.NickTable()
+    channels = []
+    for L in names:
+        channel = cls(table)
+        for name in L:
+            channel.addUser(name)
+        channels.append(channel)
+    return channels
+
+class FakeIrc:
+    nick = 'bot'
+    prefix = 'bot!bot@bot'
+
+    def isChannel(self, s):
+        return ircutils.isChannel(s)
+
+def makeState(users, channels):
+    st = irclib.IrcState()
+    for j in range(channels):
+        st.channels['#chan%s' % j] = irclib.ChannelState()
+    for i in range(users):
+        for j in range(3):
+            st.channels['#chan%s' % ((i + j * 7) % channels)].addUser(
+                'User%s' % i)
+    return st
+
+def oldQuit(st, irc, msg):
+    """IrcState.doQuit, as it was before IrcState.channelsOf."""
+    channel_names = ircutils.IrcSet()
+    for (name, channel) in st.channels.items():
+        if msg.nick in channel.users:
+            channel_names.add(name)
+            channel.removeUser(msg.nick)
+    msg.tag('channels', channel_names)
+
+def oldNick(st, irc, msg):
+    """IrcState.doNick, as it was before IrcState.channelsOf."""
+    newNick = msg.args[0]
+    channel_names = ircutils.IrcSet()
+    for (name, channel) in st.channels.items():
+        if msg.nick in channel.users:
+            channel_names.add(name)
+        channel.replaceUser(msg.nick, newNick)
+    msg.tag('channels', channel_names)
+
+def benchQuitNick(users, channels=500):
+    irc = FakeIrc()
+    quits = [ircmsgs.quit(prefix='User%s!u@h' % i) for i in range(users)]
+    nicks = [ircmsgs.IrcMsg(prefix='User%s!u@h' % i, command='NICK',
+                            args=('Renamed%s' % i,)) for i in range(users)]
+    for (label, quit, nick) in (
+            ('old', oldQuit, oldNick),
+            ('new', irclib.IrcState.doQuit, irclib.IrcState.doNick)):
+        st = makeState(users, channels)
+        with timer('%s: NICK x %s' % (label, users)):
+            for msg in nicks:
+                nick(st, irc, msg)
+        st = makeState(users, channels)
+        with timer('%s: QUIT x %s' % (label, users)):
+            for msg in quits:
+                quit(st, irc, msg)
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 40000
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    names = makeNames(users, n)
+    print('%s users, %s channels' % (users, n))
+    for (label, cls) in (('old', OldChannelState),
+                         ('new', irclib.ChannelState)):
+        with timer('%s: fill the channels' % label):
+            fill(cls, names)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        channels = fill(cls, names)
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('%-50s %8.1fMB' % ('%s: memory of the channels' % label,
+                                 (after-before)/2**20))
+        with timer('%s: look up each nick in each channel' % label):
+            for channel in channels:
+                for i in range(users):
+                    'user%s' % i in channel.users
+        del channels
+    benchQuitNick(min(users, 5000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""Benchmarks searching a history of messages with a regexp in subprocesses,
+like Misc.last --regexp does: one subprocess call per message, or all of
+them at once with commands.regexp_filter.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/last.py [messages] [pool size]
+
+Defaults to 1000 messages (the default size of the history), none of which
+matches, and a pool of 2 processes.
+"""
+
+import re
+import sys
+
+from benchlib import timer
+
+import supybot.conf as conf
+import supybot.world as world
+import supybot.commands as commands
+
+def perMessage(texts, regexp):
+    """Misc.last, as it was before regexp_filter."""
+    for s in texts:
+        if commands.regexp_wrapper(s, reobj=regexp, timeout=0.1,
+                                   plugin_name='Bench', fcn_name='last'):
+            return s
+
+def batched(texts, regexp):
+    indexes = commands.regexp_filter(texts, [regexp], timeout=1,
+                                     plugin_name='Bench', fcn_name='last')
+    try:
+        for i in indexes:
+            return texts[i]
+    finally:
+        indexes.close()
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    world.disableMultiprocessing = False
+    texts = ['this is line number %s of a rather busy channel' % i
+             for i in range(n)]
+    regexp = re.compile(r'\b(\w+)\s+\1\b')
+    with conf.supybot.commands.process.poolSize.context(0):
+        with timer('fork for each message x %s' % n):
+            perMessage(texts, regexp)
+    with conf.supybot.commands.process.poolSize.context(size):
+        with timer('pool of %s, call for each message x %s' % (size, n)):
+            perMessage(texts, regexp)
+        with timer('pool of %s, one call for %s messages' % (size, n)):
+            batched(texts, regexp)
+
+if __name__ == '__main__':
+    main()
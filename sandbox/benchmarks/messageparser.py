@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+"""Benchmarks MessageParser on a channel with many triggers, with and
+without its cache of compiled triggers.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/messageparser.py [triggers] [messages]
+
+Defaults to 300 triggers and 5000 messages, one in a hundred of which
+triggers an action.
+"""
+
+import re
+import os
+import sys
+import types
+
+from benchlib import timer
+
+import supybot.conf as conf
+import supybot.plugin as plugin
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+import supybot.plugins as plugins
+
+def loadPlugins(irc):
+    directory = os.path.join(os.path.dirname(__file__), '..', '..', 'plugins')
+    conf.supybot.directories.plugins.setValue([directory])
+    cbs = []
+    for name in ('MessageParser', 'Utilities'):
+        module = plugin.loadPluginModule(name)
+        cbs.append(plugin.loadPluginClass(irc, module))
+    return cbs[0]
+
+def addTriggers(cb, channel, n):
+    db = cb.getDb(channel)
+    cursor = db.cursor()
+    cursor.execute("BEGIN")
+    cursor.executemany("""INSERT INTO triggers VALUES
+                          (NULL, ?, 'bench', 0, 0, ?, 0)""",
+                       [(r'\bkeyword%s\b' % i, 'echo trigger %s' % i)
+                        for i in range(n)])
+    db.commit()
+
+def makeMsgs(n, triggers):
+    msgs = []
+    for i in range(n):
+        if i % 100 == 0:
+            s = 'talking about keyword%s here' % (i % triggers)
+        else:
+            s = 'this is line number %s of a rather busy channel' % i
+        msgs.append(ircmsgs.privmsg('#channel', s,
+                                    prefix='nick%s!user@host' % (i % 50)))
+    return msgs
+
+def oldDoPrivmsgNotice(self, irc, msg):
+    """MessageParser.do_privmsg_notice, as it was before the triggers were
+    cached: they were read from the databases for each message, and usage
+    counts were written to them on each match."""
+    channel = msg.channel
+    if not channel:
+        return
+    if self.registryValue('enable', channel, irc.network):
+        actions = []
+        results = []
+        for channel in set(map(plugins.getChannel, (channel, 'global'))):
+            db = self.getDb(channel)
+            cursor = db.cursor()
+            cursor.execute("SELECT regexp, action FROM triggers")
+            results.extend([(channel,)+x for x in cursor.fetchall()])
+        if len(results) == 0:
+            return
+        for (channel, regexp, action) in results:
+            for match in re.finditer(regexp, msg.args[1]):
+                if match is not None:
+                    db = self.getDb(channel)
+                    cursor = db.cursor()
+                    cursor.execute("""SELECT usage_count FROM triggers
+                                      WHERE regexp=?""", (regexp,))
+                    old_count = cursor.fetchall()[0][0]
+                    cursor.execute("""UPDATE triggers SET usage_count=?
+                                      WHERE regexp=?""",
+                                   (old_count + 1, regexp,))
+                    db.commit()
+                    actions.append(action)
+        for action in actions:
+            self._runCommandFunction(irc, msg, action)
+
+def feed(irc, msgs):
+    for msg in msgs:
+        irc.feedMsg(msg)
+        while irc.takeMsg():
+            pass
+
+def main():
+    triggers = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    conf.registerNetwork('test')
+    irc = irclib.Irc('test')
+    cb = loadPlugins(irc)
+    addTriggers(cb, '#channel', triggers)
+    msgs = makeMsgs(n, triggers)
+    print('%s triggers, %s messages' % (triggers, n))
+    newDoPrivmsgNotice = cb.do_privmsg_notice
+    cb.do_privmsg_notice = types.MethodType(oldDoPrivmsgNotice, cb)
+    with timer('triggers read for each message'):
+        feed(irc, msgs)
+    cb.do_privmsg_notice = newDoPrivmsgNotice
+    with timer('cached triggers'):
+        feed(irc, msgs)
+    with timer('flush usage counts'):
+        cb._flushRanks()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""Benchmarks running the regexps of the PluginRegexp plugins (snarfers,
+CTCP handlers, ...) on channel messages, with and without the shared
+prefilter.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/pluginregexp.py [capture file] [lines]
+
+The capture file contains one raw IRC line per line, as sent by the server
+(eg. a raw log of a connection); only its PRIVMSGs are used.  If it is not
+given, synthetic messages are used instead.  At most [lines] lines are read
+(default: 100000).
+
+The plugins use their default configuration, so most of the methods
+triggered by the regexps do nothing (eg. snarfers are disabled).
+"""
+
+import os
+import sys
+
+from benchlib import timer
+
+import supybot.conf as conf
+import supybot.plugin as plugin
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+import supybot.callbacks as callbacks
+
+PLUGINS = ('Ctcp', 'Fediverse', 'Google', 'SedRegex', 'ShrinkUrl', 'Web')
+
+def syntheticTexts(n):
+    for i in range(n):
+        if i % 100 == 0:
+            yield 'have a look at https://example.org/page/%s' % i
+        elif i % 100 == 1:
+            yield '\x01VERSION\x01'
+        elif i % 100 == 2:
+            yield 's/line/row/'
+        else:
+            yield 'this is line number %s of a rather busy channel' % i
+
+def captureTexts(filename, n):
+    with open(filename, errors='replace') as fd:
+        for (i, line) in enumerate(fd):
+            if i >= n:
+                break
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            try:
+                msg = ircmsgs.IrcMsg(line)
+            except ircmsgs.MalformedIrcMsg:
+                continue
+            if msg.command == 'PRIVMSG' and len(msg.args) == 2:
+                yield msg.args[1]
+
+def loadPlugins(irc):
+    directory = os.path.join(os.path.dirname(__file__), '..', '..', 'plugins')
+    conf.supybot.directories.plugins.setValue([directory])
+    cbs = []
+    for name in PLUGINS:
+        try:
+            module = plugin.loadPluginModule(name)
+            cbs.append(plugin.loadPluginClass(irc, module))
+        except Exception:
+            continue
+    return cbs
+
+def oldDoPrivmsg(self, irc, msg):
+    """PluginRegexp.doPrivmsg, as it was before RegexpPrefilter."""
+    if msg.isError:
+        return
+    proxy = self.Proxy(irc, msg)
+    if not msg.addressed:
+        for (r, name) in self.unaddressedRes:
+            for m in r.finditer(msg.args[1]):
+                self._callRegexp(name, proxy, msg, m)
+    for (r, name) in self.res:
+        for m in r.finditer(msg.args[1]):
+            self._callRegexp(name, proxy, msg, m)
+
+def feed(irc, cbs, msgs, doPrivmsg):
+    for msg in msgs:
+        for cb in cbs:
+            doPrivmsg(cb, irc, msg)
+        while irc.takeMsg():
+            pass
+
+def main():
+    filename = sys.argv[1] if len(sys.argv) > 1 else None
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    if filename:
+        texts = list(captureTexts(filename, n))
+    else:
+        texts = list(syntheticTexts(n))
+    conf.registerNetwork('test')
+    irc = irclib.Irc('test')
+    cbs = [cb for cb in loadPlugins(irc)
+           if isinstance(cb, callbacks.PluginRegexp)]
+    print('%s messages, plugins: %s' %
+          (len(texts), ', '.join(cb.name() for cb in cbs)))
+    msgs = [ircmsgs.privmsg('#channel', s, prefix='nick!user@host')
+            for s in texts]
+    with timer('without prefilter'):
+        feed(irc, cbs, msgs, oldDoPrivmsg)
+    with timer('with prefilter'):
+        feed(irc, cbs, msgs, callbacks.PluginRegexp.doPrivmsg)
+    print(callbacks.regexpPrefilter.stats())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+"""Benchmarks commands.process (through regexp_wrapper, as used to run
+regexps given by users), with and without the pool of processes.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/process.py [calls] [threads]
+
+Defaults to 500 calls, made from 4 threads at once.
+"""
+
+import re
+import sys
+import threading
+
+from benchlib import timer
+
+import supybot.conf as conf
+import supybot.world as world
+import supybot.commands as commands
+
+def call(n):
+    regexp = re.compile(r'(\w+)\s+\1')
+    for i in range(n):
+        commands.regexp_wrapper('some text text %s' % i, regexp, timeout=5,
+                                plugin_name='Bench', fcn_name='bench')
+
+def run(calls, threads):
+    L = [threading.Thread(target=call, args=(calls // threads,))
+         for i in range(threads)]
+    for t in L:
+        t.start()
+    for t in L:
+        t.join()
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    world.disableMultiprocessing = False
+    with conf.supybot.commands.process.poolSize.context(0):
+        with timer('fork for each call x %s' % calls):
+            run(calls, threads)
+    for size in (1, 2, 4):
+        with conf.supybot.commands.process.poolSize.context(size):
+            with timer('pool of %s x %s' % (size, calls)):
+                run(calls, threads)
+    print(commands.processPoolsStats())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""Benchmarks the lookups of network- and channel-specific configuration
+values, as done by plugins on each message.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/registry.py [networks] [lookups]
+"""
+
+import sys
+
+from benchlib import timer
+
+import supybot.conf as conf
+import supybot.world as world
+import supybot.irclib as irclib
+import supybot.callbacks as callbacks
+
+class Bench(callbacks.Plugin):
+    pass
+
+conf.registerPlugin('Bench')
+conf.registerChannelValue(conf.supybot.plugins.Bench, 'enable',
+    conf.registry.Boolean(True, ''))
+conf.registerGroup(conf.supybot.plugins.Bench, 'nested')
+conf.registerChannelValue(conf.supybot.plugins.Bench.nested, 'format',
+    conf.registry.String('$nick', ''))
+
+def main():
+    networks = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    lookups = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    ircs = []
+    for i in range(networks):
+        conf.registerNetwork('network%s' % i)
+        ircs.append(irclib.Irc('network%s' % i))
+    cb = Bench(ircs[0])
+    network = ircs[-1].network
+    # Some channels have a specific value.
+    conf.supybot.plugins.Bench.enable.get('#channel0').setValue(False)
+    conf.supybot.plugins.Bench.nested.format.get(':' + network) \
+        .get('#channel1').setValue('<$nick>')
+    channels = ['#channel%s' % (i % 10) for i in range(lookups)]
+
+    with timer('world.getIrc x %s' % lookups):
+        for channel in channels:
+            world.getIrc(network)
+    with timer('getSpecific x %s' % lookups):
+        value = conf.supybot.reply.whenAddressedBy.strings
+        for channel in channels:
+            value.getSpecific(network, channel)()
+    with timer('conf.get x %s' % lookups):
+        value = conf.supybot.reply.whenAddressedBy.strings
+        for channel in channels:
+            conf.get(value, channel=channel, network=network)
+    with timer('registryValue x %s' % lookups):
+        for channel in channels:
+            cb.registryValue('enable', channel, network)
+    with timer('registryValue (nested) x %s' % lookups):
+        for channel in channels:
+            cb.registryValue('nested.format', channel, network)
+
+    for irc in ircs:
+        irc._reallyDie()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+"""Benchmarks adding, rescheduling, removing and running many events with
+schedule.Schedule, compared to how it was before removed events were
+left in the heap.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/schedule.py [events] [operations]
+
+Defaults to 20000 pending events, and 5000 of each operation.
+
+Then, it measures how late short events are run when a slow event (like
+the upkeep) is run just before them, depending on its executor.
+"""
+
+import sys
+import time
+import heapq
+import random
+
+from benchlib import timer
+
+import supybot.world as world
+import supybot.schedule as schedule
+
+class mytuple(tuple):
+    def __lt__(self, other):
+        return self[0] < other[0]
+
+class OldSchedule(schedule.Schedule):
+    """The heap-related methods of Schedule, as they were before."""
+    def name(self):
+        return 'OldSchedule'
+
+    def addEvent(self, f, t, name=None, args=[], kwargs={}):
+        if name is None:
+            name = self.counter
+            self.counter += 1
+        assert name not in self.events, \
+               'An event with the same name has already been scheduled.'
+        with self.lock:
+            self.events[name] = f
+            heapq.heappush(self.schedule, mytuple((t, name, args, kwargs)))
+        return name
+
+    def removeEvent(self, name):
+        f = self.events.pop(name)
+        with self.lock:
+            self.schedule = [x for x in self.schedule if x[1] != name]
+            heapq.heapify(self.schedule)
+        return f
+
+    def rescheduleEvent(self, name, t):
+        f = self.removeEvent(name)
+        self.addEvent(f, t, name=name)
+
+    def run(self):
+        while self.schedule and self.schedule[0][0] < time.time():
+            with self.lock:
+                (t, name, args, kwargs) = heapq.heappop(self.schedule)
+                f = self.events.pop(name)
+            f(*args, **kwargs)
+
+class NewSchedule(schedule.Schedule):
+    def name(self):
+        return 'NewSchedule'
+
+def bench(label, sched, n, ops):
+    now = time.time()
+    random.seed(0)
+    with timer('%s: add %s' % (label, n)):
+        names = [sched.addEvent(lambda: None, now + random.uniform(1, 3600))
+                 for i in range(n)]
+    with timer('%s: reschedule %s' % (label, ops)):
+        for name in random.sample(names, ops):
+            sched.rescheduleEvent(name, now + random.uniform(1, 3600))
+    with timer('%s: remove %s' % (label, ops)):
+        for name in random.sample(names, ops):
+            sched.removeEvent(name)
+    with timer('%s: run due events' % label):
+        world.testing = True
+        realTime = time.time
+        time.time = lambda: now + 1800
+        try:
+            sched.run()
+        finally:
+            time.time = realTime
+
+def benchExecutor(executor):
+    world.testing = True
+    sched = NewSchedule()
+    now = time.time()
+    sched.addEvent(time.sleep, now, args=[0.5], executor=executor)
+    for i in range(100):
+        sched.addEvent(lambda: None, now + i / 1000, name='short%s' % i)
+    while sched.nextEventTime() is not None:
+        sched.run()
+        time.sleep(0.001)
+    lateness = max(stats['maxLateness']
+                   for (label, stats) in sched.eventStats().items()
+                   if label.endswith('<lambda>'))
+    print('%-50s %8.3fs' % ('short events late by, slow event %s' % executor,
+                            lateness))
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    ops = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    bench('old', OldSchedule(), n, ops)
+    bench('new', NewSchedule(), n, ops)
+    for executor in ('inline', 'thread'):
+        benchExecutor(executor)
+
+if __name__ == '__main__':
+    main()
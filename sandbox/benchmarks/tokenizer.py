@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+"""Benchmarks callbacks.tokenize, and the Tokenizer it uses, against the
+shlex-based tokenizer.
+
+Usage: PYTHONPATH=. sandbox/benchmarks/tokenizer.py [iterations]
+"""
+
+import sys
+
+from benchlib import timer
+
+import supybot.callbacks as callbacks
+
+COMMANDS = [
+    'echo foo',
+    'ping',
+    'config supybot.reply.whenAddressedBy.chars',
+    'echo [time] [seconds 1d 2h] "quoted \\"string\\"" it\'s',
+    'rss announce add #channel https://example.org/feed.xml',
+    'cif [nceq [echo $nick] foo] "echo yes" "echo no"',
+    'messageparser add "^hello (.*)$" "echo Hi $1, have a nice day!"',
+    'echo %s' % ' '.join('word%s' % i for i in range(50)),
+    'echo "%s"' % ('\\x02bold\\x02 \\u597d ' * 10),
+]
+
+def run(tokenizer, n):
+    for i in range(n):
+        for command in COMMANDS:
+            tokenizer.tokenize(command)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    total = n * len(COMMANDS)
+    with timer('ShlexTokenizer x %s' % total):
+        run(callbacks.ShlexTokenizer(brackets='[]', quotes='"'), n)
+    with timer('Tokenizer x %s' % total):
+        run(callbacks.Tokenizer(brackets='[]', quotes='"'), n)
+    with timer('Tokenizer (new instance each time) x %s' % total):
+        for i in range(n):
+            for command in COMMANDS:
+                callbacks.Tokenizer(brackets='[]', quotes='"') \
+                    .tokenize(command)
+    with timer('callbacks.tokenize (not cached) x %s' % total):
+        for i in range(n):
+            for command in COMMANDS:
+                callbacks._tokenizeCache.clear()
+                callbacks.tokenize(command)
+    # Most of what is left is reading the configuration.
+    with timer('callbacks.tokenize (cached) x %s' % total):
+        for i in range(n):
+            for command in COMMANDS:
+                callbacks.tokenize(command)
+    print(callbacks._tokenizeCache.stats())
+
+if __name__ == '__main__':
+    main()
@@ -228,6 +228,7 @@ setup(
              'scripts/supybot-wizard',
              'scripts/supybot-adduser',
              'scripts/supybot-reset-password',
+             'scripts/supybot-migrate-ircdb',
              'scripts/supybot-plugin-doc',
              'scripts/supybot-plugin-create',
              ],
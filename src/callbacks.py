@@ -34,16 +34,21 @@ This module contains the basic callbacks for handling PRIVMSGs.
 """
 
 import re
+import sys
 import copy
 import time
 from . import shlex
 import codecs
 import getopt
 import inspect
+import functools
 import warnings
+import threading
+import collections
+import collections.abc
 
-from . import (conf, ircdb, irclib, ircmsgs, ircutils, log, registry,
-        utils, world)
+from . import (conf, drivers, ircdb, irclib, ircmsgs, ircutils, log,
+        registry, utils, world)
 from .utils import minisix
 from .utils.iter import any, all
 from .i18n import PluginInternationalization
@@ -181,78 +186,100 @@ def reply(*args, **kwargs):
                   DeprecationWarning)
     return _makeReply(dynamic.irc, *args, **kwargs)
 
-def _makeReply(irc, msg, s,
-              prefixNick=None, private=None,
-              notice=None, to=None, action=None, error=False,
-              stripCtcp=True):
-    msg.tag('repliedTo')
-    # Ok, let's make the target:
-    # XXX This isn't entirely right.  Consider to=#foo, private=True.
-    target = ircutils.replyTo(msg)
-    def isPublic(s):
-        return irc.isChannel(irc.stripChannelPrefix(s))
-    if to is not None and isPublic(to):
-        target = to
-    if isPublic(target):
-        channel = irc.stripChannelPrefix(target)
-    else:
-        channel = None
-    if notice is None:
-        notice = conf.get(conf.supybot.reply.withNotice,
-            channel=channel, network=irc.network)
-    if private is None:
-        private = conf.get(conf.supybot.reply.inPrivate,
-            channel=channel, network=irc.network)
-    if prefixNick is None:
-        prefixNick = conf.get(conf.supybot.reply.withNickPrefix,
-            channel=channel, network=irc.network)
-    if error:
-        notice =conf.get(conf.supybot.reply.error.withNotice,
-            channel=channel, network=irc.network) or notice
-        private=conf.get(conf.supybot.reply.error.inPrivate,
-            channel=channel, network=irc.network) or private
-        s = _('Error: ') + s
-    if private:
-        prefixNick = False
-        if to is None:
-            target = msg.nick
-        else:
+class _ReplyMaker(object):
+    """Makes replies to a message with the given options (see
+    _makeReply), without keeping a reference to the message or the Irc
+    object; so the replies can be made later, eg. by the 'more' command."""
+    __slots__ = ('msgmaker', 'target', 'prefix', 'error', 'action',
+                 'stripCtcp', 'replyTo')
+    def __init__(self, irc, msg,
+                 prefixNick=None, private=None,
+                 notice=None, to=None, action=None, error=False,
+                 stripCtcp=True):
+        # Ok, let's make the target:
+        # XXX This isn't entirely right.  Consider to=#foo, private=True.
+        target = ircutils.replyTo(msg)
+        def isPublic(s):
+            return irc.isChannel(irc.stripChannelPrefix(s))
+        if to is not None and isPublic(to):
             target = to
-    if action:
-        prefixNick = False
-    if to is None:
-        to = msg.nick
-    if stripCtcp:
-        s = s.strip('\x01')
-    # Ok, now let's make the payload:
-    s = ircutils.safeArgument(s)
-    if not s and not action:
-        s = _('Error: I tried to send you an empty message.')
-    if prefixNick and isPublic(target):
-        # Let's may sure we don't do, "#channel: foo.".
-        if not isPublic(to):
-            s = '%s: %s' % (to, s)
-    if not isPublic(target):
-        if conf.supybot.reply.withNoticeWhenPrivate():
-            notice = True
-    # And now, let's decide whether it's a PRIVMSG or a NOTICE.
-    msgmaker = ircmsgs.privmsg
-    if notice:
-        msgmaker = ircmsgs.notice
-    # We don't use elif here because actions can't be sent as NOTICEs.
-    if action:
-        msgmaker = ircmsgs.action
-    # Finally, we'll return the actual message.
-    ret = msgmaker(target, s)
+        if isPublic(target):
+            channel = irc.stripChannelPrefix(target)
+        else:
+            channel = None
+        if notice is None:
+            notice = conf.get(conf.supybot.reply.withNotice,
+                channel=channel, network=irc.network)
+        if private is None:
+            private = conf.get(conf.supybot.reply.inPrivate,
+                channel=channel, network=irc.network)
+        if prefixNick is None:
+            prefixNick = conf.get(conf.supybot.reply.withNickPrefix,
+                channel=channel, network=irc.network)
+        if error:
+            notice =conf.get(conf.supybot.reply.error.withNotice,
+                channel=channel, network=irc.network) or notice
+            private=conf.get(conf.supybot.reply.error.inPrivate,
+                channel=channel, network=irc.network) or private
+        if private:
+            prefixNick = False
+            if to is None:
+                target = msg.nick
+            else:
+                target = to
+        if action:
+            prefixNick = False
+        if to is None:
+            to = msg.nick
+        self.prefix = ''
+        if prefixNick and isPublic(target):
+            # Let's may sure we don't do, "#channel: foo.".
+            if not isPublic(to):
+                self.prefix = '%s: ' % to
+        if not isPublic(target):
+            if conf.supybot.reply.withNoticeWhenPrivate():
+                notice = True
+        # And now, let's decide whether it's a PRIVMSG or a NOTICE.
+        self.msgmaker = ircmsgs.privmsg
+        if notice:
+            self.msgmaker = ircmsgs.notice
+        # We don't use elif here because actions can't be sent as NOTICEs.
+        if action:
+            self.msgmaker = ircmsgs.action
+        self.target = target
+        self.error = error
+        self.action = action
+        self.stripCtcp = stripCtcp
+        self.replyTo = None
+        if 'msgid' in msg.server_tags \
+                and conf.supybot.protocols.irc.experimentalExtensions() \
+                and 'message-tags' in irc.state.capabilities_ack:
+            # In theory, msgid being in server_tags implies message-tags was
+            # negotiated, but the +reply spec requires it explicitly. Plus,
+            # there's no harm in doing this extra check, in case a plugin is
+            # replying across network (as it may happen with
+            # '@network command').
+            self.replyTo = msg.server_tags['msgid']
+
+    def __call__(self, s):
+        if self.error:
+            s = _('Error: ') + s
+        if self.stripCtcp:
+            s = s.strip('\x01')
+        # Ok, now let's make the payload:
+        s = ircutils.safeArgument(s)
+        if not s and not self.action:
+            s = _('Error: I tried to send you an empty message.')
+        # Finally, we'll return the actual message.
+        ret = self.msgmaker(self.target, self.prefix + s)
+        if self.replyTo is not None:
+            ret.server_tags['+draft/reply'] = self.replyTo
+        return ret
+
+def _makeReply(irc, msg, s, **kwargs):
+    msg.tag('repliedTo')
+    ret = _ReplyMaker(irc, msg, **kwargs)(s)
     ret.tag('inReplyTo', msg)
-    if 'msgid' in msg.server_tags \
-            and conf.supybot.protocols.irc.experimentalExtensions() \
-            and 'message-tags' in irc.state.capabilities_ack:
-        # In theory, msgid being in server_tags implies message-tags was
-        # negotiated, but the +reply spec requires it explicitly. Plus, there's
-        # no harm in doing this extra check, in case a plugin is replying
-        # across network (as it may happen with '@network command').
-        ret.server_tags['+draft/reply'] = msg.server_tags['msgid']
     return ret
 
 def error(*args, **kwargs):
@@ -303,7 +330,31 @@ class SilentError(Error):
     """An error that we should not notify the user."""
     pass
 
-class Tokenizer(object):
+def _unescapeToken(token):
+    # FIXME: No need to tell you this is a hack.
+    # It has to handle both IRC commands and serialized configuration.
+    #
+    # Whoever you are, if you make a single modification to this
+    # code, TEST the code with Python 2 & 3, both with the unit
+    # tests and on IRC with this: @echo "好"
+    if minisix.PY2:
+        try:
+            token = token.encode('utf8').decode('string_escape')
+            token = token.decode('utf8')
+        except:
+            token = token.decode('string_escape')
+    else:
+        token = codecs.getencoder('utf8')(token)[0]
+        token = codecs.getdecoder('unicode_escape')(token)[0]
+        try:
+            token = token.encode('iso-8859-1').decode()
+        except: # Prevent issue with tokens like '"\\x80"'.
+            pass
+    return token
+
+class ShlexTokenizer(object):
+    """The original tokenizer, based on supybot.shlex.  Tokenizer returns
+    the same results much faster; this one is kept as a reference."""
     # This will be used as a global environment to evaluate strings in.
     # Evaluation is, of course, necessary in order to allow escaped
     # characters to be properly handled.
@@ -328,26 +379,7 @@ class Tokenizer(object):
 
     def _handleToken(self, token):
         if token[0] == token[-1] and token[0] in self.quotes:
-            token = token[1:-1]
-            # FIXME: No need to tell you this is a hack.
-            # It has to handle both IRC commands and serialized configuration.
-            #
-            # Whoever you are, if you make a single modification to this
-            # code, TEST the code with Python 2 & 3, both with the unit
-            # tests and on IRC with this: @echo "好"
-            if minisix.PY2:
-                try:
-                    token = token.encode('utf8').decode('string_escape')
-                    token = token.decode('utf8')
-                except:
-                    token = token.decode('string_escape')
-            else:
-                token = codecs.getencoder('utf8')(token)[0]
-                token = codecs.getdecoder('unicode_escape')(token)[0]
-                try:
-                    token = token.encode('iso-8859-1').decode()
-                except: # Prevent issue with tokens like '"\\x80"'.
-                    pass
+            token = _unescapeToken(token[1:-1])
         return token
 
     def _insideBrackets(self, lexer):
@@ -409,6 +441,117 @@ class Tokenizer(object):
                 args[-1].append(ends.pop())
         return args
 
+class Tokenizer(object):
+    """Splits a command into its arguments, with nested commands (between
+    brackets, or before a pipe) as lists.
+
+    This gives the same results as ShlexTokenizer, but reads the whole string
+    with a single regular expression, compiled once for each set of brackets,
+    pipe, and quotes."""
+    _whitespace = ' \t\r\n'
+    # Separators that are not whitespace are tokens by themselves.
+    separators = '\x00' + _whitespace
+    _regexps = {}
+    def __init__(self, brackets='', pipe=False, quotes='"'):
+        if brackets:
+            self.separators += brackets
+            self.left = brackets[0]
+            self.right = brackets[1]
+        else:
+            self.left = ''
+            self.right = ''
+        self.pipe = pipe
+        if self.pipe:
+            self.separators += '|'
+        self.quotes = quotes
+        self.separators += quotes
+        key = (self.separators, quotes)
+        try:
+            self._regexp = self._regexps[key]
+        except KeyError:
+            self._regexp = self._regexps[key] = self._compile()
+
+    def _compile(self):
+        def charClass(chars):
+            return '[^%s]' % ''.join(map(re.escape, chars))
+        # Like with shlex: words start with any character that is not a
+        # separator, and go on until the next separator which is not a
+        # quote.  Quoted strings go on until the next unescaped quote, and
+        # anything else is a token of its own.
+        word = charClass(self.separators) + \
+            charClass([c for c in self.separators if c not in self.quotes]) + \
+            '*'
+        quoted = '|'.join('%(q)s(?:[^%(q)s\\\\]|\\\\.)*%(q)s' %
+                          {'q': re.escape(q)} for q in self.quotes)
+        return re.compile(r'[%s]*(?:(%s)|(%s)|(%s))' % (
+            re.escape(self._whitespace), word, quoted or '(?!)',
+            charClass(self._whitespace)), re.DOTALL)
+
+    def tokenize(self, s):
+        quotes = self.quotes
+        left = self.left
+        right = self.right
+        pipe = self.pipe
+        args = []
+        ends = []
+        # The lists of arguments of the nested commands we are in.
+        stack = []
+        for (word, quoted, other) in self._regexp.findall(s):
+            if word:
+                args.append(word)
+            elif quoted:
+                quoted = quoted[1:-1]
+                if '\\' in quoted:
+                    quoted = _unescapeToken(quoted)
+                args.append(quoted)
+            elif other in quotes:
+                raise ValueError('No closing quotation')
+            elif other == '|' and pipe and not stack:
+                if not args:
+                    raise SyntaxError(_('"|" with nothing preceding.  I '
+                                        'obviously can\'t do a pipe with '
+                                        'nothing before the |.'))
+                ends.append(args)
+                args = []
+            elif other == left:
+                stack.append(args)
+                nested = []
+                args.append(nested)
+                args = nested
+            elif other == right:
+                if not stack:
+                    raise SyntaxError(_('Spurious "%s".  You may want to '
+                                        'quote your arguments with double '
+                                        'quotes in order to prevent extra '
+                                        'brackets from being evaluated '
+                                        'as nested commands.') % right)
+                args = stack.pop()
+            else:
+                args.append(other)
+        if stack:
+            raise SyntaxError(_('Missing "%s".  You may want to '
+                                'quote your arguments with double '
+                                'quotes in order to prevent extra '
+                                'brackets from being evaluated '
+                                'as nested commands.') % right)
+        if ends:
+            if not args:
+                raise SyntaxError(_('"|" with nothing following.  I '
+                                    'obviously can\'t do a pipe with '
+                                    'nothing after the |.'))
+            args.append(ends.pop())
+            while ends:
+                args[-1].append(ends.pop())
+        return args
+
+def _copyTokens(tokens):
+    return [_copyTokens(token) if isinstance(token, list) else token
+            for token in tokens]
+
+# Messages are often tokenized several times (eg. by MessageParser, or when
+# they call an alias), so the results for the most common ones are kept.
+_tokenizeCache = utils.structures.LRUCache(1000)
+
 def tokenize(s, channel=None, network=None):
     """A utility function to create a Tokenizer and tokenize a string."""
     pipe = False
@@ -420,11 +563,18 @@ def tokenize(s, channel=None, network=None):
                 channel=channel, network=network): # No nesting, no pipe.
             pipe = True
     quotes = conf.supybot.commands.quotes.getSpecific(network, channel)()
+    key = (s, brackets, pipe, quotes)
     try:
-        ret = Tokenizer(brackets=brackets,pipe=pipe,quotes=quotes).tokenize(s)
-        return ret
-    except ValueError as e:
-        raise SyntaxError(str(e))
+        ret = _tokenizeCache[key]
+    except KeyError:
+        try:
+            ret = Tokenizer(brackets=brackets,pipe=pipe,quotes=quotes) \
+                .tokenize(s)
+        except ValueError as e:
+            raise SyntaxError(str(e))
+        _tokenizeCache[key] = ret
+    # Callers are free to modify the lists they get.
+    return _copyTokens(ret)
 
 def formatCommand(command):
     return ' '.join(command)
@@ -666,9 +816,96 @@ class ReplyIrcProxy(RichReplyMethods):
 
 SimpleProxy = ReplyIrcProxy # Backwards-compatibility
 
+class MoreReplies(object):
+    """The chunks of a reply which were not sent yet, for the 'more'
+    command.  They are stored as strings, and made into messages only when
+    they are requested; those are tagged with inReplyTo, the message they
+    reply to, like the replies sent immediately."""
+    __slots__ = ('maker', 'chunks', 'private', 'inReplyTo', 'time')
+    def __init__(self, maker, chunks, private, inReplyTo=None):
+        self.maker = maker
+        self.chunks = chunks # Used as a stack, the next chunk is the last.
+        self.private = private
+        self.inReplyTo = inReplyTo
+        self.time = time.time()
+
+    def copy(self):
+        return self.__class__(self.maker, self.chunks[:], self.private,
+                              self.inReplyTo)
+
+    def pop(self, number):
+        """Returns the messages of the next number chunks, and removes
+        them."""
+        chunks = self.chunks[-number:]
+        del self.chunks[-number:]
+        msgs = [self.maker(chunk) for chunk in reversed(chunks)]
+        if self.inReplyTo is not None:
+            for msg in msgs:
+                msg.tag('inReplyTo', self.inReplyTo)
+        return msgs
+
+    def memoryUsage(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.chunks) + \
+            sum(map(sys.getsizeof, self.chunks))
+
+class MoresStore(collections.abc.MutableMapping):
+    """Stores MoreReplies by user hostmask (without the nick) and by nick.
+
+    It holds at most supybot.reply.mores.maximumStored items, dropping the
+    oldest ones first, and items expire after supybot.reply.mores.timeout
+    seconds."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = collections.OrderedDict()
+
+    def _expire(self):
+        maximum = conf.supybot.reply.mores.maximumStored()
+        oldest = time.time() - conf.supybot.reply.mores.timeout()
+        items = self._items
+        while items and (len(items) > maximum or
+                         next(iter(items.values())).time < oldest):
+            items.popitem(last=False)
+
+    def __getitem__(self, key):
+        with self._lock:
+            self._expire()
+            return self._items[ircutils.toLower(key)]
+
+    def __setitem__(self, key, replies):
+        key = ircutils.toLower(key)
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = replies
+            self._expire()
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._items[ircutils.toLower(key)]
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def memoryUsage(self):
+        """Returns the number of replies stored, and an estimate of the
+        memory they use, in bytes."""
+        with self._lock:
+            self._expire()
+            replies = {id(r): r for r in self._items.values()}
+            return (len(replies),
+                    sys.getsizeof(self._items) +
+                    sum(r.memoryUsage() for r in replies.values()))
+
 class NestedCommandsIrcProxy(ReplyIrcProxy):
     "A proxy object to allow proper nesting of commands (even threaded ones)."
-    _mores = ircutils.IrcDict()
+    _mores = MoresStore()
     def __init__(self, irc, msg, args, nested=0):
         assert isinstance(args, list), 'Args should be a list, not a string.'
         super(NestedCommandsIrcProxy, self).__init__(irc, msg)
@@ -779,6 +1016,16 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
         else:
             callInvalidCommands()
 
+    def _getCommandIndex(self):
+        irc = self.getRealIrc()
+        version = (irc.callbacksVersion, _commandIndexVersion,
+                   len(irc.callbacks))
+        index = getattr(irc, '_commandIndex', None)
+        if index is None or index.version != version:
+            index = CommandIndex(irc.callbacks, version)
+            irc._commandIndex = index
+        return index
+
     def findCallbacksForArgs(self, args):
         """Returns a two-tuple of (command, plugins) that has the command
         (a list of strings) and the plugins for which it was a command."""
@@ -786,30 +1033,12 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
         args = list(map(canonicalName, args))
 
         # Find a list maxL such that maxL = args[0:n] for the largest n
-        # possible such that maxL is a command.
-        cbs = []
-        maxL = []
-        for cb in self.irc.callbacks:
-            if not hasattr(cb, 'getCommand'):
-                continue
-            L = cb.getCommand(args)
-            if L and L >= maxL:
-                # equivalent to "L and len(L) >= len(maxL)", because L and maxL
-                # are both "prefixes" of the same list.
-                maxL = L
-                cbs.append((cb, L))
-                assert isinstance(L, list), \
-                       'getCommand now returns a list, not a method.'
-                assert utils.iter.startswith(L, args), \
-                       'getCommand must return a prefix of the args given.  ' \
-                       '(args given: %r, returned: %r)' % (args, L)
-        log.debug('findCallbacksForArgs: %r', cbs)
+        # possible such that maxL is a command, and the callbacks for which
+        # it is.
+        (maxL, cbs) = self._getCommandIndex().findCallbacks(args)
+        log.debug('findCallbacksForArgs: %r', (maxL, cbs))
 
-        # Filter out all the entries in cbs that are smaller than maxL (ie.
-        # maxL contains them, with more items at the end.)
-        cbs = [cb for (cb, L) in cbs if L == maxL]
-
-        if len(maxL) == 1:
+        if len(maxL) == 1 and len(cbs) > 1:
             # Special case: one arg determines the callback.  In this case, we
             # have to check, in order:
             # 1. Whether the arg is the same as the name of a callback.  This
@@ -999,33 +1228,31 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                     # (which is used like a stack)
                     chunks.reverse()
 
-                    msgs = []
-                    for (i, chunk) in enumerate(chunks):
-                        if i == 0:
-                            pass # last message, no suffix to add
+                    for i in range(1, len(chunks)):
+                        # The last message has no suffix.
+                        if i == 1:
+                            more = _('more message')
                         else:
-                            if i == 1:
-                                more = _('more message')
-                            else:
-                                more = _('more messages')
-                            n = ircutils.bold('(%i %s)' % (len(msgs), more))
-                            chunk = '%s %s' % (chunk, n)
-                        msgs.append(_makeReply(self, msg, chunk, **replyArgs))
+                            more = _('more messages')
+                        n = ircutils.bold('(%i %s)' % (i, more))
+                        chunks[i] = '%s %s' % (chunks[i], n)
 
                     instant = conf.get(conf.supybot.reply.mores.instant,
                         channel=target, network=self.irc.network)
-                    while instant > 1 and msgs:
+                    while instant > 1 and chunks:
                         instant -= 1
-                        response = msgs.pop()
+                        response = _makeReply(self, msg, chunks.pop(),
+                                              **replyArgs)
                         sendMsg(response)
                         # XXX We should somehow allow these to be returned, but
                         #     until someone complains, we'll be fine :)  We
                         #     can't return from here, though, for obvious
                         #     reasons.
                         # return m
-                    if not msgs:
+                    if not chunks:
                         return
-                    response = msgs.pop()
+                    response = _makeReply(self, msg, chunks.pop(),
+                                          **replyArgs)
                     prefix = msg.prefix
                     if self.to and ircutils.isNick(self.to):
                         try:
@@ -1034,10 +1261,13 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
                         except KeyError:
                             pass # We'll leave it as it is.
                     mask = prefix.split('!', 1)[1]
-                    self._mores[mask] = msgs
                     public = bool(self.msg.channel)
                     private = self.private or not public
-                    self._mores[msg.nick] = (private, msgs)
+                    replies = MoreReplies(
+                        _ReplyMaker(self, msg, **replyArgs), chunks, private,
+                        msg)
+                    self._mores[mask] = replies
+                    self._mores[msg.nick] = replies
                     sendMsg(response)
                     return response
             finally:
@@ -1188,13 +1418,17 @@ class DisabledCommands(object):
                     self.d[command].add(plugin)
             else:
                 self.d[command] = CanonicalNameSet([plugin])
+        invalidateCommandIndexes()
 
     def remove(self, command, plugin=None):
-        if plugin is None:
-            del self.d[command]
-        else:
-            if self.d[command] is not None:
-                self.d[command].remove(plugin)
+        try:
+            if plugin is None:
+                del self.d[command]
+            else:
+                if self.d[command] is not None:
+                    self.d[command].remove(plugin)
+        finally:
+            invalidateCommandIndexes()
 
 class BasePlugin(object):
     def __init__(self, *args, **kwargs):
@@ -1329,7 +1563,7 @@ class Commands(BasePlugin, SynchronizedAndFirewalled):
                     for cb in self.pre_command_callbacks)):
             return
         method = self.getCommandMethod(command)
-        method(irc, msg, *args, **kwargs)
+        return method(irc, msg, *args, **kwargs)
 
     def _callCommand(self, command, irc, msg, *args, **kwargs):
         if irc.nick == msg.args[0]:
@@ -1363,12 +1597,31 @@ class Commands(BasePlugin, SynchronizedAndFirewalled):
 
             try:
                 self.callingCommand = command
-                self.callCommand(command, irc, msg, *args, **kwargs)
+                ret = self.callCommand(command, irc, msg, *args, **kwargs)
             finally:
                 self.callingCommand = None
-        except SilentError:
+            if inspect.iscoroutine(ret):
+                # This is an 'async def' command; it will reply when the
+                # event loop runs it.
+                future = drivers.runCoroutine(ret)
+                future.add_done_callback(functools.partial(
+                    self._commandDone, command, irc, msg))
+        except Exception as e:
+            self._handleCommandException(command, irc, msg, e)
+
+    def _commandDone(self, command, irc, msg, future):
+        # Not a coroutine itself, so this module still works with Python
+        # versions without 'async def'.
+        if future.cancelled():
+            return
+        e = future.exception()
+        if isinstance(e, Exception):
+            self._handleCommandException(command, irc, msg, e)
+
+    def _handleCommandException(self, command, irc, msg, e):
+        if isinstance(e, SilentError):
             pass
-        except (getopt.GetoptError, ArgumentError) as e:
+        elif isinstance(e, (getopt.GetoptError, ArgumentError)):
             self.log.debug('Got %s, giving argument error.',
                            utils.exnToString(e))
             help = self.getCommandHelp(command)
@@ -1378,10 +1631,10 @@ class Commands(BasePlugin, SynchronizedAndFirewalled):
                 irc.error(_('Invalid arguments for %s.') % formatCommand(command))
             else:
                 irc.reply(help)
-        except (SyntaxError, Error) as e:
+        elif isinstance(e, (SyntaxError, Error)):
             self.log.debug('Error return: %s', utils.exnToString(e))
             irc.error(str(e))
-        except Exception as e:
+        else:
             self.log.exception('Uncaught exception in %s.', command)
             if conf.supybot.reply.error.detailed():
                 irc.error(utils.exnToString(e))
@@ -1408,6 +1661,112 @@ class Commands(BasePlugin, SynchronizedAndFirewalled):
             return format(_('The %q command has no help.'),
                           formatCommand(command))
 
+
+class _CommandIndexNode(object):
+    __slots__ = ('callbacks', 'children')
+    def __init__(self):
+        self.callbacks = []
+        self.children = {}
+
+_commandIndexVersion = 0
+
+def invalidateCommandIndexes():
+    """Makes all CommandIndex objects be rebuilt the next time they are
+    used.  This must be called when the commands of a plugin change, other
+    than by adding or removing callbacks from an Irc object."""
+    global _commandIndexVersion
+    _commandIndexVersion += 1
+
+def _isIndexable(cb):
+    if not isinstance(cb, Commands):
+        return False
+    cls = type(cb)
+    for name in ('getCommand', 'isCommandMethod', 'listCommands',
+                 'isDisabled'):
+        if getattr(cls, name) is not getattr(Commands, name):
+            return False
+    return all(_isIndexable, cb.cbs)
+
+class CommandIndex(object):
+    """A trie of the commands of a list of callbacks, which gives the
+    callbacks having the longest command prefixing a list of arguments
+    without asking each of them.
+
+    Callbacks that decide what their commands are at runtime (by overriding
+    getCommand, isCommandMethod, or listCommands, like Aka does) can not be
+    indexed; their getCommand is called every time instead."""
+    def __init__(self, callbacks, version=None):
+        self.version = version
+        self.root = _CommandIndexNode()
+        self.dynamic = []
+        self.positions = {}
+        for (i, cb) in enumerate(callbacks):
+            if not hasattr(cb, 'getCommand'):
+                continue
+            self.positions[cb] = i
+            if not _isIndexable(cb):
+                self.dynamic.append(cb)
+                continue
+            name = cb.canonicalName()
+            for command in cb.listCommands():
+                command = command.split()
+                self._add(command, cb)
+                # getCommand also accepts the plugin's name before any of
+                # its commands.
+                self._add([name] + command, cb)
+
+    def _add(self, command, cb):
+        node = self.root
+        for word in command:
+            child = node.children.get(word)
+            if child is None:
+                child = node.children[word] = _CommandIndexNode()
+            node = child
+        if cb not in node.callbacks:
+            node.callbacks.append(cb)
+
+    def lookup(self, args):
+        """Returns a two-tuple of the longest prefix of args which is a
+        command of an indexed callback, and the list of those callbacks."""
+        node = self.root
+        cbs = []
+        length = 0
+        for (i, word) in enumerate(args):
+            node = node.children.get(word)
+            if node is None:
+                break
+            if node.callbacks:
+                cbs = node.callbacks
+                length = i + 1
+        return (args[:length], cbs)
+
+    def findCallbacks(self, args):
+        """Returns a two-tuple of the longest prefix of args which is a
+        command of one of the callbacks, and the list of the callbacks for
+        which it is, in the same order as in the list of callbacks."""
+        (maxL, cbs) = self.lookup(args)
+        cbs = list(cbs)
+        if not self.dynamic:
+            return (maxL, cbs)
+        for cb in self.dynamic:
+            L = cb.getCommand(args)
+            if L and len(L) >= len(maxL):
+                assert isinstance(L, list), \
+                       'getCommand now returns a list, not a method.'
+                assert utils.iter.startswith(L, args), \
+                       'getCommand must return a prefix of the args given.  ' \
+                       '(args given: %r, returned: %r)' % (args, L)
+                if len(L) > len(maxL):
+                    maxL = L
+                    cbs = []
+                cbs.append(cb)
+        cbs.sort(key=self.positions.__getitem__)
+        return (maxL, cbs)
+
+
+# (plugin name, value name, channel, network) -> (registry generation, Value)
+_registryValueCache = utils.structures.LRUCache(10000)
+
 class PluginMixin(BasePlugin, irclib.IrcCallback):
     public = True
     alwaysCall = ()
@@ -1428,6 +1787,9 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
     def canonicalName(self):
         return canonicalName(self.name())
 
+    # This __call__ only filters out messages from ignored users before
+    # dispatching them.
+    onlyDispatchesOnCommand = True
     def __call__(self, irc, msg):
         irc = SimpleProxy(irc, msg)
         if msg.command == 'PRIVMSG':
@@ -1449,12 +1811,20 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
             # argument.
             (network, value) = (value, network)
         plugin = self.name()
-        group = conf.supybot.plugins.get(plugin)
-        names = registry.split(name)
-        for name in names:
-            group = group.get(name)
-        if channel or network:
-            group = group.getSpecific(network=network, channel=channel)
+        key = (plugin, name, channel, network)
+        generation = registry.generation
+        try:
+            (cachedGeneration, group) = _registryValueCache[key]
+        except KeyError:
+            cachedGeneration = None
+        if cachedGeneration != generation:
+            group = conf.supybot.plugins.get(plugin)
+            names = registry.split(name)
+            for name in names:
+                group = group.get(name)
+            if channel or network:
+                group = group.getSpecific(network=network, channel=channel)
+            _registryValueCache[key] = (generation, group)
         if value:
             return group()
         else:
@@ -1515,6 +1885,138 @@ class Plugin(PluginMixin, Commands):
 Privmsg = Plugin # Backwards compatibility.
 
 
+class RegexpPrefilter(object):
+    """Combines the regexps of all PluginRegexp instances in a few
+    alternations, so that strings matching none of them (ie. most messages)
+    are scanned once, instead of once per regexp of each plugin.
+
+    The result for the last string is remembered, as each plugin is given
+    the same message in turn."""
+    # Regexps with these can't be part of an alternation: backreferences
+    # would refer to the wrong groups.  This is conservative, as it also
+    # matches escaped backslashes followed by a digit.
+    _uncombinableRe = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (pattern, flags) -> number of plugins using it
+        self._patterns = collections.Counter()
+        self._combined = None
+        self._last = (None, None)
+        self.scans = 0
+        self.skipped = 0
+
+    def add(self, regexp, flags):
+        """Adds a regexp compiled with the given flags.  Returns False if it
+        can't be part of an alternation; in which case the caller has to
+        run it on all strings."""
+        if not isinstance(regexp.pattern, minisix.string_types) or \
+                self._uncombinableRe.search(regexp.pattern):
+            return False
+        if regexp.flags != re.compile('', flags).flags:
+            # Global inline flags, eg. (?s), would apply to the other
+            # regexps too.
+            return False
+        with self._lock:
+            self._patterns[(regexp.pattern, flags)] += 1
+            self._combined = None
+            self._last = (None, None)
+        return True
+
+    def remove(self, regexp, flags):
+        """Removes a regexp which was added by add()."""
+        key = (regexp.pattern, flags)
+        with self._lock:
+            if self._patterns[key] <= 1:
+                del self._patterns[key]
+            else:
+                self._patterns[key] -= 1
+            self._combined = None
+            self._last = (None, None)
+
+    @staticmethod
+    def _isAnchored(pattern, flags):
+        """Returns whether the pattern can only match at the beginning of
+        strings, ie. if it starts with ^ and has no top-level |."""
+        if flags & (re.M | re.X) or not pattern.startswith('^'):
+            return False
+        depth = 0
+        i = 1
+        while i < len(pattern):
+            c = pattern[i]
+            if c == '\\':
+                i += 1
+            elif c == '[':
+                i += 1
+                if pattern[i:i+1] == '^':
+                    i += 1
+                if pattern[i:i+1] == ']':
+                    i += 1
+                while i < len(pattern) and pattern[i] != ']':
+                    if pattern[i] == '\\':
+                        i += 1
+                    i += 1
+            elif c == '(':
+                depth += 1
+            elif c == ')':
+                depth -= 1
+            elif c == '|' and depth == 0:
+                return False
+            i += 1
+        return True
+
+    def _compile(self):
+        with self._lock:
+            # (flags, anchored) -> list of (alternatives, names of their
+            # groups)
+            alternations = {}
+            for (pattern, flags) in self._patterns:
+                names = set(re.compile(pattern, flags).groupindex)
+                key = (flags, self._isAnchored(pattern, flags))
+                if flags & re.X:
+                    # Would be commented out by a comment on its last line
+                    pattern += '\n'
+                for (alternatives, usedNames) in \
+                        alternations.setdefault(key, []):
+                    if not names & usedNames:
+                        break
+                else:
+                    # Group names must be unique in each alternation
+                    (alternatives, usedNames) = ([], set())
+                    alternations[key].append((alternatives, usedNames))
+                alternatives.append('(?:%s)' % pattern)
+                usedNames.update(names)
+            # Anchored regexps only have to be tried at the beginning of
+            # strings, which is much faster than searching them.
+            self._combined = []
+            for ((flags, anchored), L) in alternations.items():
+                for (alternatives, _) in L:
+                    r = re.compile('|'.join(alternatives), flags)
+                    self._combined.append(r.match if anchored else r.search)
+            return self._combined
+
+    def search(self, s):
+        """Returns whether any of the regexps may match the string."""
+        (lastString, lastResult) = self._last
+        if s is lastString:
+            return lastResult
+        combined = self._combined
+        if combined is None:
+            combined = self._compile()
+        result = any(lambda search: search(s), combined)
+        self._last = (s, result)
+        self.scans += 1
+        if not result:
+            self.skipped += 1
+        return result
+
+    def stats(self):
+        """Returns the number of regexps, of strings scanned, and of strings
+        skipped because they matched none of the regexps."""
+        return {'regexps': sum(self._patterns.values()),
+                'scans': self.scans, 'skipped': self.skipped}
+
+regexpPrefilter = RegexpPrefilter()
+
 class PluginRegexp(Plugin):
     """Same as Plugin, except allows the user to also include regexp-based
     callbacks.  All regexp-based callbacks must be specified in the set (or
@@ -1539,18 +2041,43 @@ class PluginRegexp(Plugin):
         self.res = []
         self.addressedRes = []
         self.unaddressedRes = []
-        for name in self.regexps:
-            method = getattr(self, name)
-            r = re.compile(method.__doc__, self.flags)
-            self.res.append((r, name))
-        for name in self.addressedRegexps:
-            method = getattr(self, name)
-            r = re.compile(method.__doc__, self.flags)
-            self.addressedRes.append((r, name))
-        for name in self.unaddressedRegexps:
-            method = getattr(self, name)
-            r = re.compile(method.__doc__, self.flags)
-            self.unaddressedRes.append((r, name))
+        # Regexps which are not in regexpPrefilter, and have to be run on
+        # all messages.
+        self.unfilteredRes = set()
+        # Number of matches of each regexp
+        self.regexpMatches = collections.Counter()
+        for (names, res) in ((self.regexps, self.res),
+                             (self.addressedRegexps, self.addressedRes),
+                             (self.unaddressedRegexps, self.unaddressedRes)):
+            for name in names:
+                method = getattr(self, name)
+                r = re.compile(method.__doc__, self.flags)
+                res.append((r, name))
+                if not regexpPrefilter.add(r, self.flags):
+                    self.unfilteredRes.add(r)
+
+    def die(self):
+        self.__parent.die()
+        for res in (self.res, self.addressedRes, self.unaddressedRes):
+            for (r, name) in res:
+                if r not in self.unfilteredRes:
+                    regexpPrefilter.remove(r, self.flags)
+        # In case it is called twice
+        self.res = self.addressedRes = self.unaddressedRes = []
+
+    def _finditer(self, res, s):
+        """Yields (name, match) for each match of each regexp in res,
+        in order."""
+        if self.unfilteredRes:
+            mayMatch = regexpPrefilter.search(s)
+        else:
+            # Already checked by the caller
+            mayMatch = True
+        for (r, name) in res:
+            if mayMatch or r in self.unfilteredRes:
+                for m in r.finditer(s):
+                    self.regexpMatches[name] += 1
+                    yield (name, m)
 
     def _callRegexp(self, name, irc, msg, m):
         method = getattr(self, name)
@@ -1563,21 +2090,24 @@ class PluginRegexp(Plugin):
 
     def invalidCommand(self, irc, msg, tokens):
         s = ' '.join(tokens)
-        for (r, name) in self.addressedRes:
-            for m in r.finditer(s):
-                self._callRegexp(name, irc, msg, m)
+        if not self.unfilteredRes and not regexpPrefilter.search(s):
+            return
+        for (name, m) in self._finditer(self.addressedRes, s):
+            self._callRegexp(name, irc, msg, m)
 
     def doPrivmsg(self, irc, msg):
         if msg.isError:
             return
+        s = msg.args[1]
+        if not self.unfilteredRes and not regexpPrefilter.search(s):
+            # The common case: none of our regexps can match.
+            return
         proxy = self.Proxy(irc, msg)
         if not msg.addressed:
-            for (r, name) in self.unaddressedRes:
-                for m in r.finditer(msg.args[1]):
-                    self._callRegexp(name, proxy, msg, m)
-        for (r, name) in self.res:
-            for m in r.finditer(msg.args[1]):
+            for (name, m) in self._finditer(self.unaddressedRes, s):
                 self._callRegexp(name, proxy, msg, m)
+        for (name, m) in self._finditer(self.res, s):
+            self._callRegexp(name, proxy, msg, m)
 PrivmsgCommandAndRegexp = PluginRegexp
 
 
@@ -33,6 +33,7 @@ Includes wrappers for commands.
 """
 
 import time
+import pickle
 import getopt
 import inspect
 import threading
@@ -43,7 +44,7 @@ try:
 except ImportError: # Windows!
     resource = None
 
-from . import callbacks, conf, ircdb, ircmsgs, ircutils, log, \
+from . import callbacks, conf, ircdb, irclib, ircmsgs, ircutils, log, \
         utils, world
 from .utils import minisix
 from .i18n import PluginInternationalization, internationalizeDocstring
@@ -78,7 +79,288 @@ def _rlimit_min(a, b):
     elif b == resource.RLIM_INFINITY:
         return a
     else:
-        return min(soft, heap_size)
+        return min(a, b)
+
+def _setHeapSize(heap_size):
+    if resource:
+        rsrc = resource.RLIMIT_DATA
+        (soft, hard) = resource.getrlimit(rsrc)
+        soft = _rlimit_min(soft, heap_size)
+        hard = _rlimit_min(hard, heap_size)
+        resource.setrlimit(rsrc, (soft, hard))
+
+def _poolWorkerMain(conn, heap_size):
+    """Runs the functions sent by a ProcessPool, until the pipe is closed."""
+    _setHeapSize(heap_size)
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except (EOFError, OSError):
+            return
+        try:
+            (f, args, kwargs, iterate) = pickle.loads(data)
+        except Exception:
+            # eg. the function is in a module loaded after this process
+            # was forked.
+            conn.send_bytes(pickle.dumps(('unpicklable', None)))
+            continue
+        if iterate:
+            result = _poolWorkerIterate(conn, f, args, kwargs)
+        else:
+            try:
+                result = ('return', f(*args, **kwargs))
+            except Exception as e:
+                result = ('raise', e)
+        try:
+            data = pickle.dumps(result)
+        except Exception:
+            # Like when the result can't be put in a multiprocessing.Queue
+            data = pickle.dumps(('return', None))
+        conn.send_bytes(data)
+
+def _poolWorkerIterate(conn, f, args, kwargs):
+    """Sends the items of the iterator returned by f(*args, **kwargs), each
+    after the previous one was acknowledged by the parent, which can also
+    tell it to stop there."""
+    try:
+        iterator = iter(f(*args, **kwargs))
+        for item in iterator:
+            conn.send_bytes(pickle.dumps(('yield', item)))
+            if conn.recv_bytes() != b'next':
+                if hasattr(iterator, 'close'):
+                    iterator.close()
+                break
+    except Exception as e:
+        return ('raise', e)
+    return ('return', None)
+
+class _PoolWorker(object):
+    def __init__(self, heap_size):
+        (self.conn, childConn) = multiprocessing.Pipe()
+        self.process = callbacks.CommandProcess(target=_poolWorkerMain,
+            args=(childConn, heap_size), kwargs={'pn': 'ProcessPool',
+                                                 'cn': 'worker'})
+        self.process.daemon = True
+        self.process.start()
+        childConn.close()
+        # The functions it runs are found in the modules loaded when it
+        # was forked, so it must not be used after plugins are reloaded.
+        self.callbacksVersion = irclib.Irc.callbacksVersion
+
+    def isStale(self):
+        return self.callbacksVersion != irclib.Irc.callbacksVersion
+
+    def close(self):
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+
+class _UnpicklableTask(Exception):
+    pass
+
+class ProcessPool(object):
+    """Processes running the functions given to process(), so it does not
+    have to fork a new process (a copy of the whole bot) for each call.
+    At most supybot.commands.process.poolSize processes are forked, when
+    needed; calls wait for one of them to be available.  A process whose
+    function times out is killed, and another one is forked instead.
+    Processes forked before plugins were reloaded are not reused, so the
+    functions see the current code.
+
+    The processes are not forked again when the registry changes (it
+    changes much more often than plugins are reloaded), so the functions
+    see the configuration as it was when their process was forked; those
+    which depend on it must get the values they need as arguments."""
+    def __init__(self, heap_size):
+        self.heap_size = heap_size
+        self._cond = threading.Condition()
+        self._idle = []
+        self._workers = 0
+        self.waiting = 0
+        self.maxWaiting = 0
+        self.tasks = 0
+        self.timeouts = 0
+        self.forks = 0
+
+    def _acquire(self, timeout, name):
+        """Returns an idle process, or a new one if there are less than
+        supybot.commands.process.poolSize of them, waiting at most
+        <timeout> seconds for one of them to be available."""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                while self._idle:
+                    worker = self._idle.pop()
+                    if not worker.isStale():
+                        return worker
+                    self._workers -= 1
+                    worker.close()
+                size = conf.supybot.commands.process.poolSize()
+                if self._workers < max(1, size):
+                    self._workers += 1
+                    self.forks += 1
+                    break
+                self.waiting += 1
+                self.maxWaiting = max(self.maxWaiting, self.waiting)
+                try:
+                    if deadline is None:
+                        self._cond.wait()
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0 or not self._cond.wait(remaining):
+                            self.timeouts += 1
+                            raise ProcessTimeoutError(
+                                "%s aborted due to timeout." % (name,))
+                finally:
+                    self.waiting -= 1
+        try:
+            return _PoolWorker(self.heap_size)
+        except:
+            self._release(None)
+            raise
+
+    def _release(self, worker):
+        """Makes the worker available again, or kills it if it is None or
+        should not be used anymore."""
+        with self._cond:
+            size = conf.supybot.commands.process.poolSize()
+            if worker is None or worker.isStale() or self._workers > size:
+                self._workers -= 1
+            else:
+                self._idle.append(worker)
+                worker = None
+            self._cond.notify()
+        if worker is not None:
+            worker.close()
+
+    def _kill(self, worker):
+        self._release(None)
+        worker.close()
+
+    def _dumps(self, f, args, kwargs, iterate):
+        try:
+            return pickle.dumps((f, args, kwargs, iterate))
+        except Exception as e:
+            # eg. local functions, Irc objects
+            raise _UnpicklableTask(e)
+
+    def _recv(self, worker, deadline, name):
+        """Returns the next (status, value) sent by the worker, or raises
+        ProcessTimeoutError if it is not received before the deadline."""
+        if deadline is None:
+            timeout = None
+        else:
+            timeout = max(0, deadline - time.time())
+        if not worker.conn.poll(timeout):
+            with self._cond:
+                self.timeouts += 1
+            raise ProcessTimeoutError("%s aborted due to timeout." % (name,))
+        return pickle.loads(worker.conn.recv_bytes())
+
+    def run(self, f, args, kwargs, timeout, name):
+        """Runs f(*args, **kwargs) in one of the processes, and returns
+        (raised, value), like what process() gets from its subprocesses.
+        Raises _UnpicklableTask if the function, its arguments, or its
+        result could not be sent between processes."""
+        data = self._dumps(f, args, kwargs, False)
+        worker = self._acquire(timeout, name)
+        # Not counting the time spent waiting for the process.
+        deadline = None if timeout is None else time.time() + timeout
+        try:
+            worker.conn.send_bytes(data)
+            (status, value) = self._recv(worker, deadline, name)
+        except (EOFError, OSError):
+            # The process died, eg. because of a segfault.
+            self._kill(worker)
+            return (False, None)
+        except:
+            self._kill(worker)
+            raise
+        self._release(worker)
+        with self._cond:
+            self.tasks += 1
+        if status == 'unpicklable':
+            raise _UnpicklableTask()
+        return (status == 'raise', value)
+
+    def runIter(self, f, args, kwargs, timeout, name):
+        """Like run(), but f(*args, **kwargs) returns an iterator, whose
+        items are yielded as soon as they are received.  The timeout is
+        for the whole iteration.  _UnpicklableTask is raised before any
+        item is yielded."""
+        data = self._dumps(f, args, kwargs, True)
+        worker = self._acquire(timeout, name)
+        # Not counting the time spent waiting for the process.
+        deadline = None if timeout is None else time.time() + timeout
+        try:
+            worker.conn.send_bytes(data)
+            (status, value) = self._recv(worker, deadline, name)
+            while status == 'yield':
+                try:
+                    yield value
+                except GeneratorExit:
+                    # The caller does not need the other items; the process
+                    # can be reused once it has stopped iterating.
+                    try:
+                        worker.conn.send_bytes(b'stop')
+                        self._recv(worker, deadline, name)
+                    except (ProcessTimeoutError, EOFError, OSError):
+                        self._kill(worker)
+                    else:
+                        self._release(worker)
+                    with self._cond:
+                        self.tasks += 1
+                    return
+                worker.conn.send_bytes(b'next')
+                (status, value) = self._recv(worker, deadline, name)
+        except (EOFError, OSError):
+            # The process died, eg. because of a segfault.
+            self._kill(worker)
+            return
+        except:
+            self._kill(worker)
+            raise
+        self._release(worker)
+        with self._cond:
+            self.tasks += 1
+        if status == 'unpicklable':
+            raise _UnpicklableTask()
+        elif status == 'raise':
+            raise value
+
+    def stats(self):
+        """Returns the number of processes, of calls waiting for one of them
+        (now and at most), of calls run, of calls which timed out, and of
+        processes forked so far."""
+        with self._cond:
+            return {'processes': self._workers, 'waiting': self.waiting,
+                    'maxWaiting': self.maxWaiting, 'tasks': self.tasks,
+                    'timeouts': self.timeouts, 'forks': self.forks}
+
+# heap_size -> ProcessPool
+_pools = {}
+_poolsLock = threading.Lock()
+
+def getProcessPool(heap_size):
+    """Returns the ProcessPool whose processes have the given heap size
+    limit."""
+    with _poolsLock:
+        pool = _pools.get(heap_size)
+        if pool is None:
+            pool = _pools[heap_size] = ProcessPool(heap_size)
+        return pool
+
+def processPoolsStats():
+    """Returns the sum of the stats() of all the ProcessPools."""
+    stats = {'processes': 0, 'waiting': 0, 'maxWaiting': 0, 'tasks': 0,
+             'timeouts': 0, 'forks': 0}
+    with _poolsLock:
+        pools = list(_pools.values())
+    for pool in pools:
+        for (key, value) in pool.stats().items():
+            stats[key] += value
+    return stats
 
 def process(f, *args, **kwargs):
     """Runs a function <f> in a subprocess.
@@ -102,7 +384,24 @@ def process(f, *args, **kwargs):
             return f(*args, **kwargs)
         except Exception as e:
             raise e
-    
+
+    if conf.supybot.commands.process.poolSize():
+        name = 'Process for %s.%s' % (kwargs.get('pn', 'Unknown'),
+                                      kwargs.get('cn', 'unknown'))
+        taskKwargs = dict(kwargs)
+        taskKwargs.pop('pn', None)
+        taskKwargs.pop('cn', None)
+        try:
+            (raised, v) = getProcessPool(heap_size).run(
+                f, args, taskKwargs, timeout, name)
+        except _UnpicklableTask:
+            pass # Fork a process for it, as it used to be.
+        else:
+            if raised:
+                raise v
+            else:
+                return v
+
     try:
         q = multiprocessing.Queue()
     except OSError:
@@ -115,12 +414,7 @@ def process(f, *args, **kwargs):
                 'for more information about this bug.)\n')
         raise
     def newf(f, q, *args, **kwargs):
-        if resource:
-            rsrc = resource.RLIMIT_DATA
-            (soft, hard) = resource.getrlimit(rsrc)
-            soft = _rlimit_min(soft, heap_size)
-            hard = _rlimit_min(hard, heap_size)
-            resource.setrlimit(rsrc, (soft, hard))
+        _setHeapSize(heap_size)
         try:
             r = f(*args, **kwargs)
             q.put([False, r])
@@ -157,24 +451,89 @@ def process(f, *args, **kwargs):
     else:
         return v
 
+def _listItems(f, *args, **kwargs):
+    return list(f(*args, **kwargs))
+
+def processIter(f, *args, **kwargs):
+    """Like process(), but <f> returns an iterator (eg. it is a generator
+    function), whose items are yielded as soon as the subprocess produces
+    them.
+
+    <timeout> limits the length of the whole iteration; when it is
+    exceeded, the subprocess is killed and ProcessTimeoutError is raised
+    after the items produced so far were yielded.  If the caller stops
+    iterating early, the subprocess stops too.  Functions which cannot be
+    run by the pool of processes (see process()) are run in a forked
+    process, whose items are only available once it is finished."""
+    timeout = kwargs.pop('timeout', None)
+    heap_size = kwargs.pop('heap_size', None)
+    if resource and heap_size is None:
+        heap_size = resource.RLIM_INFINITY
+    pn = kwargs.pop('pn', 'Unknown')
+    cn = kwargs.pop('cn', 'unknown')
+
+    if world.disableMultiprocessing:
+        for item in f(*args, **kwargs):
+            yield item
+        return
+
+    if conf.supybot.commands.process.poolSize():
+        name = 'Process for %s.%s' % (pn, cn)
+        items = getProcessPool(heap_size).runIter(
+            f, args, kwargs, timeout, name)
+        try:
+            for item in items:
+                yield item
+            return
+        except _UnpicklableTask:
+            pass # Fork a process for it, as it used to be.
+        finally:
+            items.close()
+
+    items = process(_listItems, f, *args, timeout=timeout,
+                    heap_size=heap_size, pn=pn, cn=cn, **kwargs)
+    for item in items:
+        yield item
+
+def _re_bool(s, reobj):
+    """Since we can't enqueue match objects into the multiprocessing queue,
+    we'll just wrap the function to return bools.  This is not a local
+    function of regexp_wrapper, so it can be run by a ProcessPool."""
+    if reobj.search(s) is not None:
+        return True
+    else:
+        return False
+
 def regexp_wrapper(s, reobj, timeout, plugin_name, fcn_name):
     '''A convenient wrapper to stuff regexp search queries through a subprocess.
 
     This is used because specially-crafted regexps can use exponential time
     and hang the bot.'''
-    def re_bool(s, reobj):
-        """Since we can't enqueue match objects into the multiprocessing queue,
-        we'll just wrap the function to return bools."""
-        if reobj.search(s) is not None:
-            return True
-        else:
-            return False
     try:
-        v = process(re_bool, s, reobj, timeout=timeout, pn=plugin_name, cn=fcn_name)
+        v = process(_re_bool, s, reobj, timeout=timeout, pn=plugin_name, cn=fcn_name)
         return v
     except ProcessTimeoutError:
         return None
 
+def _re_search_indexes(strings, reobjs):
+    for (i, s) in enumerate(strings):
+        for reobj in reobjs:
+            if reobj.search(s) is None:
+                break
+        else:
+            yield i
+
+def regexp_filter(strings, reobjs, timeout, plugin_name, fcn_name):
+    """Like regexp_wrapper, but searches a list of strings in a single
+    subprocess, with a <timeout> for the whole list.
+
+    Yields the indexes of the strings matched by all the <reobjs>, as they
+    are found; and raises ProcessTimeoutError if the timeout is reached
+    before the end of the list.  Callers only interested in the first
+    matches should close() the generator, so the search stops."""
+    return processIter(_re_search_indexes, list(strings), list(reobjs),
+                       timeout=timeout, pn=plugin_name, cn=fcn_name)
+
 class UrlSnarfThread(world.SupyThread):
     def __init__(self, *args, **kwargs):
         assert 'url' in kwargs
@@ -1113,7 +1472,7 @@ def _wrap(f, specList=[], name=None, checkDoc=True, **kw):
             self.log.debug('Refusing to call %s due to state.errored.', f)
         else:
             try:
-                f(self, irc, msg, args, *state.args, **state.kwargs)
+                return f(self, irc, msg, args, *state.args, **state.kwargs)
             except TypeError:
                 self.log.error('Spec: %s', specList)
                 self.log.error('Received args: %s', args)
@@ -1159,7 +1518,7 @@ __all__ = [
     # Decorators.
     'urlSnarfer', 'thread',
     # Functions.
-    'wrap', 'process', 'regexp_wrapper',
+    'wrap', 'process', 'processIter', 'regexp_wrapper', 'regexp_filter',
     # Stuff for testing.
     'Spec',
 ]
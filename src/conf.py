@@ -527,6 +527,16 @@ registerChannelValue(supybot.reply.mores, 'instant',
     they are formed).  Defaults to 1, which means that a more command will be
     required for all but the first chunk.""")))
 
+registerGlobalValue(supybot.reply.mores, 'maximumStored',
+    registry.PositiveInteger(10000, _("""Determines how many users and nicks
+    the bot keeps the remaining chunks of a reply for (for use with the 'more'
+    command).  When there are more, the oldest ones are dropped.""")))
+
+registerGlobalValue(supybot.reply.mores, 'timeout',
+    registry.PositiveInteger(3600, _("""Determines how long (in seconds) the
+    remaining chunks of a reply are kept for (for use with the 'more'
+    command).""")))
+
 registerChannelValue(supybot.reply, 'oneToOne',
     registry.Boolean(True, _("""Determines whether the bot will send
     multi-message replies in a single message. This defaults to True 
@@ -756,6 +766,12 @@ registerGlobalValue(supybot, 'upkeepInterval',
     collects garbage, and records some useful statistics at the debugging
      level.""")))
 
+registerGroup(supybot, 'schedule')
+registerGlobalValue(supybot.schedule, 'threads',
+    registry.PositiveInteger(2, _("""Determines the maximum number of threads
+    running the scheduled events which must not block the main loop (those
+    added with executor='thread').""")))
+
 registerGlobalValue(supybot, 'flush',
     registry.Boolean(True, _("""Determines whether the bot will periodically
     flush data and configuration files to disk.  Generally, the only time
@@ -837,6 +853,14 @@ registerGlobalValue(supybot.commands, 'allowShell',
     Setting this to False also disables plugins and commands that can be
     used to indirectly gain shell access.""")))
 
+registerGroup(supybot.commands, 'process')
+registerGlobalValue(supybot.commands.process, 'poolSize',
+    registry.NonNegativeInteger(2, _("""Determines the maximum number of
+    processes kept running to run the functions plugins run in a separate
+    process (eg. regexps given by users, which could take forever), instead
+    of forking a new process for each of them.  If this is 0, a new process
+    is always forked.""")))
+
 # supybot.commands.disabled moved to callbacks for canonicalName.
 
 ###
@@ -894,11 +918,14 @@ registerGlobalValue(supybot.drivers, 'poll',
 
 class ValidDriverModule(registry.OnlySomeStrings):
     __slots__ = ()
-    validStrings = ('default', 'Socket')
+    validStrings = ('default', 'Socket', 'Selector', 'Asyncio')
 
 registerGlobalValue(supybot.drivers, 'module',
-    ValidDriverModule('default', _("""Determines what driver module the 
-    bot will use. Current, the only (and default) driver is Socket.""")))
+    ValidDriverModule('default', _("""Determines what driver module the
+    bot will use. The default driver is Socket; Selector uses the best
+    polling mechanism of your platform (eg. epoll on Linux), and scales better
+    when the bot is connected to many networks; Asyncio runs all connections
+    in the same asyncio event loop as the async commands of plugins.""")))
 
 registerGlobalValue(supybot.drivers, 'maxReconnectWait',
     registry.PositiveFloat(300.0, _("""Determines the maximum time the bot will
@@ -1061,6 +1088,33 @@ registerGlobalValue(supybot.databases.networks, 'filename',
     for the networks database.  This file will go into the directory specified
     by the supybot.directories.conf variable.""")))
 
+class IrcdbBackend(registry.OnlySomeStrings):
+    __slots__ = ()
+    validStrings = ('flat', 'sqlite')
+
+registerGlobalValue(supybot.databases, 'backend',
+    IrcdbBackend('flat', _("""Determines how the users, channels, and ignores
+    databases are stored.  'flat' stores them in the text files configured
+    in supybot.databases.users.filename, supybot.databases.channels.filename
+    and supybot.databases.ignores.filename; 'sqlite' stores them in a single
+    SQLite database (see supybot.databases.backend.sqliteFilename), only
+    loading users and channels from it when they are needed.  Use the
+    supybot-migrate-ircdb script to convert the text files to SQLite.  This
+    is only read on startup.""")))
+registerGlobalValue(supybot.databases.backend, 'sqliteFilename',
+    registry.String('ircdb.sqlite3', _("""Determines what filename will be
+    used for the SQLite database of the users, channels, and ignores, if
+    supybot.databases.backend is 'sqlite'.  This file will go into the
+    directory specified by the supybot.directories.conf variable.""")))
+
+registerGlobalValue(supybot.databases, 'journalSize',
+    registry.NonNegativeInteger(1048576, _("""Determines the maximum size (in
+    bytes) of the journals of the users, channels, and networks databases.
+    Changes to these databases are appended to their journal, which is merged
+    into the database file when it grows bigger than this, when the bot
+    flushes its databases, and on startup.  If this is 0, the database files
+    are rewritten on every change instead.""")))
+
 # TODO This will need to do more in the future (such as making sure link.allow
 # will let the link occur), but for now let's just leave it as this.
 class ChannelSpecific(registry.Boolean):
@@ -1258,16 +1312,23 @@ registerGlobalValue(supybot.protocols.irc, 'vhostv6',
     registry.String('', _("""Determines what vhost the bot will bind to before
     connecting a server (IRC, HTTP, ...) via IPv6.""")))
 
-registerGlobalValue(supybot.protocols.irc, 'maxHistoryLength',
-    registry.Integer(1000, _("""Determines how many old messages the bot will
-    keep around in its history.  Changing this variable will not take effect
-    on a network until it is reconnected.""")))
+registerNetworkValue(supybot.protocols.irc, 'maxHistoryLength',
+    registry.Integer(1000, _("""Determines how many old messages the
+    bot will keep around in its history of each network.  Changing this
+    variable will not take effect on a network until it is reconnected.""")))
 
 registerGlobalValue(supybot.protocols.irc, 'throttleTime',
     registry.Float(1.0, _("""A floating point number of seconds to throttle
     queued messages -- that is, messages will not be sent faster than once per
     throttleTime seconds.""")))
 
+registerNetworkValue(supybot.protocols.irc, 'throttleBurst',
+    registry.PositiveInteger(1, _("""Determines how many queued messages the
+    bot may send at once before it starts waiting throttleTime seconds
+    between messages.  Raise it to the number of lines the server lets
+    clients send in a burst to reduce reply latency; the average rate
+    remains one message per throttleTime seconds.""")))
+
 registerGlobalValue(supybot.protocols.irc, 'ping',
     registry.Boolean(True, _("""Determines whether the bot will send PINGs to
     the server it's connected to in order to keep the connection alive and
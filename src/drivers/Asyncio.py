@@ -0,0 +1,246 @@
+###
+# Copyright (c) 2026, agent
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Contains a driver based on asyncio streams.
+
+All connections, as well as coroutines started by plugins (eg. async
+commands), share the event loop returned by drivers.getEventLoop(), which is
+run by a single driver each time drivers.run() is called.
+"""
+
+import ssl
+import time
+import socket
+import asyncio
+import functools
+
+from .. import conf, drivers, log, utils
+from ..utils.str import decode_raw_line
+from . import Socket
+
+# Maximum amount of data read from a connection at once.
+READ_SIZE = 65536
+
+class AsyncioDriver(Socket.SocketDriver):
+    _instances = []
+    def __init__(self, irc):
+        self.loop = drivers.getEventLoop()
+        self.reader = None
+        self.writer = None
+        self._connecting = None
+        self._instances.append(self)
+        Socket.SocketDriver.__init__(self, irc)
+
+    def reconnect(self, wait=False, reset=True, server=None):
+        self._attempt += 1
+        self.nextReconnectTime = None
+        if self.connected:
+            self.onDisconnect()
+            drivers.log.reconnect(self.irc.network)
+            self._close()
+        if reset:
+            drivers.log.debug('Resetting %s.', self.irc)
+            self.irc.reset()
+        else:
+            drivers.log.debug('Not resetting %s.', self.irc)
+        if wait:
+            if server is not None:
+                # Make this server be the next one to be used.
+                self.servers.insert(0, server)
+            self.scheduleReconnect()
+            return
+        self.currentServer = server or self._getNextServer()
+        self._connecting = drivers.runCoroutine(
+            self._connect(self.currentServer))
+
+    def _close(self):
+        self.connected = False
+        if self._connecting is not None:
+            self._connecting.cancel()
+            self._connecting = None
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def _connect(self, server):
+        network_config = getattr(conf.supybot.networks, self.irc.network)
+        socks_proxy = network_config.socksproxy()
+        try:
+            if socks_proxy:
+                import socks
+        except ImportError:
+            log.error('Cannot use socks proxy (SocksiPy not installed), '
+                    'using direct connection instead.')
+            socks_proxy = ''
+        try:
+            address = await self.loop.run_in_executor(None, functools.partial(
+                utils.net.getAddressFromHostname,
+                server.hostname, attempt=self._attempt))
+        except (socket.gaierror, socket.error) as e:
+            drivers.log.connectError(server, e)
+            self.scheduleReconnect()
+            return
+        drivers.log.connect(server)
+        sock = None
+        sslContext = None
+        try:
+            sock = utils.net.getSocket(
+                    address,
+                    port=server.port,
+                    socks_proxy=socks_proxy,
+                    vhost=conf.supybot.protocols.irc.vhost(),
+                    vhostv6=conf.supybot.protocols.irc.vhostv6(),
+                    )
+            if socks_proxy:
+                # The SOCKS handshake is blocking, run it in a thread.
+                await self.loop.run_in_executor(
+                    None, sock.connect, (address, server.port))
+                sock.setblocking(False)
+            else:
+                sock.setblocking(False)
+                await asyncio.wait_for(
+                    self.loop.sock_connect(sock, (address, server.port)),
+                    max(10, conf.supybot.drivers.poll()*10))
+            if network_config.ssl() or server.force_tls_verification:
+                sslOptions = self._getSslOptions()
+                trustedFingerprints = sslOptions['trusted_fingerprints']
+                sslContext = utils.net.ssl_context(**sslOptions)
+            (self.reader, self.writer) = await asyncio.open_connection(
+                sock=sock, ssl=sslContext,
+                server_hostname=server.hostname if sslContext else None)
+            if sslContext and trustedFingerprints:
+                utils.net.check_certificate_fingerprint(
+                    self.writer.get_extra_info('ssl_object'),
+                    trustedFingerprints)
+        except (ssl.CertificateError, socket.error,
+                asyncio.TimeoutError) as e:
+            if isinstance(e, ssl.CertificateError):
+                self._logCertificateError(e)
+            else:
+                drivers.log.connectError(server, e)
+            # We are the task _close() would cancel.
+            self._connecting = None
+            self._close()
+            if sock is not None:
+                sock.close()
+            self.scheduleReconnect()
+            return
+        self._connecting = None
+        self._warnIfInsecure(address)
+        self.connected = True
+        self.resetDelay()
+        self._sendIfMsgs()
+        await self._readLoop(self.reader)
+
+    async def _readLoop(self, reader):
+        inbuffer = b''
+        while reader is self.reader:
+            try:
+                data = await reader.read(READ_SIZE)
+            except (socket.error, ssl.SSLError) as e:
+                self._handleSocketError(e)
+                return
+            if reader is not self.reader:
+                # We reconnected in the meantime.
+                return
+            if not data:
+                # Socket was closed
+                self._handleSocketError(None)
+                return
+            lines = (inbuffer + data).split(b'\n')
+            inbuffer = lines.pop()
+            for line in lines:
+                line = decode_raw_line(line)
+
+                msg = drivers.parseMsg(line)
+                if msg is not None and self.irc is not None:
+                    self.irc.feedMsg(msg)
+            if self.irc and not self.irc.zombie:
+                self._sendIfMsgs()
+
+    def _handleSocketError(self, e):
+        # 'e is None' means the socket was closed.
+        drivers.log.disconnect(self.currentServer, e)
+        self._close()
+        if not self.zombie:
+            self.scheduleReconnect()
+
+    def _sendIfMsgs(self):
+        if not self.connected:
+            return
+        msgs = []
+        if not self.zombie:
+            msg = self.irc.takeMsg()
+            while msg is not None:
+                msgs.append(str(msg))
+                msg = self.irc.takeMsg()
+        if msgs:
+            # The transport buffers what can not be sent right now, and
+            # flushes it when the socket is writable.
+            self.writer.write(''.join(msgs).encode())
+
+    def run(self):
+        now = time.time()
+        if self.nextReconnectTime is not None and now > self.nextReconnectTime:
+            self.reconnect()
+        if self.connected and self.irc is not None:
+            # Messages queued by other threads, or delayed by throttling.
+            self._sendIfMsgs()
+        if self._instances and self._instances[0] is self:
+            # All the connections share the same event loop, so a single
+            # driver has to run it each time drivers.run() is called.
+            timeout = drivers.getTimeout(inst.irc for inst in self._instances)
+            for inst in self._instances:
+                if inst.nextReconnectTime is not None:
+                    timeout = min(timeout,
+                                  max(0, inst.nextReconnectTime - now))
+            drivers.stepEventLoop(timeout)
+
+    def die(self):
+        if self in self._instances:
+            self._instances.remove(self)
+        self.zombie = True
+        self.nextReconnectTime = None
+        # Closing the writer flushes its buffer first.
+        self._close()
+        drivers.log.die(self.irc)
+        drivers.IrcDriver.die(self)
+        drivers.ServersMixin.die(self)
+
+    def _reallyDie(self):
+        if self in self._instances:
+            self._instances.remove(self)
+        self._close()
+        drivers.IrcDriver.die(self)
+
+
+Driver = AsyncioDriver
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
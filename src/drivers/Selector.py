@@ -0,0 +1,230 @@
+###
+# Copyright (c) 2002-2004, Jeremiah Fincher
+# Copyright (c) 2010, 2013, James McCoy
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Contains a socket driver based on the selectors module (epoll, kqueue, ...).
+
+Unlike the Socket driver, sockets are registered with the selector once per
+connection instead of being passed to select.select() on every tick, and only
+one driver per loop iteration blocks waiting for events.
+"""
+
+import time
+import socket
+import selectors
+import threading
+
+from .. import drivers
+from ..utils.str import decode_raw_line
+from . import Socket
+
+# Size of the buffer we recv_into().  It is shared by all connections, as
+# reads are processed synchronously.
+RECV_BUFFER_SIZE = 65536
+
+class SelectorDriver(Socket.SocketDriver):
+    _instances = []
+    _selecting = threading.Lock()
+    _selector = selectors.DefaultSelector()
+    _recvBuffer = memoryview(bytearray(RECV_BUFFER_SIZE))
+
+    def __init__(self, irc):
+        self._registeredConn = None
+        self._wantWrite = False
+        Socket.SocketDriver.__init__(self, irc)
+        self.inbuffer = bytearray()
+        self.outbuffer = bytearray()
+
+    def _syncRegistration(self):
+        """Makes the selector's registration of this driver match its
+        presence in self._instances."""
+        conn = self.conn if self in self._instances else None
+        if conn is self._registeredConn:
+            return
+        if self._registeredConn is not None:
+            try:
+                self._selector.unregister(self._registeredConn)
+            except (KeyError, ValueError):
+                pass
+            self._registeredConn = None
+            self._wantWrite = False
+        if conn is not None:
+            self._selector.register(conn, selectors.EVENT_READ, self)
+            self._registeredConn = conn
+            # This is a new connection, anything left in the buffers belongs
+            # to the previous one.
+            self.inbuffer = bytearray()
+            self.outbuffer = bytearray()
+
+    def _setWantWrite(self, wantWrite):
+        if wantWrite == self._wantWrite or self._registeredConn is None:
+            return
+        events = selectors.EVENT_READ
+        if wantWrite:
+            events |= selectors.EVENT_WRITE
+        self._selector.modify(self._registeredConn, events, self)
+        self._wantWrite = wantWrite
+
+    def _handleSocketError(self, e):
+        Socket.SocketDriver._handleSocketError(self, e)
+        self._syncRegistration()
+
+    def reconnect(self, *args, **kwargs):
+        Socket.SocketDriver.reconnect(self, *args, **kwargs)
+        self._syncRegistration()
+
+    def _checkAndWriteOrReconnect(self):
+        Socket.SocketDriver._checkAndWriteOrReconnect(self)
+        if self.connected and self not in self._instances:
+            self._instances.append(self)
+        self._syncRegistration()
+
+    def die(self):
+        Socket.SocketDriver.die(self)
+        self._syncRegistration()
+
+    def _flush(self):
+        """Sends as much of the output buffer as the socket accepts."""
+        try:
+            sent = self.conn.send(self.outbuffer)
+            del self.outbuffer[:sent]
+            self.eagains = 0
+        except socket.error as e:
+            self._handleSocketError(e)
+            return
+        if not self.outbuffer:
+            self._setWantWrite(False)
+
+    def _sendIfMsgs(self):
+        """Moves the messages the Irc object is willing to send to the output
+        buffer.  They are actually sent once the socket is writable."""
+        if not self.connected:
+            return
+        if not self.zombie:
+            msg = self.irc.takeMsg()
+            while msg is not None:
+                self.outbuffer += str(msg).encode()
+                msg = self.irc.takeMsg()
+        if self.zombie:
+            # We are not in the selector anymore, so send what is left right
+            # now.
+            if self.outbuffer:
+                self._flush()
+            if not self.outbuffer:
+                self._reallyDie()
+        elif self.outbuffer:
+            self._setWantWrite(True)
+
+    @classmethod
+    def _select(cls):
+        if not cls._selecting.acquire(blocking=False):
+            # there's already a thread running this code, abort.
+            return
+        try:
+            timeout = drivers.getTimeout(inst.irc for inst in cls._instances)
+            events = cls._selector.select(timeout)
+            for (key, mask) in events:
+                inst = key.data
+                if mask & selectors.EVENT_READ:
+                    inst._read()
+                if mask & selectors.EVENT_WRITE and inst.connected and \
+                        inst.conn is key.fileobj:
+                    inst._flush()
+        finally:
+            cls._selecting.release()
+        for inst in cls._instances[:]:
+            if inst.irc and not inst.irc.zombie:
+                inst._sendIfMsgs()
+
+    def run(self):
+        now = time.time()
+        if self.nextReconnectTime is not None and now > self.nextReconnectTime:
+            self.reconnect()
+        elif self.writeCheckTime is not None and now > self.writeCheckTime:
+            self._checkAndWriteOrReconnect()
+        if self.zombie:
+            self._sendIfMsgs()
+            return
+        if not self._instances:
+            # Nobody is waiting on the selector, so we sleep here because
+            # otherwise we would spin at 100% CPU while disconnected.
+            timeout = drivers.getTimeout()
+            if self.nextReconnectTime is not None:
+                timeout = min(timeout, max(0, self.nextReconnectTime - now))
+            time.sleep(timeout)
+            return
+        if self._instances[0] is self:
+            # The selector watches all the connections, so a single driver
+            # has to wait on it each time drivers.run() is called.
+            self._select()
+
+    def _read(self):
+        """Called by _select() when we can read data."""
+        try:
+            while True:
+                n = self.conn.recv_into(self._recvBuffer)
+                if not n:
+                    # Socket was closed
+                    self._handleSocketError(None)
+                    return
+                self.inbuffer += self._recvBuffer[:n]
+                # SSL sockets may have already decrypted data that the
+                # selector will not tell us about.
+                pending = getattr(self.conn, 'pending', None)
+                if pending is None or not pending():
+                    break
+            self.eagains = 0 # If we successfully recv'ed, we can reset this.
+            end = self.inbuffer.rfind(b'\n')
+            if end == -1:
+                return
+            lines = self.inbuffer[:end].split(b'\n')
+            del self.inbuffer[:end+1]
+            for line in lines:
+                line = decode_raw_line(bytes(line))
+
+                msg = drivers.parseMsg(line)
+                if msg is not None and self.irc is not None:
+                    self.irc.feedMsg(msg)
+        except socket.timeout:
+            pass
+        except Socket.SSLError as e:
+            if e.args[0] == 'The read operation timed out':
+                pass
+            else:
+                self._handleSocketError(e)
+                return
+        except socket.error as e:
+            self._handleSocketError(e)
+            return
+
+
+Driver = SelectorDriver
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
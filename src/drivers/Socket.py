@@ -299,20 +299,7 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
                     self.currentServer.force_tls_verification:
                 self.starttls()
 
-            # Suppress this warning for loopback IPs.
-            if sys.version_info[0] < 3:
-                # Backported Python 2 ipaddress demands unicode instead of str
-                address = address.decode('utf-8')
-            elif (not network_config.requireStarttls()) and \
-                    (not network_config.ssl()) and \
-                    (not self.currentServer.force_tls_verification) and \
-                    (ipaddress is None or not ipaddress.ip_address(address).is_loopback):
-                drivers.log.warning(('Connection to network %s '
-                    'does not use SSL/TLS, which makes it vulnerable to '
-                    'man-in-the-middle attacks and passive eavesdropping. '
-                    'You should consider upgrading your connection to SSL/TLS '
-                    '<http://docs.limnoria.net/en/latest/use/faq.html#how-to-make-a-connection-secure>')
-                    % self.irc.network)
+            self._warnIfInsecure(address)
 
             conf.supybot.drivers.poll.addCallback(self.setTimeout)
             self.setTimeout()
@@ -332,6 +319,23 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
             return
         self._instances.append(self)
 
+    def _warnIfInsecure(self, address):
+        network_config = getattr(conf.supybot.networks, self.irc.network)
+        # Suppress this warning for loopback IPs.
+        if sys.version_info[0] < 3:
+            # Backported Python 2 ipaddress demands unicode instead of str
+            address = address.decode('utf-8')
+        elif (not network_config.requireStarttls()) and \
+                (not network_config.ssl()) and \
+                (not self.currentServer.force_tls_verification) and \
+                (ipaddress is None or not ipaddress.ip_address(address).is_loopback):
+            drivers.log.warning(('Connection to network %s '
+                'does not use SSL/TLS, which makes it vulnerable to '
+                'man-in-the-middle attacks and passive eavesdropping. '
+                'You should consider upgrading your connection to SSL/TLS '
+                '<http://docs.limnoria.net/en/latest/use/faq.html#how-to-make-a-connection-secure>')
+                % self.irc.network)
+
     def setTimeout(self):
         try:
             self.conn.settimeout(conf.supybot.drivers.poll())
@@ -393,8 +397,9 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
             network_config.ssl.authorityCertificate(),
         ])
 
-    def starttls(self):
-        assert 'ssl' in globals()
+    def _getSslOptions(self):
+        """Returns the keyword arguments to pass to utils.net.ssl_context or
+        utils.net.ssl_wrap_socket for the current server."""
         network_config = getattr(conf.supybot.networks, self.irc.network)
         certfile = network_config.certfile()
         if not certfile:
@@ -416,27 +421,34 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
                         'are vulnerable to man-in-the-middle attacks. Set '
                         'supybot.protocols.ssl.verifyCertificates to "true" '
                         'to enable validity checks.')
+        return dict(
+            certfile=certfile,
+            verify=verifyCertificates,
+            trusted_fingerprints=network_config.ssl.serverFingerprints(),
+            ca_file=network_config.ssl.authorityCertificate(),
+            )
+
+    def _logCertificateError(self, e):
+        drivers.log.error(('Certificate validation failed when '
+            'connecting to %s: %s\n'
+            'This means either someone is doing a man-in-the-middle '
+            'attack on your connection, or the server\'s certificate is '
+            'not in your trusted fingerprints list.')
+            % (self.irc.network, e.args[0]))
+
+    def starttls(self):
+        assert 'ssl' in globals()
         try:
             self.conn = utils.net.ssl_wrap_socket(self.conn,
                     logger=drivers.log,
                     hostname=self.currentServer.hostname,
-                    certfile=certfile,
-                    verify=verifyCertificates,
-                    trusted_fingerprints=network_config.ssl.serverFingerprints(),
-                    ca_file=network_config.ssl.authorityCertificate(),
-                    )
+                    **self._getSslOptions())
         except ssl.CertificateError as e:
-            drivers.log.error(('Certificate validation failed when '
-                'connecting to %s: %s\n'
-                'This means either someone is doing a man-in-the-middle '
-                'attack on your connection, or the server\'s certificate is '
-                'not in your trusted fingerprints list.')
-                % (self.irc.network, e.args[0]))
+            self._logCertificateError(e)
             raise ssl.CertificateError('Aborting because of failed certificate '
                     'verification.')
 
 
-
 Driver = SocketDriver
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
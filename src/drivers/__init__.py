@@ -34,9 +34,10 @@ Contains various drivers (network, file, and otherwise) for using IRC objects.
 
 import time
 import socket
+import asyncio
 from collections import namedtuple
 
-from .. import conf, ircdb, ircmsgs, ircutils, log as supylog, utils
+from .. import conf, ircdb, ircmsgs, ircutils, log as supylog, utils, world
 from ..utils import minisix
 
 
@@ -50,6 +51,7 @@ Server = namedtuple('Server', 'hostname port force_tls_verification')
 _drivers = {}
 _deadDrivers = set()
 _newDrivers = []
+_eventLoop = None
 
 class IrcDriver(object):
     """Base class for drivers."""
@@ -170,6 +172,54 @@ def run():
             _drivers[name].die()
             del _drivers[name]
         _drivers[name] = driver
+    # Give coroutines (eg. async commands) a chance to run, even if no
+    # driver is based on asyncio.
+    stepEventLoop(0)
+
+def getTimeout(ircs=()):
+    """Returns how long a driver may block waiting for input without delaying
+    the next scheduled event, or the next message of one of the given Irc
+    objects that is waiting for its throttle delay.  It is never more than
+    supybot.drivers.poll."""
+    from .. import schedule
+    now = time.time()
+    timeout = conf.supybot.drivers.poll()
+    nextEventTime = schedule.schedule.nextEventTime()
+    if nextEventTime is not None:
+        timeout = min(timeout, nextEventTime - now)
+    for irc in ircs:
+        if irc is not None and irc.queue and not irc.fastqueue:
+            timeout = min(timeout, irc.throttleDelay())
+    return max(0, timeout)
+
+def getEventLoop():
+    """Returns the asyncio event loop shared by the drivers and the
+    coroutines they run, creating it if needed."""
+    global _eventLoop
+    if _eventLoop is None:
+        _eventLoop = asyncio.new_event_loop()
+    return _eventLoop
+
+def runCoroutine(coro):
+    """Schedules the coroutine to be run by the event loop.  Can be called
+    from any thread."""
+    loop = getEventLoop()
+    if world.isMainThread():
+        return loop.create_task(coro)
+    else:
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+def stepEventLoop(timeout):
+    """Runs the event loop (if any) for at most `timeout` seconds, or one
+    iteration if `timeout` is zero."""
+    loop = _eventLoop
+    if loop is None or loop.is_running():
+        return
+    handle = loop.call_later(timeout, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        handle.cancel()
 
 class Log(object):
     """This is used to have a nice, consistent interface for drivers to use."""
@@ -30,7 +30,13 @@
 ###
 
 import os
+import re
 import time
+import heapq
+import threading
+import itertools
+import collections
+import collections.abc
 import operator
 
 from . import conf, ircutils, log, registry, unpreserve, utils, world
@@ -106,10 +112,17 @@ def unWildcardHostmask(hostmask):
     return _unwildcard_remover(hostmask)
 
 _invert = invertCapability
+
+# Versions of capability sets and of the users and channels databases, used to
+# know when the results cached by checkCapability are outdated.  They are
+# unique across all objects, so replacing an object changes the version too.
+_versions = itertools.count()
+
 class CapabilitySet(set):
     """A subclass of set handling basic capability stuff."""
-    __slots__ = ('__parent',)
+    __slots__ = ('__parent', 'version')
     def __init__(self, capabilities=()):
+        self.version = next(_versions)
         self.__parent = super(CapabilitySet, self)
         self.__parent.__init__()
         for capability in capabilities:
@@ -122,11 +135,13 @@ class CapabilitySet(set):
         if self.__parent.__contains__(inverted):
             self.__parent.remove(inverted)
         self.__parent.add(capability)
+        self.version = next(_versions)
 
     def remove(self, capability):
         """Removes a capability from the set."""
         capability = ircutils.toLower(capability)
         self.__parent.remove(capability)
+        self.version = next(_versions)
 
     def __contains__(self, capability):
         capability = ircutils.toLower(capability)
@@ -379,8 +394,8 @@ class IrcChannel(object):
                  capabilities=None, lobotomized=False, defaultAllow=True):
         self.defaultAllow = defaultAllow
         self.expiredBans = []
-        self.bans = bans or {}
-        self.ignores = ignores or {}
+        self.bans = HostmaskMatcher(bans, onExpire=self._banExpired)
+        self.ignores = HostmaskMatcher(ignores)
         self.silences = silences or []
         self.exceptions = exceptions or []
         self.capabilities = capabilities or CapabilitySet()
@@ -409,18 +424,13 @@ class IrcChannel(object):
                 ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
         return self.bans.pop(hostmask)
 
+    def _banExpired(self, hostmask, expiration):
+        self.expiredBans.append((hostmask, expiration))
+
     def checkBan(self, hostmask):
         """Checks whether a given hostmask is banned by the channel banlist."""
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
-        now = time.time()
-        for (pattern, expiration) in list(self.bans.items()):
-            if now < expiration or not expiration:
-                if ircutils.hostmaskPatternEqual(pattern, hostmask):
-                    return True
-            else:
-                self.expiredBans.append((pattern, expiration))
-                del self.bans[pattern]
-        return False
+        return self.bans.match(hostmask) is not None
 
     def addIgnore(self, hostmask, expiration=0):
         """Adds an ignore to the channel ignore list."""
@@ -466,15 +476,7 @@ class IrcChannel(object):
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
         if self.checkBan(hostmask):
             return True
-        now = time.time()
-        for (pattern, expiration) in list(self.ignores.items()):
-            if now < expiration or not expiration:
-                if ircutils.hostmaskPatternEqual(pattern, hostmask):
-                    return True
-            else:
-                del self.ignores[pattern]
-                # Later we may wish to keep expiredIgnores, but not now.
-        return False
+        return self.ignores.match(hostmask) is not None
 
     def preserve(self, fd, indent=''):
         def write(s):
@@ -596,6 +598,13 @@ class IrcUserCreator(Creator):
         self._checkId()
         self.u.gpgkeys.append(rest)
 
+    def deluser(self, rest, lineno):
+        # Only written to journals, see JournaledDictionary.
+        try:
+            self.users.delUser(int(rest))
+        except KeyError:
+            pass
+
     def finish(self):
         if self.u.name:
             try:
@@ -685,17 +694,385 @@ class IrcNetworkCreator(Creator):
 class DuplicateHostmask(ValueError):
     pass
 
-class UsersDictionary(utils.IterableMap):
+class _HostmaskGroup(object):
+    """A set of hostmask patterns, matched at once by a single regexp."""
+    __slots__ = ('patterns', '_regexp', '_matchers')
+    def __init__(self):
+        self.patterns = {} # pattern -> set of user ids
+        self._regexp = None
+        self._matchers = {} # pattern -> compiled pattern, built lazily
+
+    def add(self, pattern, id):
+        self.patterns.setdefault(pattern, set()).add(id)
+        self._regexp = None
+
+    def remove(self, pattern, id):
+        ids = self.patterns.get(pattern)
+        if ids is not None:
+            ids.discard(id)
+            if not ids:
+                del self.patterns[pattern]
+                self._matchers.pop(pattern, None)
+            self._regexp = None
+
+    def _getMatcher(self, pattern):
+        try:
+            return self._matchers[pattern]
+        except KeyError:
+            matcher = re.compile(
+                ircutils.hostmaskPatternRegexp(pattern) + '$', re.I).match
+            self._matchers[pattern] = matcher
+            return matcher
+
+    def match(self, hostmask):
+        """Returns the sets of ids of the patterns matching hostmask."""
+        if not self.patterns:
+            return []
+        if self._regexp is None:
+            self._regexp = re.compile('(?:%s)$' % '|'.join(
+                '(?:%s)' % ircutils.hostmaskPatternRegexp(pattern)
+                for pattern in self.patterns), re.I).match
+        if self._regexp(hostmask) is None:
+            return []
+        # At least one of them matches; groups are small enough to find
+        # which ones.
+        return [ids for (pattern, ids) in self.patterns.items()
+                if self._getMatcher(pattern)(hostmask) is not None]
+
+def _isAscii(s):
+    try:
+        s.encode('ascii')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+class HostmaskIndex(object):
+    """Finds which users a hostmask may belong to, without matching it
+    against the hostmasks of every user.
+
+    Hostmasks without wildcards are looked up in a dict.  Other hostmasks are
+    grouped by their longest literal part among: the end of the host, the
+    beginning of the host (for IP ranges), or the beginning of the nick; so
+    only the few groups that can match a given hostmask are tried.
+
+    This only returns candidates, which must still be checked with
+    IrcUser.checkHostmask; in particular, authentications that expired are
+    not removed from the index until the user is updated."""
+    __slots__ = ('_exact', '_auth', '_groups', '_keyLengths', '_others',
+                 '_indexed')
+    # Patterns whose literal parts are all shorter than this go in a single
+    # group, as their keys would not be selective enough.
+    minKeyLength = 3
+    _wildcardRe = re.compile(r'[*?]')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._exact = {} # normalized hostmask -> set of user ids
+        self._auth = {} # authenticated hostmask -> set of user ids
+        # For each kind of key (see _keys), key -> _HostmaskGroup
+        self._groups = ({}, {}, {})
+        # For each kind of key, the lengths of the keys in use, so lookups
+        # only try these.
+        self._keyLengths = tuple(collections.Counter() for _ in self._groups)
+        self._others = _HostmaskGroup()
+        self._indexed = {} # user id -> (hostmasks, authenticated hostmasks)
+
+    @classmethod
+    def _keys(cls, normalized):
+        """Returns the literal suffix, host prefix, and prefix of a
+        normalized pattern."""
+        host = normalized.rsplit('@', 1)[-1]
+        return (cls._wildcardRe.split(normalized)[-1],
+                cls._wildcardRe.split(host)[0],
+                cls._wildcardRe.split(normalized)[0])
+
+    def _getGroupKey(self, pattern):
+        """Returns the kind and key of the group pattern goes in, or
+        (None, None) for self._others."""
+        if not _isAscii(pattern):
+            # ircutils.toLower and re.I do not agree on non-ASCII characters.
+            return (None, None)
+        keys = self._keys(ircutils.toLower(pattern))
+        kind = max(range(len(keys)), key=lambda kind: len(keys[kind]))
+        if len(keys[kind]) < self.minKeyLength:
+            return (None, None)
+        return (kind, keys[kind])
+
+    def _addHostmask(self, id, pattern):
+        if '*' in pattern or '?' in pattern or not _isAscii(pattern):
+            (kind, key) = self._getGroupKey(pattern)
+            if kind is None:
+                group = self._others
+            else:
+                groups = self._groups[kind]
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = _HostmaskGroup()
+                    self._keyLengths[kind][len(key)] += 1
+            group.add(pattern, id)
+        else:
+            normalized = ircutils.toLower(pattern)
+            self._exact.setdefault(normalized, set()).add(id)
+
+    def _removeHostmask(self, id, pattern):
+        if '*' in pattern or '?' in pattern or not _isAscii(pattern):
+            (kind, key) = self._getGroupKey(pattern)
+            if kind is None:
+                self._others.remove(pattern, id)
+                return
+            groups = self._groups[kind]
+            group = groups.get(key)
+            if group is not None:
+                group.remove(pattern, id)
+                if not group.patterns:
+                    del groups[key]
+                    lengths = self._keyLengths[kind]
+                    lengths[len(key)] -= 1
+                    if not lengths[len(key)]:
+                        del lengths[len(key)]
+        else:
+            self._discard(self._exact, ircutils.toLower(pattern), id)
+
+    @staticmethod
+    def _discard(d, key, id):
+        ids = d.get(key)
+        if ids is not None:
+            ids.discard(id)
+            if not ids:
+                del d[key]
+
+    def update(self, id, user):
+        """Indexes the current hostmasks and authentications of user."""
+        self.updateHostmasks(id, frozenset(map(str, user.hostmasks)),
+            frozenset(authmask for (_, authmask) in user.auth))
+
+    def updateHostmasks(self, id, hostmasks, authmasks):
+        """Indexes the given frozensets of hostmasks and authenticated
+        hostmasks of the user with the given id, instead of the ones it had
+        so far."""
+        (oldHostmasks, oldAuthmasks) = \
+            self._indexed.get(id, (frozenset(), frozenset()))
+        for pattern in oldHostmasks - hostmasks:
+            self._removeHostmask(id, pattern)
+        for pattern in hostmasks - oldHostmasks:
+            self._addHostmask(id, pattern)
+        for authmask in oldAuthmasks - authmasks:
+            self._discard(self._auth, authmask, id)
+        for authmask in authmasks - oldAuthmasks:
+            self._auth.setdefault(authmask, set()).add(id)
+        self._indexed[id] = (hostmasks, authmasks)
+
+    def remove(self, id):
+        """Removes all the hostmasks of the user with the given id."""
+        (hostmasks, authmasks) = self._indexed.pop(id, ((), ()))
+        for pattern in hostmasks:
+            self._removeHostmask(id, pattern)
+        for authmask in authmasks:
+            self._discard(self._auth, authmask, id)
+
+    def candidates(self, hostmask):
+        """Returns the set of the ids of the users hostmask may belong to,
+        or None if the index can't tell."""
+        if not _isAscii(hostmask) or hostmask.count('@') != 1:
+            return None
+        ids = set(self._auth.get(hostmask, ()))
+        normalized = ircutils.toLower(hostmask)
+        ids.update(self._exact.get(normalized, ()))
+        host = normalized.rsplit('@', 1)[-1]
+        groups = [self._others]
+        (suffixes, hostPrefixes, prefixes) = self._groups
+        (suffixLengths, hostPrefixLengths, prefixLengths) = self._keyLengths
+        groups.extend(suffixes.get(normalized[-n:]) for n in suffixLengths)
+        groups.extend(hostPrefixes.get(host[:n]) for n in hostPrefixLengths)
+        groups.extend(prefixes.get(normalized[:n]) for n in prefixLengths)
+        for group in groups:
+            if group is not None:
+                for groupIds in group.match(hostmask):
+                    ids.update(groupIds)
+        return ids
+
+class HostmaskMatcher(collections.abc.MutableMapping):
+    """A dict of hostmask patterns to their expiration time (or 0 if they
+    do not expire), used for bans and ignores, that finds the patterns
+    matching a hostmask with a HostmaskIndex instead of trying each of them.
+
+    Patterns are removed once they expired, in order of expiration, when the
+    matcher is used; onExpire, if given, is then called with the pattern and
+    its expiration time."""
+    __slots__ = ('_expirations', '_index', '_heap', 'onExpire')
+    def __init__(self, patterns=None, onExpire=None):
+        self._expirations = {}
+        self._index = HostmaskIndex()
+        self._heap = [] # (expiration, pattern), may contain outdated items
+        self.onExpire = onExpire
+        if patterns:
+            self.update(patterns)
+
+    def __repr__(self):
+        return repr(self._expirations)
+
+    def __getitem__(self, pattern):
+        return self._expirations[pattern]
+
+    def __setitem__(self, pattern, expiration):
+        if pattern not in self._expirations:
+            self._index.updateHostmasks(pattern, frozenset([pattern]),
+                                        frozenset())
+        self._expirations[pattern] = expiration
+        if expiration:
+            heapq.heappush(self._heap, (expiration, pattern))
+            if len(self._heap) > 2*len(self._expirations) + 16:
+                # Too many outdated items.
+                self._heap = [(expiration, pattern) for (pattern, expiration)
+                              in self._expirations.items() if expiration]
+                heapq.heapify(self._heap)
+
+    def __delitem__(self, pattern):
+        del self._expirations[pattern]
+        self._index.remove(pattern)
+
+    def __iter__(self):
+        return iter(self._expirations)
+
+    def __len__(self):
+        return len(self._expirations)
+
+    def copy(self, onExpire=None):
+        """Returns a copy of the matcher, calling onExpire instead of the
+        callback of this one, which belongs to its owner (eg. the
+        IrcChannel whose bans it holds)."""
+        return HostmaskMatcher(self._expirations, onExpire=onExpire)
+
+    def expire(self, now=None):
+        """Removes the patterns that expired."""
+        if now is None:
+            now = time.time()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            (expiration, pattern) = heapq.heappop(heap)
+            if self._expirations.get(pattern) == expiration:
+                del self[pattern]
+                if self.onExpire is not None:
+                    self.onExpire(pattern, expiration)
+
+    def match(self, hostmask, now=None):
+        """Returns a pattern matching the hostmask, or None."""
+        self.expire(now)
+        candidates = self._index.candidates(hostmask)
+        if candidates is None:
+            candidates = [pattern for pattern in self._expirations
+                          if ircutils.hostmaskPatternEqual(pattern, hostmask)]
+        for pattern in candidates:
+            return pattern
+        return None
+
+
+class JournaledDictionary(utils.IterableMap):
+    """Base class of the databases stored in the format read by
+    unpreserve.Reader.
+
+    flush() writes the whole database to its file; other changes are only
+    appended to a journal file next to it, which is read after the database
+    file when opening it.  The journal is merged into the database file by
+    flush(), which is called periodically, and when the journal grows bigger
+    than supybot.databases.journalSize."""
+    __slots__ = ()
+    # The command starting entries in the file, eg. 'user'.
+    entryType = None
+
+    def journalFilename(self):
+        return self.filename + '.journal'
+
+    def _writeEntry(self, fd, key, entry):
+        fd.write('%s %s' % (self.entryType, key))
+        fd.write(os.linesep)
+        entry.preserve(fd, indent='  ')
+
+    def _writeDatabase(self, entries):
+        """Writes the given (key, entry) pairs to the database file, and
+        empties the journal, as they are now part of the database file."""
+        fd = utils.file.AtomicFile(self.filename)
+        for (key, entry) in entries:
+            self._writeEntry(fd, key, entry)
+        fd.close()
+        try:
+            os.remove(self.journalFilename())
+        except FileNotFoundError:
+            pass
+
+    def _readJournal(self, reader):
+        """Replays the journal (if any) on top of the database file."""
+        try:
+            fd = open(self.journalFilename())
+        except FileNotFoundError:
+            return
+        with fd:
+            reader.read(fd)
+
+    def journal(self, key, entry=None):
+        """Records that the entry with the given key was changed to `entry`,
+        or deleted if `entry` is None."""
+        if self.noFlush:
+            log.debug('Not journaling %s %s because of noFlush.',
+                      self.entryType, key)
+            return
+        maxSize = conf.supybot.databases.journalSize()
+        if self.filename is None or not maxSize or \
+                not os.path.exists(self.filename):
+            # The journal is only read if the database file exists.
+            self.flush()
+            return
+        try:
+            size = os.path.getsize(self.journalFilename())
+        except OSError:
+            size = 0
+        if size >= maxSize:
+            # Changes are already made in memory, so this includes this
+            # one.
+            self.flush()
+            return
+        with open(self.journalFilename(), 'a', encoding='utf8') as fd:
+            if entry is None:
+                fd.write('del%s %s' % (self.entryType, key))
+                fd.write(os.linesep)
+            else:
+                self._writeEntry(fd, key, entry)
+
+class UsersDictionary(JournaledDictionary):
     """A simple serialized-to-file User Database."""
     __slots__ = ('noFlush', 'filename', 'users', '_nameCache',
-            '_hostmaskCache', 'nextId')
+            '_hostmaskCache', '_hostmaskIndex', 'nextId', 'version')
+    entryType = 'user'
     def __init__(self):
+        self.version = next(_versions)
         self.noFlush = False
         self.filename = None
         self.users = {}
         self.nextId = 0
-        self._nameCache = utils.structures.CacheDict(1000)
-        self._hostmaskCache = utils.structures.CacheDict(1000)
+        # Both contain mappings in the two directions (name -> id and
+        # id -> name, hostmask -> id and id -> set of hostmasks), which must
+        # be evicted together.
+        self._nameCache = utils.structures.LRUCache(1000,
+            onEvict=self._nameEvicted)
+        self._hostmaskCache = utils.structures.LRUCache(1000,
+            onEvict=self._hostmaskEvicted)
+        self._hostmaskIndex = HostmaskIndex()
+
+    def _nameEvicted(self, key, value):
+        self._nameCache.pop(value, None)
+
+    def _hostmaskEvicted(self, key, value):
+        if isinstance(key, int):
+            for hostmask in value:
+                self._hostmaskCache.pop(hostmask, None)
+        else:
+            hostmasks = self._hostmaskCache.get(value)
+            if hostmasks is not None:
+                hostmasks.discard(key)
+                if not hostmasks:
+                    del self._hostmaskCache[value]
 
     # This is separate because the Creator has to access our instance.
     def open(self, filename):
@@ -705,6 +1082,7 @@ class UsersDictionary(utils.IterableMap):
             self.noFlush = True
             try:
                 reader.readFile(filename)
+                self._readJournal(unpreserve.Reader(IrcUserCreator, self))
                 self.noFlush = False
                 self.flush()
             except EnvironmentError as e:
@@ -718,10 +1096,12 @@ class UsersDictionary(utils.IterableMap):
     def reload(self):
         """Reloads the database from its file."""
         if self.filename is not None:
+            self.version = next(_versions)
             self.nextId = 0
             self.users.clear()
             self._nameCache.clear()
             self._hostmaskCache.clear()
+            self._hostmaskIndex.clear()
             try:
                 self.open(self.filename)
             except EnvironmentError as e:
@@ -733,12 +1113,7 @@ class UsersDictionary(utils.IterableMap):
         """Flushes the database to its file."""
         if not self.noFlush:
             if self.filename is not None:
-                fd = utils.file.AtomicFile(self.filename)
-                for (id, u) in sorted(self.users.items()):
-                    fd.write('user %s' % id)
-                    fd.write(os.linesep)
-                    u.preserve(fd, indent='  ')
-                fd.close()
+                self._writeDatabase(sorted(self.users.items()))
             else:
                 log.error('UsersDictionary.flush called with no filename.')
         else:
@@ -748,7 +1123,9 @@ class UsersDictionary(utils.IterableMap):
         self.flush()
         if self.flush in world.flushers:
             world.flushers.remove(self.flush)
+        self.version = next(_versions)
         self.users.clear()
+        self._hostmaskIndex.clear()
 
     def items(self):
         return self.users.items()
@@ -760,7 +1137,11 @@ class UsersDictionary(utils.IterableMap):
                 return self._hostmaskCache[s]
             except KeyError:
                 ids = {}
-                for (id, user) in self.users.items():
+                for id in sorted(self._hostmaskCandidates(s)):
+                    try:
+                        user = self.getUser(id)
+                    except KeyError:
+                        continue
                     x = user.checkHostmask(s)
                     if x:
                         ids[id] = x
@@ -777,22 +1158,39 @@ class UsersDictionary(utils.IterableMap):
                 else:
                     log.error('Multiple matches found in user database.  '
                               'Removing the offending hostmasks.')
+                    self.version = next(_versions)
                     for (id, hostmask) in ids.items():
                         log.error('Removing %q from user %s.', hostmask, id)
                         self.users[id].removeHostmask(hostmask)
+                        self._hostmaskIndex.update(id, self.users[id])
                     raise DuplicateHostmask('Ids %r matched.' % ids)
         else: # Not a hostmask, must be a name.
             s = s.lower()
             try:
                 return self._nameCache[s]
             except KeyError:
-                for (id, user) in self.users.items():
-                    if s == user.name.lower():
-                        self._nameCache[s] = id
-                        self._nameCache[id] = s
-                        return id
-                else:
-                    raise KeyError(s)
+                id = self._getUserIdFromName(s)
+                # The user may have been renamed since its former name was
+                # cached.
+                self._nameCache.pop(self._nameCache.pop(id, None), None)
+                self._nameCache[s] = id
+                self._nameCache[id] = s
+                return id
+
+    def _hostmaskCandidates(self, hostmask):
+        """Returns the ids of the users the hostmask may belong to."""
+        candidates = self._hostmaskIndex.candidates(hostmask)
+        if candidates is None:
+            return set(self.users)
+        return candidates
+
+    def _getUserIdFromName(self, name):
+        """Returns the id of the user with the given lowercased name, or
+        raises KeyError."""
+        for (id, user) in self.users.items():
+            if name == user.name.lower():
+                return id
+        raise KeyError(name)
 
     def getUser(self, id):
         """Returns a user given its id, name, or hostmask."""
@@ -828,6 +1226,7 @@ class UsersDictionary(utils.IterableMap):
         return len(self.users)
 
     def invalidateCache(self, id=None, hostmask=None, name=None):
+        self.version = next(_versions)
         if hostmask is not None:
             if hostmask in self._hostmaskCache:
                 id = self._hostmaskCache.pop(hostmask)
@@ -854,6 +1253,16 @@ class UsersDictionary(utils.IterableMap):
                 raise DuplicateHostmask(user.name, user.name)
         except KeyError:
             pass
+        self._checkHostmaskCollisions(user)
+        self.invalidateCache(user.id)
+        self.users[user.id] = user
+        self._hostmaskIndex.update(user.id, user)
+        if flush:
+            self.journal(user.id, user)
+
+    def _checkHostmaskCollisions(self, user):
+        """Raises DuplicateHostmask if a hostmask of the user matches
+        another user's."""
         for hostmask in user.hostmasks:
             for (i, u) in self.items():
                 if i == user.id:
@@ -868,14 +1277,12 @@ class UsersDictionary(utils.IterableMap):
                 for otherHostmask in u.hostmasks:
                     if ircutils.hostmaskPatternEqual(hostmask, otherHostmask):
                         raise DuplicateHostmask(u.name, hostmask)
-        self.invalidateCache(user.id)
-        self.users[user.id] = user
-        if flush:
-            self.flush()
 
     def delUser(self, id):
         """Removes a user from the database."""
+        self.version = next(_versions)
         del self.users[id]
+        self._hostmaskIndex.remove(id)
         if id in self._nameCache:
             del self._nameCache[self._nameCache[id]]
             del self._nameCache[id]
@@ -883,7 +1290,7 @@ class UsersDictionary(utils.IterableMap):
             for hostmask in list(self._hostmaskCache[id]):
                 del self._hostmaskCache[hostmask]
             del self._hostmaskCache[id]
-        self.flush()
+        self.journal(id)
 
     def newUser(self):
         """Allocates a new user in the database and returns it and its id."""
@@ -891,14 +1298,17 @@ class UsersDictionary(utils.IterableMap):
         self.nextId += 1
         id = self.nextId
         self.users[id] = user
-        self.flush()
+        # Not journaled, there is nothing to write until setUser() is called
+        # with its name.
         user.id = id
         return user
 
 
-class ChannelsDictionary(utils.IterableMap):
-    __slots__ = ('noFlush', 'filename', 'channels')
+class ChannelsDictionary(JournaledDictionary):
+    __slots__ = ('noFlush', 'filename', 'channels', 'version')
+    entryType = 'channel'
     def __init__(self):
+        self.version = next(_versions)
         self.noFlush = False
         self.filename = None
         self.channels = ircutils.IrcDict()
@@ -910,6 +1320,7 @@ class ChannelsDictionary(utils.IterableMap):
             reader = unpreserve.Reader(IrcChannelCreator, self)
             try:
                 reader.readFile(filename)
+                self._readJournal(unpreserve.Reader(IrcChannelCreator, self))
                 self.noFlush = False
                 self.flush()
             except EnvironmentError as e:
@@ -925,12 +1336,7 @@ class ChannelsDictionary(utils.IterableMap):
         """Flushes the channel database to its file."""
         if not self.noFlush:
             if self.filename is not None:
-                fd = utils.file.AtomicFile(self.filename)
-                for (channel, c) in sorted(self.channels.items()):
-                    fd.write('channel %s' % channel)
-                    fd.write(os.linesep)
-                    c.preserve(fd, indent='  ')
-                fd.close()
+                self._writeDatabase(sorted(self.channels.items()))
             else:
                 log.warning('ChannelsDictionary.flush without self.filename.')
         else:
@@ -940,11 +1346,13 @@ class ChannelsDictionary(utils.IterableMap):
         self.flush()
         if self.flush in world.flushers:
             world.flushers.remove(self.flush)
+        self.version = next(_versions)
         self.channels.clear()
 
     def reload(self):
         """Reloads the channel database from its file."""
         if self.filename is not None:
+            self.version = next(_versions)
             self.channels.clear()
             try:
                 self.open(self.filename)
@@ -966,14 +1374,16 @@ class ChannelsDictionary(utils.IterableMap):
     def setChannel(self, channel, ircChannel):
         """Sets a given channel to the IrcChannel object given."""
         channel = channel.lower()
+        self.version = next(_versions)
         self.channels[channel] = ircChannel
-        self.flush()
+        self.journal(channel, ircChannel)
 
     def items(self):
         return self.channels.items()
 
-class NetworksDictionary(utils.IterableMap):
+class NetworksDictionary(JournaledDictionary):
     __slots__ = ('noFlush', 'filename', 'networks')
+    entryType = 'network'
 
     def __init__(self):
         self.noFlush = False
@@ -987,6 +1397,7 @@ class NetworksDictionary(utils.IterableMap):
             reader = unpreserve.Reader(IrcNetworkCreator, self)
             try:
                 reader.readFile(filename)
+                self._readJournal(unpreserve.Reader(IrcNetworkCreator, self))
                 self.noFlush = False
                 self.flush()
             except EnvironmentError as e:
@@ -1002,12 +1413,7 @@ class NetworksDictionary(utils.IterableMap):
         """Flushes the network database to its file."""
         if not self.noFlush:
             if self.filename is not None:
-                fd = utils.file.AtomicFile(self.filename)
-                for (network, net) in sorted(self.networks.items()):
-                    fd.write('network %s' % network)
-                    fd.write(os.linesep)
-                    net.preserve(fd, indent='  ')
-                fd.close()
+                self._writeDatabase(sorted(self.networks.items()))
             else:
                 log.warning('NetworksDictionary.flush without self.filename.')
         else:
@@ -1044,7 +1450,7 @@ class NetworksDictionary(utils.IterableMap):
         """Sets a given network to the IrcNetwork object given."""
         network = network.lower()
         self.networks[network] = ircNetwork
-        self.flush()
+        self.journal(network, ircNetwork)
 
     def items(self):
         return self.networks.items()
@@ -1054,7 +1460,7 @@ class IgnoresDB(object):
     __slots__ = ('filename', 'hostmasks')
     def __init__(self):
         self.filename = None
-        self.hostmasks = {}
+        self.hostmasks = HostmaskMatcher()
 
     def open(self, filename):
         self.filename = filename
@@ -1105,14 +1511,7 @@ class IgnoresDB(object):
             log.warning('IgnoresDB.reload called without self.filename.')
 
     def checkIgnored(self, prefix):
-        now = time.time()
-        for (hostmask, expiration) in list(self.hostmasks.items()):
-            if expiration and now > expiration:
-                del self.hostmasks[hostmask]
-            else:
-                if ircutils.hostmaskPatternEqual(hostmask, prefix):
-                    return True
-        return False
+        return self.hostmasks.match(prefix) is not None
 
     def add(self, hostmask, expiration=0):
         assert ircutils.isUserHostmask(hostmask), 'got %s' % hostmask
@@ -1122,21 +1521,533 @@ class IgnoresDB(object):
         del self.hostmasks[hostmask]
 
 
+###
+# SQLite backend
+###
+
+_sqliteSchema = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    normalized_name TEXT NOT NULL,
+    ignored INTEGER NOT NULL,
+    secure INTEGER NOT NULL,
+    hashed INTEGER NOT NULL,
+    password TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS users_name ON users (normalized_name);
+CREATE TABLE IF NOT EXISTS user_hostmasks (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    hostmask TEXT NOT NULL,
+    normalized_hostmask TEXT NOT NULL,
+    is_pattern INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS user_hostmasks_user ON user_hostmasks (user_id);
+CREATE INDEX IF NOT EXISTS user_hostmasks_exact
+    ON user_hostmasks (normalized_hostmask) WHERE NOT is_pattern;
+CREATE TABLE IF NOT EXISTS user_nicks (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    network TEXT NOT NULL,
+    nick TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS user_nicks_user ON user_nicks (user_id);
+CREATE INDEX IF NOT EXISTS user_nicks_nick ON user_nicks (network, nick);
+CREATE TABLE IF NOT EXISTS user_capabilities (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    capability TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS user_capabilities_user
+    ON user_capabilities (user_id);
+CREATE TABLE IF NOT EXISTS user_gpgkeys (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    gpgkey TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS user_gpgkeys_user ON user_gpgkeys (user_id);
+
+CREATE TABLE IF NOT EXISTS channels (
+    name TEXT PRIMARY KEY,
+    lobotomized INTEGER NOT NULL,
+    default_allow INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS channel_capabilities (
+    channel TEXT NOT NULL REFERENCES channels (name) ON DELETE CASCADE,
+    capability TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS channel_capabilities_channel
+    ON channel_capabilities (channel);
+CREATE TABLE IF NOT EXISTS channel_bans (
+    channel TEXT NOT NULL REFERENCES channels (name) ON DELETE CASCADE,
+    hostmask TEXT NOT NULL,
+    expiration INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS channel_bans_channel ON channel_bans (channel);
+CREATE TABLE IF NOT EXISTS channel_ignores (
+    channel TEXT NOT NULL REFERENCES channels (name) ON DELETE CASCADE,
+    hostmask TEXT NOT NULL,
+    expiration INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS channel_ignores_channel
+    ON channel_ignores (channel);
+
+CREATE TABLE IF NOT EXISTS ignores (
+    hostmask TEXT PRIMARY KEY,
+    expiration INTEGER NOT NULL);
+"""
+
+def _openSqlite(filename):
+    """Opens the SQLite database of the users, channels, and ignores,
+    creating its tables if needed."""
+    import sqlite3
+    # Threaded commands use the databases too; access is serialized by the
+    # callers.
+    db = sqlite3.connect(filename, check_same_thread=False)
+    # With a write-ahead log, each change only appends to the log, and is
+    # safe once committed.
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA foreign_keys=ON')
+    db.create_function('hostmask_pattern_equal', 2,
+                       ircutils.hostmaskPatternEqual)
+    db.executescript(_sqliteSchema)
+    return db
+
+def _isHostmaskPattern(hostmask):
+    """Returns whether the hostmask must be matched with
+    hostmaskPatternEqual instead of looked up by its normalized form."""
+    return '*' in hostmask or '?' in hostmask or not _isAscii(hostmask)
+
+class SqliteUsersDictionary(UsersDictionary):
+    """A UsersDictionary stored in SQLite.
+
+    Users are only loaded from the database when they are needed, then kept
+    in memory (so their authentications are kept).  Only the hostmasks with
+    wildcards are always in memory, to be matched by the HostmaskIndex;
+    names, other hostmasks, and nicks are looked up by the database."""
+    __slots__ = ('db', '_lock', '_written')
+    def __init__(self):
+        UsersDictionary.__init__(self)
+        self.db = None
+        self._lock = threading.RLock()
+        # id -> _userState() of the loaded users, as in the database
+        self._written = {}
+
+    @staticmethod
+    def _userState(user):
+        return (user.name, user.ignore, user.secure, user.hashed,
+                user.password, tuple(user.hostmasks),
+                tuple((network, tuple(nicks))
+                      for (network, nicks) in user.nicks.items()),
+                frozenset(user.capabilities), tuple(user.gpgkeys))
+
+    def open(self, filename):
+        self.filename = filename
+        self.db = _openSqlite(filename)
+        with self._lock:
+            (maxId,) = self.db.execute('SELECT MAX(id) FROM users').fetchone()
+            self.nextId = maxId or 0
+            patterns = {}
+            cursor = self.db.execute('SELECT user_id, hostmask '
+                                     'FROM user_hostmasks WHERE is_pattern')
+            for (id, hostmask) in cursor:
+                patterns.setdefault(id, set()).add(hostmask)
+        for (id, hostmasks) in patterns.items():
+            self._hostmaskIndex.updateHostmasks(
+                id, frozenset(hostmasks), frozenset())
+
+    def reload(self):
+        """Reloads the database."""
+        if self.filename is not None:
+            self.version = next(_versions)
+            self.nextId = 0
+            self.users.clear()
+            self._written.clear()
+            self._nameCache.clear()
+            self._hostmaskCache.clear()
+            self._hostmaskIndex.clear()
+            self.db.close()
+            self.open(self.filename)
+        else:
+            log.error('UsersDictionary.reload called with no filename.')
+
+    def _writeUser(self, id, user):
+        self._written[id] = self._userState(user)
+        self.db.execute('DELETE FROM users WHERE id=?', (id,))
+        self.db.execute('INSERT INTO users (id, name, normalized_name, '
+                        'ignored, secure, hashed, password) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (id, user.name, user.name.lower(), user.ignore,
+                         user.secure, user.hashed, user.password))
+        self.db.executemany('INSERT INTO user_hostmasks (user_id, hostmask, '
+                            'normalized_hostmask, is_pattern) '
+                            'VALUES (?, ?, ?, ?)',
+                            [(id, str(hostmask),
+                              ircutils.toLower(hostmask),
+                              _isHostmaskPattern(hostmask))
+                             for hostmask in user.hostmasks])
+        self.db.executemany('INSERT INTO user_nicks (user_id, network, nick) '
+                            'VALUES (?, ?, ?)',
+                            [(id, network, nick)
+                             for (network, nicks) in user.nicks.items()
+                             for nick in nicks])
+        self.db.executemany('INSERT INTO user_capabilities '
+                            '(user_id, capability) VALUES (?, ?)',
+                            [(id, capability)
+                             for capability in user.capabilities])
+        self.db.executemany('INSERT INTO user_gpgkeys (user_id, gpgkey) '
+                            'VALUES (?, ?)',
+                            [(id, key) for key in user.gpgkeys])
+
+    def _loadUser(self, id):
+        row = self.db.execute('SELECT name, ignored, secure, hashed, password '
+                              'FROM users WHERE id=?', (id,)).fetchone()
+        if row is None:
+            raise KeyError(id)
+        (name, ignore, secure, hashed, password) = row
+        user = IrcUser(name=name, ignore=bool(ignore), secure=bool(secure),
+                       hashed=bool(hashed), password=password)
+        for (hostmask,) in self.db.execute(
+                'SELECT hostmask FROM user_hostmasks WHERE user_id=? '
+                'ORDER BY rowid', (id,)):
+            user.hostmasks.add(hostmask)
+        for (network, nick) in self.db.execute(
+                'SELECT network, nick FROM user_nicks WHERE user_id=? '
+                'ORDER BY rowid', (id,)):
+            user.nicks.setdefault(network, []).append(nick)
+        for (capability,) in self.db.execute(
+                'SELECT capability FROM user_capabilities WHERE user_id=? '
+                'ORDER BY rowid', (id,)):
+            user.capabilities.add(capability)
+        for (key,) in self.db.execute(
+                'SELECT gpgkey FROM user_gpgkeys WHERE user_id=? '
+                'ORDER BY rowid', (id,)):
+            user.gpgkeys.append(key)
+        user.id = id
+        self.users[id] = user
+        self._written[id] = self._userState(user)
+        return user
+
+    def journal(self, key, entry=None):
+        if self.noFlush:
+            return
+        with self._lock, self.db:
+            if entry is None:
+                self._written.pop(key, None)
+                self.db.execute('DELETE FROM users WHERE id=?', (key,))
+            else:
+                self._writeUser(key, entry)
+
+    def flush(self):
+        """Writes the users loaded in memory which were changed without
+        calling setUser to the database."""
+        if self.noFlush or self.db is None:
+            return
+        with self._lock, self.db:
+            for (id, user) in self.users.items():
+                if user.name and \
+                        self._written.get(id) != self._userState(user):
+                    self._writeUser(id, user)
+
+    def close(self):
+        self.flush()
+        if self.flush in world.flushers:
+            world.flushers.remove(self.flush)
+        self.version = next(_versions)
+        self.users.clear()
+        self._written.clear()
+        self._hostmaskIndex.clear()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def _allIds(self):
+        with self._lock:
+            ids = set(id for (id,) in self.db.execute('SELECT id FROM users'))
+        # Including users allocated by newUser() and not set yet.
+        ids.update(self.users)
+        return ids
+
+    def items(self):
+        return [(id, self.getUser(id)) for id in sorted(self._allIds())]
+
+    def numUsers(self):
+        return len(self._allIds())
+
+    def getUser(self, id):
+        """Returns a user given its id, name, or hostmask."""
+        if not isinstance(id, int):
+            # Must be a string.  Get the UserId first.
+            id = self.getUserId(id)
+        try:
+            return self.users[id]
+        except KeyError:
+            with self._lock:
+                return self._loadUser(id)
+
+    def _hostmaskCandidates(self, hostmask):
+        candidates = self._hostmaskIndex.candidates(hostmask)
+        if candidates is None:
+            return self._allIds()
+        with self._lock:
+            candidates.update(id for (id,) in self.db.execute(
+                'SELECT user_id FROM user_hostmasks '
+                'WHERE normalized_hostmask=? AND NOT is_pattern',
+                (ircutils.toLower(hostmask),)))
+        return candidates
+
+    def _getUserIdFromName(self, name):
+        with self._lock:
+            row = self.db.execute('SELECT id FROM users '
+                                  'WHERE normalized_name=?', (name,)).fetchone()
+        if row is not None:
+            return row[0]
+        for (id, user) in self.users.items():
+            # Users allocated by newUser() and not set yet.
+            if name == user.name.lower():
+                return id
+        raise KeyError(name)
+
+    def getUserFromNick(self, network, nick):
+        """Return a user given its nick."""
+        with self._lock:
+            ids = [id for (id,) in self.db.execute(
+                'SELECT user_id FROM user_nicks WHERE network=? AND nick=?',
+                (network, nick))]
+        for id in ids:
+            user = self.getUser(id)
+            if nick in user.nicks.get(network, ()):
+                return user
+        return None
+
+    def _checkHostmaskCollisions(self, user):
+        for hostmask in user.hostmasks:
+            for id in self._hostmaskCandidates(hostmask):
+                if id == user.id:
+                    continue
+                u = self.getUser(id)
+                if u.checkHostmask(hostmask):
+                    raise DuplicateHostmask(u.name, hostmask)
+            if not _isHostmaskPattern(hostmask):
+                # Already found by the candidates above.
+                continue
+            # Other users' hostmasks matched by this one.
+            with self._lock:
+                row = self.db.execute(
+                    'SELECT user_id FROM user_hostmasks WHERE user_id!=? '
+                    'AND hostmask_pattern_equal(?, hostmask) LIMIT 1',
+                    (user.id, hostmask)).fetchone()
+            if row is not None:
+                raise DuplicateHostmask(self.getUser(row[0]).name, hostmask)
+
+    def delUser(self, id):
+        """Removes a user from the database."""
+        self.getUser(id) # Loads it, if needed
+        UsersDictionary.delUser(self, id)
+
+
+class SqliteChannelsDictionary(ChannelsDictionary):
+    """A ChannelsDictionary stored in SQLite.  Channels are only loaded from
+    the database when they are needed."""
+    __slots__ = ('db', '_lock')
+    def __init__(self):
+        ChannelsDictionary.__init__(self)
+        self.db = None
+        self._lock = threading.RLock()
+
+    def open(self, filename):
+        self.filename = filename
+        self.db = _openSqlite(filename)
+
+    def reload(self):
+        """Reloads the channel database."""
+        if self.filename is not None:
+            self.version = next(_versions)
+            self.channels.clear()
+            self.db.close()
+            self.open(self.filename)
+        else:
+            log.warning('ChannelsDictionary.reload without self.filename.')
+
+    def _writeChannel(self, name, channel):
+        self.db.execute('DELETE FROM channels WHERE name=?', (name,))
+        self.db.execute('INSERT INTO channels (name, lobotomized, '
+                        'default_allow) VALUES (?, ?, ?)',
+                        (name, channel.lobotomized, channel.defaultAllow))
+        self.db.executemany('INSERT INTO channel_capabilities '
+                            '(channel, capability) VALUES (?, ?)',
+                            [(name, capability)
+                             for capability in channel.capabilities])
+        self.db.executemany('INSERT INTO channel_bans '
+                            '(channel, hostmask, expiration) '
+                            'VALUES (?, ?, ?)',
+                            [(name, hostmask, expiration) for
+                             (hostmask, expiration) in channel.bans.items()])
+        self.db.executemany('INSERT INTO channel_ignores '
+                            '(channel, hostmask, expiration) '
+                            'VALUES (?, ?, ?)',
+                            [(name, hostmask, expiration) for
+                             (hostmask, expiration) in channel.ignores.items()])
+
+    def _loadChannel(self, name):
+        row = self.db.execute('SELECT lobotomized, default_allow '
+                              'FROM channels WHERE name=?', (name,)).fetchone()
+        if row is None:
+            return None
+        channel = IrcChannel()
+        (channel.lobotomized, channel.defaultAllow) = map(bool, row)
+        for (capability,) in self.db.execute(
+                'SELECT capability FROM channel_capabilities '
+                'WHERE channel=? ORDER BY rowid', (name,)):
+            channel.capabilities.add(capability)
+        for (hostmask, expiration) in self.db.execute(
+                'SELECT hostmask, expiration FROM channel_bans '
+                'WHERE channel=? ORDER BY rowid', (name,)):
+            channel.bans[hostmask] = expiration
+        for (hostmask, expiration) in self.db.execute(
+                'SELECT hostmask, expiration FROM channel_ignores '
+                'WHERE channel=? ORDER BY rowid', (name,)):
+            channel.ignores[hostmask] = expiration
+        return channel
+
+    def journal(self, key, entry=None):
+        if self.noFlush:
+            return
+        with self._lock, self.db:
+            if entry is None:
+                self.db.execute('DELETE FROM channels WHERE name=?', (key,))
+            else:
+                self._writeChannel(key, entry)
+
+    def flush(self):
+        """Writes the channels loaded in memory to the database, as they
+        may have been changed without calling setChannel."""
+        if self.noFlush or self.db is None:
+            return
+        with self._lock, self.db:
+            for (name, channel) in self.channels.items():
+                self._writeChannel(name, channel)
+
+    def close(self):
+        self.flush()
+        if self.flush in world.flushers:
+            world.flushers.remove(self.flush)
+        self.version = next(_versions)
+        self.channels.clear()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def getChannel(self, channel):
+        """Returns an IrcChannel object for the given channel."""
+        channel = channel.lower()
+        if channel not in self.channels:
+            with self._lock:
+                c = self._loadChannel(channel)
+            self.channels[channel] = c or IrcChannel()
+        return self.channels[channel]
+
+    def items(self):
+        with self._lock:
+            names = set(name for (name,) in
+                        self.db.execute('SELECT name FROM channels'))
+        names.update(self.channels)
+        return [(name, self.getChannel(name)) for name in sorted(names)]
+
+
+class SqliteIgnoresDB(IgnoresDB):
+    """An IgnoresDB stored in SQLite.  Ignores are still all kept in
+    memory, as there are usually few of them."""
+    __slots__ = ('db', '_lock')
+    def __init__(self):
+        IgnoresDB.__init__(self)
+        self.db = None
+        self._lock = threading.RLock()
+
+    def open(self, filename):
+        self.filename = filename
+        self.db = _openSqlite(filename)
+        with self._lock:
+            for (hostmask, expiration) in self.db.execute(
+                    'SELECT hostmask, expiration FROM ignores'):
+                IgnoresDB.add(self, hostmask, expiration)
+
+    def flush(self):
+        """Removes the expired ignores from the database."""
+        if self.db is None:
+            return
+        with self._lock, self.db:
+            self.db.execute('DELETE FROM ignores '
+                            'WHERE expiration != 0 AND expiration <= ?',
+                            (time.time(),))
+
+    def close(self):
+        if self.flush in world.flushers:
+            world.flushers.remove(self.flush)
+        self.flush()
+        self.hostmasks.clear()
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def reload(self):
+        if self.filename is not None:
+            self.hostmasks.clear()
+            self.db.close()
+            self.open(self.filename)
+        else:
+            log.warning('IgnoresDB.reload called without self.filename.')
+
+    def add(self, hostmask, expiration=0):
+        IgnoresDB.add(self, hostmask, expiration)
+        with self._lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO ignores '
+                            '(hostmask, expiration) VALUES (?, ?)',
+                            (hostmask, expiration))
+
+    def remove(self, hostmask):
+        IgnoresDB.remove(self, hostmask)
+        with self._lock, self.db:
+            self.db.execute('DELETE FROM ignores WHERE hostmask=?',
+                            (hostmask,))
+
+
+def copyToSqlite(filename, users, channels, ignores):
+    """Copies the given users, channels, and ignores databases to the SQLite
+    database in filename (eg. to migrate from the flat files)."""
+    sqliteUsers = SqliteUsersDictionary()
+    sqliteUsers.open(filename)
+    with sqliteUsers._lock, sqliteUsers.db:
+        for (id, user) in users.items():
+            sqliteUsers._writeUser(id, user)
+    sqliteUsers.db.close()
+
+    sqliteChannels = SqliteChannelsDictionary()
+    sqliteChannels.open(filename)
+    with sqliteChannels._lock, sqliteChannels.db:
+        for (name, channel) in channels.items():
+            sqliteChannels._writeChannel(name, channel)
+    sqliteChannels.db.close()
+
+    sqliteIgnores = SqliteIgnoresDB()
+    sqliteIgnores.open(filename)
+    for (hostmask, expiration) in ignores.hostmasks.items():
+        sqliteIgnores.add(hostmask, expiration)
+    sqliteIgnores.db.close()
+
+
 confDir = conf.supybot.directories.conf()
-try:
-    userFile = os.path.join(confDir, conf.supybot.databases.users.filename())
-    users = UsersDictionary()
-    users.open(userFile)
-except EnvironmentError as e:
-    log.warning('Couldn\'t open user database: %s', e)
+if conf.supybot.databases.backend() == 'sqlite':
+    sqliteFile = os.path.join(confDir,
+            conf.supybot.databases.backend.sqliteFilename())
+    users = SqliteUsersDictionary()
+    users.open(sqliteFile)
+    channels = SqliteChannelsDictionary()
+    channels.open(sqliteFile)
+else:
+    try:
+        userFile = os.path.join(confDir,
+                                conf.supybot.databases.users.filename())
+        users = UsersDictionary()
+        users.open(userFile)
+    except EnvironmentError as e:
+        log.warning('Couldn\'t open user database: %s', e)
 
-try:
-    channelFile = os.path.join(confDir,
-                               conf.supybot.databases.channels.filename())
-    channels = ChannelsDictionary()
-    channels.open(channelFile)
-except EnvironmentError as e:
-    log.warning('Couldn\'t open channel database: %s', e)
+    try:
+        channelFile = os.path.join(confDir,
+                                   conf.supybot.databases.channels.filename())
+        channels = ChannelsDictionary()
+        channels.open(channelFile)
+    except EnvironmentError as e:
+        log.warning('Couldn\'t open channel database: %s', e)
 
 try:
     networkFile = os.path.join(confDir,
@@ -1146,13 +2057,17 @@ try:
 except EnvironmentError as e:
     log.warning('Couldn\'t open network database: %s', e)
 
-try:
-    ignoreFile = os.path.join(confDir,
-                              conf.supybot.databases.ignores.filename())
-    ignores = IgnoresDB()
-    ignores.open(ignoreFile)
-except EnvironmentError as e:
-    log.warning('Couldn\'t open ignore database: %s', e)
+if conf.supybot.databases.backend() == 'sqlite':
+    ignores = SqliteIgnoresDB()
+    ignores.open(sqliteFile)
+else:
+    try:
+        ignoreFile = os.path.join(confDir,
+                                  conf.supybot.databases.ignores.filename())
+        ignores = IgnoresDB()
+        ignores.open(ignoreFile)
+    except EnvironmentError as e:
+        log.warning('Couldn\'t open ignore database: %s', e)
 
 
 world.flushers.append(users.flush)
@@ -1226,6 +2141,46 @@ def _checkCapabilityForUnknownUser(capability, users=users, channels=channels,
     else:
         return _x(capability, conf.supybot.capabilities.default())
 
+class CapabilityCache(object):
+    """Caches the results of checkCapability.
+
+    Each result is stored with the versions of what it was computed from (the
+    users and channels databases, the capabilities of the user and of the
+    channel, and the supybot.capabilities values), and is computed again if
+    any of them changed since."""
+    __slots__ = ('cache', 'hits', 'misses', 'invalidations')
+    def __init__(self, size=10000):
+        self.cache = utils.structures.LRUCache(size)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        """Returns the number of hits, misses, and outdated results found in
+        the cache, and its size."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'invalidations': self.invalidations, 'size': len(self.cache)}
+
+capabilityCache = CapabilityCache()
+
+# Changed when supybot.capabilities, supybot.capabilities.registeredUsers, or
+# supybot.capabilities.default are set.
+_capabilityConfVersion = next(_versions)
+def _capabilityConfChanged():
+    global _capabilityConfVersion
+    _capabilityConfVersion = next(_versions)
+
+def _capabilityStamp(users, channels, user, channel, defaults):
+    return (users.version, channels.version, _capabilityConfVersion,
+            user is not None and
+                (user.capabilities.version, user.ignore, user.secure),
+            channel is not None and
+                (channel.capabilities.version, channel.defaultAllow),
+            defaults[0].version, defaults[1].version)
+
 def checkCapability(hostmask, capability, users=users, channels=channels,
                     ignoreOwner=False, ignoreChannelOp=False,
                     ignoreDefaultAllow=False):
@@ -1249,22 +2204,51 @@ def checkCapability(hostmask, capability, users=users, channels=channels,
             '@' not in hostmask or
             '__no_testcap__' not in hostmask.split('@')[1]):
         return _x(capability, True)
+    key = (hostmask, capability, ignoreOwner, ignoreChannelOp,
+           ignoreDefaultAllow, id(users), id(channels))
+    try:
+        (ret, u, c, defaults, stamp) = capabilityCache.cache[key]
+    except KeyError:
+        pass
+    else:
+        if stamp == _capabilityStamp(users, channels, u, c, defaults):
+            capabilityCache.hits += 1
+            return ret
+        capabilityCache.invalidations += 1
+    capabilityCache.misses += 1
+    defaults = (conf.supybot.capabilities(),
+                conf.supybot.capabilities.registeredUsers())
+    (ret, u) = _checkCapability(hostmask, capability, users, channels,
+                                ignoreOwner, ignoreChannelOp,
+                                ignoreDefaultAllow)
+    c = None
+    if isChannelCapability(capability):
+        # Only there if it was used to compute the result.
+        c = channels.channels.get(fromChannelCapability(capability)[0])
+    capabilityCache.cache[key] = (ret, u, c, defaults,
+            _capabilityStamp(users, channels, u, c, defaults))
+    return ret
+
+def _checkCapability(hostmask, capability, users, channels, ignoreOwner,
+                     ignoreChannelOp, ignoreDefaultAllow):
+    """Does the work of checkCapability, and returns its result and the
+    user."""
     try:
         u = users.getUser(hostmask)
         if u.secure and not u.checkHostmask(hostmask, useAuth=False):
             raise KeyError
     except KeyError:
         # Raised when no hostmasks match.
-        return _checkCapabilityForUnknownUser(capability, users=users,
-                channels=channels, ignoreDefaultAllow=ignoreDefaultAllow)
+        return (_checkCapabilityForUnknownUser(capability, users=users,
+                channels=channels, ignoreDefaultAllow=ignoreDefaultAllow), None)
     except ValueError as e:
         # Raised when multiple hostmasks match.
         log.warning('%s: %s', hostmask, e)
-        return _checkCapabilityForUnknownUser(capability, users=users,
-              channels=channels, ignoreDefaultAllow=ignoreDefaultAllow)
+        return (_checkCapabilityForUnknownUser(capability, users=users,
+              channels=channels, ignoreDefaultAllow=ignoreDefaultAllow), None)
     if capability in u.capabilities:
         try:
-            return u._checkCapability(capability, ignoreOwner)
+            return (u._checkCapability(capability, ignoreOwner), u)
         except KeyError:
             pass
     if isChannelCapability(capability):
@@ -1273,26 +2257,26 @@ def checkCapability(hostmask, capability, users=users, channels=channels,
             try:
                 chanop = makeChannelCapability(channel, 'op')
                 if u._checkCapability(chanop):
-                    return _x(capability, True)
+                    return (_x(capability, True), u)
             except KeyError:
                 pass
         c = channels.getChannel(channel)
         if capability in c.capabilities:
-            return c._checkCapability(capability)
+            return (c._checkCapability(capability), u)
         elif not ignoreDefaultAllow:
-            return _x(capability, c.defaultAllow)
+            return (_x(capability, c.defaultAllow), u)
         else:
-            return False
+            return (False, u)
     defaultCapabilities = conf.supybot.capabilities()
     defaultCapabilitiesRegistered = conf.supybot.capabilities.registeredUsers()
     if capability in defaultCapabilities:
-        return defaultCapabilities.check(capability)
+        return (defaultCapabilities.check(capability), u)
     elif capability in defaultCapabilitiesRegistered:
-        return defaultCapabilitiesRegistered.check(capability)
+        return (defaultCapabilitiesRegistered.check(capability), u)
     elif ignoreDefaultAllow:
-        return _x(capability, False)
+        return (_x(capability, False), u)
     else:
-        return _x(capability, conf.supybot.capabilities.default())
+        return (_x(capability, conf.supybot.capabilities.default()), u)
 
 
 def checkCapabilities(hostmask, capabilities, requireAll=False):
@@ -1358,6 +2342,12 @@ conf.registerGlobalValue(conf.supybot.capabilities, 'default',
     have the capability for whatever command they wish to run.
     To set this in a channel-specific way, use the 'channel capability
     setdefault' command."""))
+for value in (conf.supybot.capabilities,
+              conf.supybot.capabilities.registeredUsers,
+              conf.supybot.capabilities.default):
+    value.addCallback(_capabilityConfChanged)
+del value
+
 conf.registerGlobalValue(conf.supybot.capabilities, 'private',
     registry.SpaceSeparatedListOfStrings([], """Determines what capabilities
     the bot will never tell to a non-admin whether or not a user has them."""))
@@ -35,7 +35,7 @@ import random
 import base64
 import textwrap
 import warnings
-import collections
+import collections.abc
 
 try:
     class crypto:
@@ -54,7 +54,7 @@ try:
 except ImportError:
     scram = None
 
-from . import conf, ircdb, ircmsgs, ircutils, log, utils, world
+from . import conf, ircdb, ircmsgs, ircutils, log, registry, utils, world
 from .drivers import Server
 from .utils.str import rsplit
 from .utils.iter import chain
@@ -119,6 +119,12 @@ class IrcCallback(IrcCommandDispatcher, log.Firewalled):
     callBefore = ()
     echoMessage = False
     echo_message = False  # deprecated alias of echoMessage
+    # True if the __call__ method defined by this class does nothing but call
+    # the doCommand methods, so Irc objects do not need to call it for
+    # messages without such a method.  Only the class defining __call__ is
+    # checked, so subclasses overriding it are always called unless they set
+    # it too.
+    onlyDispatchesOnCommand = True
     __firewalled__ = {'die': None,
                       'reset': None,
                       '__call__': None,
@@ -209,12 +215,111 @@ class IrcCallback(IrcCommandDispatcher, log.Firewalled):
         """Makes the callback die.  Called when the parent Irc object dies."""
         pass
 
+class _DispatchTable(object):
+    """Lists, for each command, the callbacks which have to be called on
+    messages with this command, in the same order as the list of callbacks
+    it is built from; and the callbacks which have an inFilter."""
+    __slots__ = ('version', 'callbacks', 'inFilters', '_handlers', '_byCommand')
+    def __init__(self, callbacks, version=None):
+        self.version = version
+        self.callbacks = [cb for cb in callbacks if cb is not None]
+        self.inFilters = [cb for cb in self.callbacks
+                          if not isinstance(cb, IrcCallback) or
+                          type(cb).inFilter is not IrcCallback.inFilter]
+        # (callback, names of its doCommand methods), the names being None
+        # if it has to be called on all messages.
+        self._handlers = [(cb, self._handlerNames(cb))
+                          for cb in self.callbacks]
+        self._byCommand = {}
+
+    @staticmethod
+    def _handlerNames(cb):
+        if not isinstance(cb, IrcCallback):
+            return None
+        cls = type(cb)
+        for klass in cls.__mro__:
+            if '__call__' in klass.__dict__:
+                if not klass.__dict__.get('onlyDispatchesOnCommand'):
+                    return None
+                break
+        if cls.dispatchCommand is not IrcCommandDispatcher.dispatchCommand \
+                or hasattr(cls, '__getattr__'):
+            return None
+        return frozenset(name for name in dir(cb) if name.startswith('do'))
+
+    def get(self, command):
+        """Returns the list of callbacks to call on messages with the given
+        command."""
+        try:
+            return self._byCommand[command]
+        except KeyError:
+            pass
+        upper = command.upper()
+        name = 'do' + upper.capitalize()
+        if upper in ('FAIL', 'WARN', 'NOTE', 'CAP'):
+            # dispatchCommand may use a method for a subcommand too.
+            def handles(names):
+                return any(n.startswith(name) for n in names)
+        else:
+            def handles(names):
+                return name in names
+        cbs = [cb for (cb, names) in self._handlers
+               if names is None or handles(names)]
+        self._byCommand[command] = cbs
+        return cbs
+
 ###
 # Basic queue for IRC messages.  It doesn't presently (but should at some
 # later point) reorder messages based on priority or penalty calculations.
 ###
 _high = frozenset(['MODE', 'KICK', 'PONG', 'NICK', 'PASS', 'CAPAB', 'REMOVE'])
 _low = frozenset(['PRIVMSG', 'PING', 'WHO', 'NOTICE', 'JOIN'])
+# Commands whose first argument is the channel or nick they are sent to.
+_targeted = frozenset(['PRIVMSG', 'NOTICE', 'TAGMSG', 'MODE', 'KICK',
+                       'TOPIC', 'REMOVE'])
+
+class RoundRobinQueue(object):
+    """A FIFO queue for each target, with items dequeued from each target in
+    turn.  All operations are O(1)."""
+    __slots__ = ('queues', 'length')
+    def __init__(self):
+        self.queues = collections.OrderedDict()
+        self.length = 0
+
+    def enqueue(self, target, item):
+        queue = self.queues.get(target)
+        if queue is None:
+            queue = self.queues[target] = collections.deque()
+        queue.append(item)
+        self.length += 1
+
+    def dequeue(self):
+        (target, queue) = next(iter(self.queues.items()))
+        item = queue.popleft()
+        if queue:
+            # Let the other targets go first.
+            self.queues.move_to_end(target)
+        else:
+            del self.queues[target]
+        self.length -= 1
+        return item
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        for queue in self.queues.values():
+            for item in queue:
+                yield item
+
+    def items(self):
+        """Returns an iterator of (target, deque of items)."""
+        return self.queues.items()
+
 class IrcMsgQueue(object):
     """Class for a queue of IrcMsgs.  Eventually, it should be smart.
 
@@ -226,7 +331,12 @@ class IrcMsgQueue(object):
     As it stands, however, we simply keep track of 'high priority' messages,
     'low priority' messages, and normal messages, and just make sure to return
     the 'high priority' ones before the normal ones before the 'low priority'
-    ones.
+    ones.  Within a priority, messages to different targets (channels or
+    nicks) are sent in turn, so a long reply to a target does not delay the
+    others.
+
+    `msgs` counts the queued messages, so that membership tests are O(1),
+    like enqueuing and dequeuing.
     """
     __slots__ = ('msgs', 'highpriority', 'normal', 'lowpriority', 'lastJoin')
     def __init__(self, iterable=()):
@@ -237,49 +347,77 @@ class IrcMsgQueue(object):
     def reset(self):
         """Clears the queue."""
         self.lastJoin = 0
-        self.highpriority = smallqueue()
-        self.normal = smallqueue()
-        self.lowpriority = smallqueue()
+        self.msgs = collections.Counter()
+        self.highpriority = RoundRobinQueue()
+        self.normal = RoundRobinQueue()
+        self.lowpriority = RoundRobinQueue()
+
+    @staticmethod
+    def _getTarget(msg):
+        if msg.command in _targeted and msg.args:
+            return ircutils.toLower(msg.args[0])
+        else:
+            return None
 
     def enqueue(self, msg):
         """Enqueues a given message."""
-        if msg in self and \
-           conf.supybot.protocols.irc.queuing.duplicates():
+        if conf.supybot.protocols.irc.queuing.duplicates() and \
+           msg in self:
             s = str(msg).strip()
             log.info('Not adding message %q to queue, already added.', s)
             return False
         else:
             if msg.command in _high:
-                self.highpriority.enqueue(msg)
+                queue = self.highpriority
             elif msg.command in _low:
-                self.lowpriority.enqueue(msg)
+                queue = self.lowpriority
             else:
-                self.normal.enqueue(msg)
+                queue = self.normal
+            queue.enqueue(self._getTarget(msg), (time.time(), msg))
+            self.msgs[msg] += 1
             return True
 
     def dequeue(self):
         """Dequeues a given message."""
         msg = None
         if self.highpriority:
-            msg = self.highpriority.dequeue()
+            (_, msg) = self.highpriority.dequeue()
         elif self.normal:
-            msg = self.normal.dequeue()
+            (_, msg) = self.normal.dequeue()
         elif self.lowpriority:
-            msg = self.lowpriority.dequeue()
+            (enqueuedAt, msg) = self.lowpriority.dequeue()
             if msg.command == 'JOIN':
                 limit = conf.supybot.protocols.irc.queuing.rateLimit.join()
                 now = time.time()
                 if self.lastJoin + limit <= now:
                     self.lastJoin = now
                 else:
-                    self.lowpriority.enqueue(msg)
-                    msg = None
+                    self.lowpriority.enqueue(None, (enqueuedAt, msg))
+                    return None
+        if msg is not None:
+            count = self.msgs[msg] - 1
+            if count > 0:
+                self.msgs[msg] = count
+            else:
+                del self.msgs[msg]
         return msg
 
+    def targetStats(self):
+        """Returns a dictionary whose keys are the targets (lowercased channels
+        and nicks, or None for messages without a target) of the queued
+        messages, and whose values are (number of messages, seconds the
+        oldest one has been waiting)."""
+        now = time.time()
+        stats = {}
+        for queue in (self.highpriority, self.normal, self.lowpriority):
+            for (target, items) in queue.items():
+                (count, wait) = stats.get(target, (0, 0))
+                stats[target] = (count + len(items),
+                                 max(wait, now - items[0][0]))
+        return stats
+
     def __contains__(self, msg):
-        return msg in self.normal or \
-               msg in self.lowpriority or \
-               msg in self.highpriority
+        return msg in self.msgs
 
     def __bool__(self):
         return bool(self.highpriority or self.normal or self.lowpriority)
@@ -290,16 +428,158 @@ class IrcMsgQueue(object):
 
     def __repr__(self):
         name = self.__class__.__name__
-        return '%s(%r)' % (name, list(chain(self.highpriority,
-                                            self.normal,
-                                            self.lowpriority)))
+        return '%s(%r)' % (name, [msg for (_, msg) in chain(self.highpriority,
+                                                            self.normal,
+                                                            self.lowpriority)])
     __str__ = __repr__
 
 
+class TokenBucket(object):
+    """Rate limiter allowing bursts of up to `capacity` actions, and one
+    action every `interval` seconds on average.  Both parameters are given to
+    each call, so configuration changes apply immediately."""
+    __slots__ = ('tokens', 'lastRefill')
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.tokens = None
+        self.lastRefill = 0
+
+    def _refill(self, now, interval, capacity):
+        if self.tokens is None or interval <= 0:
+            self.tokens = capacity
+        else:
+            elapsed = max(0, now - self.lastRefill)
+            self.tokens = min(capacity, self.tokens + elapsed/interval)
+        self.lastRefill = now
+
+    def take(self, now, interval, capacity):
+        """Consumes a token and returns True if one is available, returns
+        False otherwise."""
+        self._refill(now, interval, capacity)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        else:
+            return False
+
+    def delay(self, now, interval, capacity):
+        """Returns the number of seconds until a token is available."""
+        self._refill(now, interval, capacity)
+        return max(0, (1 - self.tokens) * interval)
+
+
 ###
 # Maintains the state of IRC connection -- the most recent messages, the
 # status of various modes (especially ops/halfops/voices) in channels, etc.
 ###
+class NickTable(object):
+    """Nicks of the users in the channels of a network, shared by their
+    ChannelStates: each nick is stored once, with the channels referencing
+    it.  The nicks which are not in any channel anymore are added to
+    :attr:`released`, so IrcState can forget about them."""
+    __slots__ = ('_nicks', '_channels', 'released')
+    def __init__(self):
+        # lowered nick -> ircutils.IrcString
+        self._nicks = {}
+        # lowered nick -> tuple of ChannelStates
+        self._channels = {}
+        self.released = []
+
+    def clear(self):
+        self._nicks.clear()
+        self._channels.clear()
+        self.released = []
+
+    def ref(self, nick, channel):
+        """Adds a reference to the nick from the ChannelState, and returns
+        its lowered version, to be used as key."""
+        key = ircutils.toLower(nick)
+        interned = self._nicks.get(key)
+        if interned is None:
+            interned = self._nicks[key] = ircutils.IrcString(nick)
+            self._channels[interned.lowered] = (channel,)
+        else:
+            self._channels[key] += (channel,)
+        return interned.lowered
+
+    def unref(self, key, channel):
+        channels = tuple(c for c in self._channels[key] if c is not channel)
+        if channels:
+            self._channels[key] = channels
+        else:
+            del self._channels[key]
+            self.released.append(self._nicks.pop(key))
+
+    def channels(self, nick):
+        """Returns the ChannelStates referencing the nick (which may only be
+        op, voice, ... but not in the channel)."""
+        return self._channels.get(ircutils.toLower(nick), ())
+
+    def get(self, key):
+        """Returns the nick (as an IrcString) whose lowered version is
+        given, or None."""
+        return self._nicks.get(key)
+
+    def __contains__(self, nick):
+        return ircutils.toLower(nick) in self._nicks
+
+    def __len__(self):
+        return len(self._nicks)
+
+    def __getstate__(self):
+        return (self._nicks, self._channels, self.released)
+
+    def __setstate__(self, state):
+        (self._nicks, self._channels, self.released) = state
+
+class ChannelNicks(collections.abc.MutableSet):
+    """A view of the nicks of a ChannelState which have a given status (being
+    in the channel, being op, ...), which can be used like an IrcSet."""
+    __slots__ = ('_channel', '_flag')
+    def __init__(self, channel, flag):
+        self._channel = channel
+        self._flag = flag
+
+    @classmethod
+    def _from_iterable(cls, iterable):
+        return ircutils.IrcSet(iterable)
+
+    def __contains__(self, nick):
+        try:
+            key = ircutils.toLower(nick)
+        except TypeError:
+            return False
+        return bool(self._channel._members.get(key, 0) & self._flag)
+
+    def __iter__(self):
+        nicks = self._channel.nickTable
+        flag = self._flag
+        for (key, flags) in list(self._channel._members.items()):
+            if flags & flag:
+                nick = nicks.get(key)
+                if nick is not None: # It was removed by another thread
+                    yield nick
+
+    def __len__(self):
+        return self._channel._sizes[self._flag]
+
+    def add(self, nick):
+        self._channel._setFlag(nick, self._flag)
+
+    def discard(self, nick):
+        self._channel._unsetFlag(nick, self._flag)
+
+    def copy(self):
+        return ircutils.IrcSet(self)
+
+    def __reduce__(self):
+        return (ircutils.IrcSet, (list(self),))
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, list(self))
+
 class ChannelState(utils.python.Object):
     """Represents the known state of an IRC channel.
 
@@ -319,25 +599,25 @@ class ChannelState(utils.python.Object):
 
         Set of the nicks of all the operators of the channel.
 
-        :type: ircutils.IrcSet[str]
+        :type: ChannelNicks
 
     .. attribute:: halfops
 
         Set of the nicks of all the half-operators of the channel.
 
-        :type: ircutils.IrcSet[str]
+        :type: ChannelNicks
 
     .. attribute:: voices
 
         Set of the nicks of all the voiced users of the channel.
 
-        :type: ircutils.IrcSet[str]
+        :type: ChannelNicks
 
     .. attribute:: users
 
         Set of the nicks of all the users in the channel.
 
-        :type: ircutils.IrcSet[str]
+        :type: ChannelNicks
 
     .. attribute:: bans
 
@@ -351,19 +631,88 @@ class ChannelState(utils.python.Object):
         This excludes the following modes: ovhbeq
 
         :type: Dict[str, Optional[str]]
+
+    .. attribute:: nickTable
+
+        The NickTable the nicks of the users are stored in, shared with the
+        other channels of the network.
+
+        :type: NickTable
+
+    .. attribute:: name
+
+        The name of the channel, if it is in the channels of an IrcState.
+
+        :type: Optional[str]
     """
 
+    # Bits of the flags of each nick
+    USER = 1
+    OP = 2
+    HALFOP = 4
+    VOICE = 8
+
     __slots__ = ('users', 'ops', 'halfops', 'bans',
-                 'voices', 'topic', 'modes', 'created')
-    def __init__(self):
+                 'voices', 'topic', 'modes', 'created',
+                 'nickTable', 'name', '_members', '_sizes')
+    def __init__(self, nickTable=None, name=None):
+        self.name = name
         self.topic = ''
         self.created = 0
-        self.ops = ircutils.IrcSet()
         self.bans = ircutils.IrcSet()
-        self.users = ircutils.IrcSet()
-        self.voices = ircutils.IrcSet()
-        self.halfops = ircutils.IrcSet()
         self.modes = {}
+        if nickTable is None:
+            nickTable = NickTable()
+        self.nickTable = nickTable
+        # key of the nick in the nickTable -> flags
+        self._members = {}
+        # flag -> number of nicks having it
+        self._sizes = dict.fromkeys(
+            (self.USER, self.OP, self.HALFOP, self.VOICE), 0)
+        self._makeViews()
+
+    def _makeViews(self):
+        self.users = ChannelNicks(self, self.USER)
+        self.ops = ChannelNicks(self, self.OP)
+        self.halfops = ChannelNicks(self, self.HALFOP)
+        self.voices = ChannelNicks(self, self.VOICE)
+
+    def _setFlag(self, nick, flag):
+        key = ircutils.toLower(nick)
+        flags = self._members.get(key, 0)
+        if flags & flag:
+            return
+        if not flags:
+            key = self.nickTable.ref(nick, self)
+        self._members[key] = flags | flag
+        self._sizes[flag] += 1
+
+    def _unsetFlag(self, nick, flag):
+        key = ircutils.toLower(nick)
+        flags = self._members.get(key, 0)
+        if not flags & flag:
+            return
+        flags &= ~flag
+        self._sizes[flag] -= 1
+        if flags:
+            self._members[key] = flags
+        else:
+            del self._members[key]
+            self.nickTable.unref(key, self)
+
+    def _adopt(self, name, nickTable):
+        """Called when the channel is added to the channels of an
+        IrcState."""
+        self.name = name
+        if nickTable is not self.nickTable:
+            oldTable = self.nickTable
+            members = self._members
+            self._members = {}
+            self.nickTable = nickTable
+            for (key, flags) in members.items():
+                newKey = nickTable.ref(oldTable.get(key), self)
+                oldTable.unref(key, self)
+                self._members[newKey] = flags
 
     def isOp(self, nick):
         """Returns whether the given nick is an op."""
@@ -401,29 +750,34 @@ class ChannelState(utils.python.Object):
             (marker, user) = (user[0], user[1:])
             assert user, 'Looks like my caller is passing chars, not nicks.'
             if marker in '@&~!':
-                self.ops.add(nick)
+                self._setFlag(nick, self.OP)
             elif marker == '%':
-                self.halfops.add(nick)
+                self._setFlag(nick, self.HALFOP)
             elif marker == '+':
-                self.voices.add(nick)
-        self.users.add(nick)
+                self._setFlag(nick, self.VOICE)
+        self._setFlag(nick, self.USER)
 
     def replaceUser(self, oldNick, newNick):
         """Changes the user oldNick to newNick; used for NICK changes."""
         # Note that this doesn't have to have the sigil (@%+) that users
         # have to have for addUser; it just changes the name of the user
         # without changing any of their categories.
-        for s in (self.users, self.ops, self.halfops, self.voices):
-            if oldNick in s:
-                s.remove(oldNick)
-                s.add(newNick)
+        flags = self._members.get(ircutils.toLower(oldNick), 0)
+        for flag in (self.USER, self.OP, self.HALFOP, self.VOICE):
+            if flags & flag:
+                self._unsetFlag(oldNick, flag)
+                self._setFlag(newNick, flag)
 
     def removeUser(self, user):
         """Removes a given user from the channel."""
-        self.users.discard(user)
-        self.ops.discard(user)
-        self.halfops.discard(user)
-        self.voices.discard(user)
+        for flag in (self.USER, self.OP, self.HALFOP, self.VOICE):
+            self._unsetFlag(user, flag)
+
+    def removeAllUsers(self):
+        """Removes all the users from the channel; used when the bot
+        leaves it."""
+        for key in list(self._members):
+            self.removeUser(key)
 
     def setMode(self, mode, value=None):
         assert mode not in 'ovhbeq'
@@ -462,20 +816,150 @@ class ChannelState(utils.python.Object):
                     assert action == '-'
                     self.unsetMode(modeChar)
 
+    _stateSlots = ('topic', 'created', 'bans', 'modes', 'nickTable', 'name',
+                   '_members', '_sizes')
+
     def __getstate__(self):
-        return [getattr(self, name) for name in self.__slots__]
+        return [getattr(self, name) for name in self._stateSlots]
 
     def __setstate__(self, t):
-        for (name, value) in zip(self.__slots__, t):
+        for (name, value) in zip(self._stateSlots, t):
             setattr(self, name, value)
+        self._makeViews()
 
     def __eq__(self, other):
         ret = True
-        for name in self.__slots__:
+        for name in ('topic', 'created', 'bans', 'modes',
+                     'users', 'ops', 'halfops', 'voices'):
             ret = ret and getattr(self, name) == getattr(other, name)
         return ret
 
 
+class ChannelStates(ircutils.IrcDict):
+    """The ChannelStates of an IrcState, by channel name.  Makes sure they
+    know their name and use the NickTable of the IrcState."""
+    __slots__ = ('nickTable',)
+    def __init__(self, nickTable, dict=None):
+        self.nickTable = nickTable
+        super(ChannelStates, self).__init__(dict)
+
+    def __setitem__(self, k, v):
+        old = self.get(k)
+        if old is not v and isinstance(old, ChannelState):
+            old.removeAllUsers()
+        if isinstance(v, ChannelState):
+            v._adopt(k, self.nickTable)
+        super(ChannelStates, self).__setitem__(k, v)
+
+    def __delitem__(self, k):
+        old = self[k]
+        super(ChannelStates, self).__delitem__(k)
+        if isinstance(old, ChannelState):
+            old.removeAllUsers()
+
+    def __reduce__(self):
+        return (self.__class__, (self.nickTable, dict(self.data.values())))
+
+
+class History(RingBuffer):
+    """The RingBuffer of the messages of a network, indexed by channel and
+    by nick, so that the messages of a channel or of a nick can be searched
+    without going through the whole history.
+
+    The indexes only reference messages that are still in the ring: when
+    a message is dropped from the ring, it is dropped from the indexes
+    too."""
+    __slots__ = ('channels', 'nicks')
+    def reset(self):
+        super(History, self).reset()
+        self.channels = {}
+        self.nicks = {}
+
+    @staticmethod
+    def _channelOf(msg):
+        channel = getattr(msg, 'channel', None)
+        if channel is None and msg.args and ircutils.isChannel(msg.args[0]):
+            # Not tagged by Irc (eg. messages sent by the bot).
+            channel = msg.args[0]
+        return channel
+
+    def _keys(self, msg):
+        channel = self._channelOf(msg)
+        nick = msg.nick
+        return ((self.channels, channel and ircutils.toLower(channel)),
+                (self.nicks, nick and ircutils.toLower(nick)))
+
+    def _index(self, msg):
+        for (index, key) in self._keys(msg):
+            if key:
+                L = index.get(key)
+                if L is None:
+                    L = index[key] = collections.deque()
+                L.append(msg)
+
+    def _unindex(self, msg):
+        # msg is the oldest message of the ring, so it is also the oldest
+        # message of its indexes.
+        for (index, key) in self._keys(msg):
+            L = index.get(key)
+            if L and L[0] is msg:
+                L.popleft()
+                if not L:
+                    del index[key]
+
+    def _reindex(self):
+        self.channels = {}
+        self.nicks = {}
+        for msg in self:
+            self._index(msg)
+
+    def append(self, msg):
+        if len(self.L) == self.maxSize:
+            self.full = True
+            old = self.L[self.i]
+            self.L[self.i] = msg
+            self.i = (self.i + 1) % len(self.L)
+            self._unindex(old)
+        else:
+            self.L.append(msg)
+        self._index(msg)
+
+    def __setitem__(self, idx, msg):
+        super(History, self).__setitem__(idx, msg)
+        self._reindex()
+
+    def __setstate__(self, state):
+        super(History, self).__setstate__(state)
+        self._reindex()
+
+    def search(self, channel=None, nick=None):
+        """Returns an iterator on the messages sent to `channel` and/or by
+        `nick`, most recent first.  With neither of them, iterates on the
+        whole history.
+
+        Channel messages sent only to some status (eg. ``@#channel``) are
+        in the history of the channel, so callers that should not see them
+        still have to check ``msg.args[0]``."""
+        if not channel and not nick:
+            return reversed(self)
+        # Copied, so the caller can keep iterating while messages are added.
+        byChannel = byNick = None
+        if channel:
+            byChannel = list(self.channels.get(ircutils.toLower(channel), ()))
+        if nick:
+            byNick = list(self.nicks.get(ircutils.toLower(nick), ()))
+        if byChannel is None:
+            return reversed(byNick)
+        elif byNick is None:
+            return reversed(byChannel)
+        elif len(byNick) <= len(byChannel):
+            return (m for m in reversed(byNick)
+                    if ircutils.strEqual(self._channelOf(m) or '', channel))
+        else:
+            return (m for m in reversed(byChannel)
+                    if ircutils.nickEqual(m.nick, nick))
+
+
 Batch = collections.namedtuple('Batch', 'type arguments messages')
 """Represents a batch of messages, see
 <https://ircv3.net/specs/extensions/batch-3.2>"""
@@ -662,21 +1146,36 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
 
         History of messages received from the network. Automatically discards
         messages so it doesn't exceed
-        ``supybot.protocols.irc.maxHistoryLength``.
+        ``supybot.protocols.irc.maxHistoryLength`` (of the network).
+        Use its ``search`` method to get the messages of a channel or of a
+        nick.
 
-        :type: RingBuffer[ircmsgs.IrcMsg]
+        :type: History[ircmsgs.IrcMsg]
 
     .. attribute:: channels
 
         Store channel states.
 
-        :type: ircutils.IrcDict[str, ChannelState]
+        :type: ChannelStates
 
-    .. attribute:: nickToHostmask
+    .. attribute:: nicksToHostmasks
 
-        Stores the last hostmask of a seen nick.
+        Stores the last hostmask of a seen nick.  The nicks are forgotten
+        when they quit, or leave the last channel they shared with the bot.
 
         :type: ircutils.IrcDict[str, str]
+
+    .. attribute:: nickTable
+
+        Stores the nicks of the users in the channels (see ChannelState).
+
+        :type: NickTable
+
+    .. attribute:: network
+
+        Name of the network, used to get its network-specific settings.
+
+        :type: Optional[str]
     """
     __firewalled__ = {'addMsg': None}
 
@@ -685,16 +1184,22 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
                  nicksToHostmasks=None, channels=None,
                  capabilities_req=None,
                  capabilities_ack=None, capabilities_nak=None,
-                 capabilities_ls=None):
+                 capabilities_ls=None, nickTable=None, network=None):
         self.fsm = IrcStateFsm()
+        self.network = network
         if history is None:
-            history = RingBuffer(conf.supybot.protocols.irc.maxHistoryLength())
+            history = History(self._maxHistoryLength())
+        elif not isinstance(history, History):
+            history = History(history.maxSize, history)
         if supported is None:
             supported = utils.InsensitivePreservingDict()
         if nicksToHostmasks is None:
             nicksToHostmasks = ircutils.IrcDict()
-        if channels is None:
-            channels = ircutils.IrcDict()
+        if nickTable is None:
+            nickTable = NickTable()
+        if not isinstance(channels, ChannelStates) or \
+                channels.nickTable is not nickTable:
+            channels = ChannelStates(nickTable, channels)
         self.capabilities_req = capabilities_req or set()
         self.capabilities_ack = capabilities_ack or set()
         self.capabilities_nak = capabilities_nak or set()
@@ -704,6 +1209,7 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
         self.history = history
         self.channels = channels
         self.nicksToHostmasks = nicksToHostmasks
+        self.nickTable = nickTable
 
         # Batches should always finish and be way shorter than 3600s, but
         # let's just make sure to avoid leaking memory.
@@ -713,11 +1219,15 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
         """Resets the state to normal, unconnected state."""
         self.fsm.reset()
         self.history.reset()
-        self.history.resize(conf.supybot.protocols.irc.maxHistoryLength())
+        self.history.resize(self._maxHistoryLength())
         self.ircd = None
         self.channels.clear()
+        channelSupports = any(self._getChannelSupports())
         self.supported.clear()
+        if channelSupports:
+            registry.incrementGeneration()
         self.nicksToHostmasks.clear()
+        self.nickTable.clear()
         self.batches.clear()
         self.capabilities_req = set()
         self.capabilities_ack = set()
@@ -726,7 +1236,9 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
 
     def __reduce__(self):
         return (self.__class__, (self.history, self.supported,
-                                 self.nicksToHostmasks, self.channels))
+                                 self.nicksToHostmasks, self.channels,
+                                 None, None, None, None, self.nickTable,
+                                 self.network))
 
     def __eq__(self, other):
         return self.history == other.history and \
@@ -738,16 +1250,24 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
     def __ne__(self, other):
         return not self == other
 
+    def _maxHistoryLength(self):
+        return conf.supybot.protocols.irc.maxHistoryLength.getSpecific(
+            network=self.network)()
+
     def copy(self):
-        ret = self.__class__()
+        ret = self.__class__(network=self.network)
         ret.history = copy.deepcopy(self.history)
         ret.nicksToHostmasks = copy.deepcopy(self.nicksToHostmasks)
-        ret.channels = copy.deepcopy(self.channels)
+        # The channels share the nick table, so they are copied together.
+        (ret.nickTable, ret.channels) = \
+            copy.deepcopy((self.nickTable, self.channels))
         ret.batches = copy.deepcopy(self.batches)
         return ret
 
     def addMsg(self, irc, msg):
         """Updates the state based on the irc object and the message."""
+        if self.nickTable.released:
+            self._forgetReleasedNicks(irc)
         self.history.append(msg)
         if ircutils.isUserHostmask(msg.prefix) and not msg.command == 'NICK':
             self.nicksToHostmasks[msg.nick] = msg.prefix
@@ -759,6 +1279,29 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
         method = self.dispatchCommand(msg.command, msg.args)
         if method is not None:
             method(irc, msg)
+        if ircutils.isUserHostmask(msg.prefix):
+            if msg.command == 'NICK':
+                nick = msg.args[0]
+            else:
+                nick = msg.nick
+            if nick not in self.nickTable:
+                # Not in any of our channels (eg. a private message), so
+                # nothing else would release it.
+                self.nickTable.released.append(nick)
+
+    def _forgetReleasedNicks(self, irc):
+        # This is done when the next message is received, so the callbacks
+        # can still get the hostmask of a user who just left.
+        released = self.nickTable.released
+        self.nickTable.released = []
+        for nick in released:
+            if nick not in self.nickTable and \
+                    not ircutils.strEqual(nick, irc.nick):
+                self.nicksToHostmasks.pop(nick, None)
+
+    def _newChannel(self, channel):
+        chan = self.channels[channel] = ChannelState(self.nickTable, channel)
+        return chan
 
     def getTopic(self, channel):
         """Returns the topic for a given channel."""
@@ -768,6 +1311,13 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
         """Returns the hostmask for a given nick."""
         return self.nicksToHostmasks[nick]
 
+    def channelsOf(self, nick):
+        """Returns the names of the channels the given nick is in, as an
+        IrcSet."""
+        return ircutils.IrcSet([channel.name
+                                for channel in self.nickTable.channels(nick)
+                                if nick in channel.users])
+
     def do004(self, irc, msg):
         """Handles parsing the 004 reply
 
@@ -838,7 +1388,14 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
             return int(s)
     _005converters['maxbans'] = _maxbansParser
     del _maxbansParser
+    # Irc.isChannel depends on these.
+    _channelSupports = ('chantypes', 'channellen')
+
+    def _getChannelSupports(self):
+        return tuple(self.supported.get(name) for name in self._channelSupports)
+
     def do005(self, irc, msg):
+        channelSupports = self._getChannelSupports()
         for arg in msg.args[1:-1]: # 0 is nick, -1 is "are supported"
             if '=' in arg:
                 (name, value) = arg.split('=', 1)
@@ -850,6 +1407,10 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
                     log.error('Name: %s, Converter: %s', name, converter)
             else:
                 self.supported[arg] = None
+        if self._getChannelSupports() != channelSupports:
+            # Lookups cached by registry.getSpecific were validated with
+            # the previous channel names.
+            registry.incrementGeneration()
 
     def do352(self, irc, msg):
         # WHO reply.
@@ -872,7 +1433,7 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
         # NAMES reply.
         (__, type, channel, items) = msg.args
         if channel not in self.channels:
-            self.channels[channel] = ChannelState()
+            self._newChannel(channel)
         c = self.channels[channel]
         for item in items.split():
             if ircutils.isUserHostmask(item):
@@ -895,9 +1456,8 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
             if channel in self.channels:
                 self.channels[channel].addUser(msg.nick)
             elif msg.nick: # It must be us.
-                chan = ChannelState()
+                chan = self._newChannel(channel)
                 chan.addUser(msg.nick)
-                self.channels[channel] = chan
                 # I don't know why this assert was here.
                 #assert msg.nick == irc.nick, msg
 
@@ -919,8 +1479,7 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
             try:
                 chan = self.channels[channel]
             except KeyError:
-                chan = ChannelState()
-                self.channels[channel] = chan
+                chan = self._newChannel(channel)
             chan.doMode(msg)
 
     def do324(self, irc, msg):
@@ -928,8 +1487,7 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
         try:
             chan = self.channels[channel]
         except KeyError:
-            chan = ChannelState()
-            self.channels[channel] = chan
+            chan = self._newChannel(channel)
         for (mode, value) in ircutils.separateModes(msg.args[2:]):
             modeChar = mode[1]
             if mode[0] == '+' and mode[1] not in 'ovh':
@@ -943,8 +1501,7 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
         try:
             chan = self.channels[channel]
         except KeyError:
-            chan = ChannelState()
-            self.channels[channel] = chan
+            chan = self._newChannel(channel)
         chan.created = int(msg.args[2])
 
     def doPart(self, irc, msg):
@@ -969,11 +1526,9 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
                 chan.removeUser(user)
 
     def doQuit(self, irc, msg):
-        channel_names = ircutils.IrcSet()
-        for (name, channel) in self.channels.items():
-            if msg.nick in channel.users:
-                channel_names.add(name)
-                channel.removeUser(msg.nick)
+        channel_names = self.channelsOf(msg.nick)
+        for name in channel_names:
+            self.channels[name].removeUser(msg.nick)
         # Remember which channels the user was on
         msg.tag('channels', channel_names)
         if msg.nick in self.nicksToHostmasks:
@@ -1005,10 +1560,8 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
             del self.nicksToHostmasks[oldNick]
         except KeyError:
             pass
-        channel_names = ircutils.IrcSet()
-        for (name, channel) in self.channels.items():
-            if msg.nick in channel.users:
-                channel_names.add(name)
+        channel_names = self.channelsOf(oldNick)
+        for channel in self.nickTable.channels(oldNick):
             channel.replaceUser(oldNick, newNick)
         msg.tag('channels', channel_names)
 
@@ -1027,11 +1580,7 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
             assert False, msg.args[0]
 
     def doAway(self, irc, msg):
-        channel_names = ircutils.IrcSet()
-        for (name, channel) in self.channels.items():
-            if msg.nick in channel.users:
-                channel_names.add(name)
-        msg.tag('channels', channel_names)
+        msg.tag('channels', self.channelsOf(msg.nick))
 
 
 ###
@@ -1121,15 +1670,21 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
     _nickSetters = set(['001', '002', '003', '004', '250', '251', '252',
                         '254', '255', '265', '266', '372', '375', '376',
                         '333', '353', '332', '366', '005'])
+    # Incremented each time a callback is added to or removed from any Irc
+    # object (they usually share the same list of callbacks), so that what
+    # is computed from the list of callbacks knows when to be computed again.
+    callbacksVersion = 0
+
     # We specifically want these callbacks to be common between all Ircs,
     # that's why we don't do the normal None default with a check.
     def __init__(self, network, callbacks=_callbacks):
         self.zombie = False
-        world.ircs.append(self)
         self.network = network
+        world.ircs.append(self)
         self.startedAt = time.time()
         self.callbacks = callbacks
-        self.state = IrcState()
+        self._dispatchTable = None
+        self.state = IrcState(network=network)
         self.queue = IrcMsgQueue()
         self.fastqueue = smallqueue()
         self.driver = None # The driver should set this later.
@@ -1166,6 +1721,7 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         """
         assert not self.getCallback(callback.name())
         self.callbacks.append(callback)
+        Irc.callbacksVersion += 1
         # This is the new list we're building, which will be tsorted.
         cbs = []
         # The vertices are self.callbacks itself.  Now we make the edges.
@@ -1216,6 +1772,7 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
             return cb.name().lower() == name
         (bad, good) = utils.iter.partition(nameMatches, self.callbacks)
         self.callbacks[:] = good
+        Irc.callbacksVersion += 1
         return bad
 
     def queueMsg(self, msg):
@@ -1254,6 +1811,17 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
             msg._len = len(str(msg))
         # TODO: truncate tags
 
+    def _getThrottle(self):
+        """Returns the (interval, capacity) parameters of self.sendBucket."""
+        return (conf.supybot.protocols.irc.throttleTime(),
+                conf.supybot.protocols.irc.throttleBurst.getSpecific(
+                    network=self.network)())
+
+    def throttleDelay(self):
+        """Returns the number of seconds before self.sendBucket has a token
+        for the next throttled message (0 if it has one now)."""
+        return self.sendBucket.delay(time.time(), *self._getThrottle())
+
     def takeMsg(self):
         """Called by the IrcDriver; takes a message to be sent."""
         if not self.callbacks:
@@ -1263,11 +1831,10 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         if self.fastqueue:
             msg = self.fastqueue.dequeue()
         elif self.queue:
-            if now-self.lastTake <= conf.supybot.protocols.irc.throttleTime():
-                log.debug('Irc.takeMsg throttling.')
-            else:
-                self.lastTake = now
+            if self.sendBucket.take(now, *self._getThrottle()):
                 msg = self.queue.dequeue()
+            else:
+                log.debug('Irc.takeMsg throttling.')
         elif self.afterConnect and \
              conf.supybot.protocols.irc.ping() and \
              now > self.lastping + conf.supybot.protocols.irc.ping.interval():
@@ -1398,7 +1965,8 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
 
         # Now call the callbacks.
         world.debugFlush()
-        for callback in self.callbacks:
+        table = self._getDispatchTable()
+        for callback in table.inFilters:
             try:
                 m = callback.inFilter(self, msg)
                 if not m:
@@ -1411,14 +1979,24 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         postInFilter = str(msg).rstrip('\r\n')
         if postInFilter != preInFilter:
             log.debug('Incoming message (post-inFilter): %s', postInFilter)
-        for callback in self.callbacks:
+        for callback in table.get(msg.command):
             try:
-                if callback is not None:
-                    callback(self, msg)
+                callback(self, msg)
             except:
                 log.exception('Uncaught exception in callback:')
             world.debugFlush()
 
+    def _getDispatchTable(self):
+        """Returns a _DispatchTable of self.callbacks, which is only built
+        again when callbacks are added or removed."""
+        version = (Irc.callbacksVersion, id(self.callbacks),
+                   len(self.callbacks))
+        table = self._dispatchTable
+        if table is None or table.version != version:
+            table = self._dispatchTable = \
+                _DispatchTable(self.callbacks, version)
+        return table
+
     def die(self):
         """Makes the Irc object *promise* to die -- but it won't die (of its
         own volition) until all its queues are clear.  Isn't that cool?"""
@@ -1460,7 +2038,7 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         self.password = network_config.password()
         self.prefix = '%s!%s@%s' % (self.nick, self.ident, 'unset.domain')
         # The rest.
-        self.lastTake = 0
+        self.sendBucket = TokenBucket()
         self.server = 'unset'
         self.afterConnect = False
         self.startedAt = time.time()
@@ -2135,6 +2713,7 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
                 # hurt anybody.
                 log.debug('Last Irc, clearing callbacks.')
                 self.callbacks[:] = []
+                Irc.callbacksVersion += 1
         else:
             log.warning('Irc object killed twice: %s', utils.stackTrace())
 
@@ -205,9 +205,13 @@ class IrcMsg(object):
     # It's too useful to be able to tag IrcMsg objects with extra, unforeseen
     # data.  Goodbye, __slots__.
     # On second thought, let's use methods for tagging.
-    __slots__ = ('args', 'command', 'host', 'nick', 'prefix', 'user',
+    #
+    # Server tags (and the time, which depends on them) and the parts of the
+    # prefix are only decoded when first accessed, as most messages go
+    # through the bot without anyone looking at them.
+    __slots__ = ('args', 'command', 'prefix', '_hostmask',
                  '_hash', '_str', '_repr', '_len', 'tags', 'reply_env',
-                 'server_tags', 'time', 'channel')
+                 '_server_tags', '_rawServerTags', '_time', 'channel')
 
     def __init__(self, s='', command='', args=(), prefix='', server_tags=None, msg=None,
             reply_env=None):
@@ -218,6 +222,8 @@ class IrcMsg(object):
         self._repr = None
         self._hash = None
         self._len = None
+        self._hostmask = None
+        self._rawServerTags = None
         self.reply_env = reply_env
         self.tags = {}
         if s:
@@ -227,10 +233,11 @@ class IrcMsg(object):
                     s += '\n'
                 self._str = s
                 if s[0] == '@':
-                    (server_tags, s) = s.split(' ', 1)
-                    self.server_tags = _parse_server_tags(server_tags[1:])
+                    (rawServerTags, s) = s.split(' ', 1)
+                    self._rawServerTags = rawServerTags[1:]
+                    self._server_tags = None
                 else:
-                    self.server_tags = {}
+                    self._server_tags = {}
                 if ' :' in s: # Note the space: IPV6 addresses are bad w/o it.
                     s, last = s.split(' :', 1)
                     self.args = split_args(s)
@@ -242,13 +249,8 @@ class IrcMsg(object):
                 else:
                     self.prefix = ''
                 self.command = self.args.pop(0)
-                if 'time' in self.server_tags:
-                    s = self.server_tags['time']
-                    date = datetime.datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%fZ')
-                    date = minisix.make_datetime_utc(date)
-                    self.time = minisix.datetime__timestamp(date)
-                else:
-                    self.time = time.time()
+                # Overridden by the 'time' tag, if any, when it is parsed.
+                self._time = time.time()
             except (IndexError, ValueError):
                 raise MalformedIrcMsg(repr(originalString))
         else:
@@ -272,25 +274,78 @@ class IrcMsg(object):
                 else:
                     self.reply_env = None
                 self.tags = msg.tags.copy()
-                self.server_tags = msg.server_tags
-                self.time = msg.time
+                self._server_tags = msg.server_tags
+                self._time = msg.time
             else:
                 self.prefix = prefix
                 self.command = command
                 assert all(ircutils.isValidArgument, args), args
                 self.args = args
-                self.time = None
+                self._time = None
                 if server_tags is None:
-                    self.server_tags = {}
+                    self._server_tags = {}
                 else:
-                    self.server_tags = server_tags
+                    self._server_tags = server_tags
         self.prefix = sys.intern(self.prefix)
         self.command = sys.intern(self.command)
         self.args = tuple(self.args)
+
+    def _parseServerTags(self):
+        rawServerTags = self._rawServerTags
+        self._rawServerTags = None
+        self._server_tags = _parse_server_tags(rawServerTags)
+        if 'time' in self._server_tags:
+            s = self._server_tags['time']
+            try:
+                date = datetime.datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%fZ')
+            except (TypeError, ValueError):
+                # Keep the time the message was received at; it is too late
+                # to reject the message.
+                return
+            date = minisix.make_datetime_utc(date)
+            self._time = minisix.datetime__timestamp(date)
+
+    @property
+    def server_tags(self):
+        if self._rawServerTags is not None:
+            self._parseServerTags()
+        return self._server_tags
+
+    @server_tags.setter
+    def server_tags(self, value):
+        self._rawServerTags = None
+        self._server_tags = value
+
+    @property
+    def time(self):
+        if self._rawServerTags is not None:
+            self._parseServerTags()
+        return self._time
+
+    @time.setter
+    def time(self, value):
+        if self._rawServerTags is not None:
+            self._parseServerTags()
+        self._time = value
+
+    def _splitPrefix(self):
         if isUserHostmask(self.prefix):
-            (self.nick,self.user,self.host)=ircutils.splitHostmask(self.prefix)
+            self._hostmask = ircutils.splitHostmask(self.prefix)
         else:
-            (self.nick, self.user, self.host) = (self.prefix,)*3
+            self._hostmask = (self.prefix,)*3
+        return self._hostmask
+
+    @property
+    def nick(self):
+        return (self._hostmask or self._splitPrefix())[0]
+
+    @property
+    def user(self):
+        return (self._hostmask or self._splitPrefix())[1]
+
+    @property
+    def host(self):
+        return (self._hostmask or self._splitPrefix())[2]
 
     def __str__(self):
         if self._str is not None:
@@ -168,35 +168,40 @@ def areReceivers(s, strictRfc=True, nicklen=None, chantypes='#&!',
             channellen=channellen)
     return all([nick(x) or chan(x) for x in s.split(',')])
 
-_patternCache = utils.structures.CacheDict(1000)
+def hostmaskPatternRegexp(pattern):
+    """pattern => str
+    Returns a regexp (to be compiled with re.I) matching the same hostmasks
+    as the hostmask pattern pattern.  It is not anchored at the end."""
+    # We make our own regexps, rather than use fnmatch, because fnmatch's
+    # case-insensitivity is not IRC's case-insensitity.
+    fd = minisix.io.StringIO()
+    for c in pattern:
+        if c == '*':
+            fd.write('.*')
+        elif c == '?':
+            fd.write('.')
+        elif c in '[{':
+            fd.write(r'[\[{]')
+        elif c in '}]':
+            fd.write(r'[}\]]')
+        elif c in '|\\':
+            fd.write(r'[|\\]')
+        elif c in '^~':
+            fd.write('[~^]')
+        else:
+            fd.write(re.escape(c))
+    return fd.getvalue()
+
+_patternCache = utils.structures.LRUCache(1000)
 def _hostmaskPatternEqual(pattern, hostmask):
     try:
         return _patternCache[pattern](hostmask) is not None
     except KeyError:
-        # We make our own regexps, rather than use fnmatch, because fnmatch's
-        # case-insensitivity is not IRC's case-insensitity.
-        fd = minisix.io.StringIO()
-        for c in pattern:
-            if c == '*':
-                fd.write('.*')
-            elif c == '?':
-                fd.write('.')
-            elif c in '[{':
-                fd.write(r'[\[{]')
-            elif c in '}]':
-                fd.write(r'[}\]]')
-            elif c in '|\\':
-                fd.write(r'[|\\]')
-            elif c in '^~':
-                fd.write('[~^]')
-            else:
-                fd.write(re.escape(c))
-        fd.write('$')
-        f = re.compile(fd.getvalue(), re.I).match
+        f = re.compile(hostmaskPatternRegexp(pattern) + '$', re.I).match
         _patternCache[pattern] = f
         return f(hostmask) is not None
 
-_hostmaskPatternEqualCache = utils.structures.CacheDict(1000)
+_hostmaskPatternEqualCache = utils.structures.LRUCache(1000)
 def hostmaskPatternEqual(pattern, hostmask):
     """pattern, hostmask => bool
     Returns True if hostmask matches the hostmask pattern pattern."""
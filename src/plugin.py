@@ -131,6 +131,7 @@ def renameCommand(cb, name, newName):
         method = getattr(cb.__class__, name)
         setattr(cb.__class__, newName, method)
         delattr(cb.__class__, name)
+        callbacks.invalidateCommandIndexes()
 
 def registerRename(plugin, command=None, newName=None):
     g = conf.registerGlobalValue(conf.supybot.commands.renames, plugin,
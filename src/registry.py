@@ -78,6 +78,21 @@ else:
 
 _cache = utils.InsensitivePreservingDict()
 _lastModified = 0
+
+# Incremented each time a value is set, or a node is registered or
+# unregistered, anywhere in the registry; so what is computed from the
+# registry can be cached as long as it did not change.
+generation = 0
+def incrementGeneration():
+    """Makes all the caches depending on the registry stale.  This is called
+    by the registry itself when it changes, but must also be called when
+    something else these caches depend on changes (eg. world.ircs)."""
+    global generation
+    generation += 1
+
+# (Value, network, channel, check) -> (generation, Value returned by
+# Value.getSpecific)
+_specificCache = utils.structures.LRUCache(10000)
 def open_registry(filename, clear=False):
     """Initializes the module by loading the registry file into memory."""
     global _lastModified
@@ -275,6 +290,7 @@ class Group(object):
         # from experience, we now know that it most definitely *is* right.
         if name not in self._children:
             self._children[name] = node
+            incrementGeneration()
             self._added.append(name)
             names = split(self._name)
             names.append(name)
@@ -294,6 +310,7 @@ class Group(object):
         try:
             node = self._children[name]
             del self._children[name]
+            incrementGeneration()
             # We do this because we need to remove case-insensitively.
             name = name.lower()
             for elt in reversed(self._added):
@@ -388,6 +405,19 @@ class Value(Group):
         (resp. channel-specific). If `check=False`, then `network` and/or
         `channel` may be silently ignored.
         """
+        key = (self, network, channel, check)
+        currentGeneration = generation
+        try:
+            (cachedGeneration, value) = _specificCache[key]
+            if cachedGeneration == currentGeneration:
+                return value
+        except KeyError:
+            pass
+        value = self._getSpecific(network, channel, check)
+        _specificCache[key] = (currentGeneration, value)
+        return value
+
+    def _getSpecific(self, network, channel, check):
         if network and not self._networkValue:
             if check:
                 raise NonExistentRegistryEntry('%s is not network-specific' %
@@ -503,6 +533,7 @@ class Value(Group):
         well."""
         self._lastModified = monotonic_time()
         self.value = v
+        incrementGeneration()
         if self._supplyDefault:
             for (name, child) in list(self._children.items()):
                 if not child._wasSet:
@@ -511,6 +542,9 @@ class Value(Group):
         for callback, args, kwargs in self._callbacks:
             callback(*args, **kwargs)
         self._wasSet = not inherited
+        # Again, as the callbacks may have cached values computed while
+        # _wasSet was not up to date.
+        incrementGeneration()
 
     def context(self, value):
         """Return a context manager object, which sets this variable to a
@@ -39,36 +39,118 @@ import heapq
 import functools
 from threading import Lock
 
-from . import drivers, log, world
-
-class mytuple(tuple):
-    def __cmp__(self, other):
-        return cmp(self[0], other[0])
-    def __le__(self, other):
-        return self[0] <= other[0]
-    def __lt__(self, other):
-        return self[0] < other[0]
-    def __gt__(self, other):
-        return self[0] > other[0]
-    def __ge__(self, other):
-        return self[0] >= other[0]
+from . import conf, drivers, log, world
+from .utils import minisix
+
+# Indexes of the items of the entries of Schedule.schedule
+_TIME = 0
+_NAME = 2
+_F = 3
+_EXECUTOR = 6
+
+EXECUTORS = ('inline', 'thread')
+
+def _label(f):
+    """Returns the name of a function, used to group the statistics of the
+    events running it."""
+    return '%s.%s' % (getattr(f, '__module__', None),
+                      getattr(f, '__qualname__', None) or repr(f))
+
+class _EventStats(object):
+    __slots__ = ('executor', 'runs', 'totalLateness', 'maxLateness',
+                 'totalDuration', 'maxDuration')
+    def __init__(self, executor):
+        self.executor = executor
+        self.runs = 0
+        self.totalLateness = 0
+        self.maxLateness = 0
+        self.totalDuration = 0
+        self.maxDuration = 0
+
+    def add(self, lateness, duration):
+        self.runs += 1
+        self.totalLateness += lateness
+        self.maxLateness = max(self.maxLateness, lateness)
+        self.totalDuration += duration
+        self.maxDuration = max(self.maxDuration, duration)
+
+    def asDict(self):
+        return {'executor': self.executor, 'runs': self.runs,
+                'averageLateness': self.totalLateness / (self.runs or 1),
+                'maxLateness': self.maxLateness,
+                'averageDuration': self.totalDuration / (self.runs or 1),
+                'maxDuration': self.maxDuration}
+
+class _EventThreads(object):
+    """Threads running the events which must not block the main loop.  At
+    most supybot.schedule.threads threads are started, when needed; the
+    other events wait for one of them to be available."""
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.queue = minisix.queue.Queue()
+        self.lock = Lock()
+        self.threads = 0
+        self.idle = 0
+
+    def submit(self, event):
+        self.queue.put(event)
+        with self.lock:
+            if self.idle or self.threads >= conf.supybot.schedule.threads():
+                return
+            self.threads += 1
+            self.idle += 1
+        t = world.SupyThread(target=self._work,
+                             name='Schedule thread #%s' % self.threads)
+        t.daemon = True
+        t.start()
+
+    def _work(self):
+        while True:
+            event = self.queue.get()
+            with self.lock:
+                self.idle -= 1
+            self.schedule._runEvent(event)
+            with self.lock:
+                self.idle += 1
 
 class Schedule(drivers.IrcDriver):
     """An IrcDriver to handling scheduling of events.
 
-    Events, in this case, are functions accepting no arguments.
+    Events, in this case, are functions accepting no arguments.  They are run
+    by the main loop, unless they are added with executor='thread' (run by
+    a thread, see supybot.schedule.threads).  Those run concurrently with
+    the main loop, so they must do their own locking of the data they share
+    with it.
     """
     def __init__(self):
         drivers.IrcDriver.__init__(self)
+        # A heap of [t, sequence, name, f, args, kwargs, executor] lists,
+        # compared by t then by the unique sequence number.  Removing an
+        # event only sets its f to None; it is dropped when it reaches the
+        # top of the heap, or when the heap is compacted.
         self.schedule = []
+        # name -> entry of the heap
         self.events = {}
+        # name -> entry of the events popped from the heap which have not
+        # finished running yet; removing one of them only sets its f to
+        # None, so a periodic event does not schedule itself again.
+        self._running = {}
         self.counter = 0
         self.lock = Lock()
+        self._sequence = 0
+        self._removed = 0
+        self._ran = 0
+        self._totalLateness = 0
+        self._maxLateness = 0
+        # label of the function -> _EventStats
+        self._eventStats = {}
+        self._threads = _EventThreads(self)
 
     def reset(self):
         with self.lock:
             self.events.clear()
             self.schedule[:] = []
+            self._removed = 0
         # We don't reset the counter here because if someone has held an id of
         # one of the nuked events, we don't want them removing new events with
         # their old id.
@@ -76,42 +158,134 @@ class Schedule(drivers.IrcDriver):
     def name(self):
         return 'Schedule'
 
-    def addEvent(self, f, t, name=None, args=[], kwargs={}):
+    def _push(self, f, t, name, args, kwargs, executor):
+        """Adds an event to the heap; the lock must be held."""
+        assert name not in self.events, \
+               'An event with the same name has already been scheduled.'
+        entry = [t, self._sequence, name, f, args, kwargs, executor]
+        self._sequence += 1
+        self.events[name] = entry
+        heapq.heappush(self.schedule, entry)
+
+    def _remove(self, name):
+        """Removes an event from the schedule, and returns its (f, args,
+        kwargs, executor); the lock must be held."""
+        entry = self.events.pop(name)
+        (f, args, kwargs, executor) = entry[_F:]
+        entry[_F] = None
+        self._removed += 1
+        if self._removed > max(100, len(self.schedule) // 2):
+            # Most of the heap is removed events, which take memory and make
+            # the other operations slower.
+            self.schedule[:] = [x for x in self.schedule if x[_F] is not None]
+            heapq.heapify(self.schedule)
+            self._removed = 0
+        return (f, args, kwargs, executor)
+
+    def _dropRemoved(self):
+        """Pops the removed events from the top of the heap; the lock must be
+        held."""
+        while self.schedule and self.schedule[0][_F] is None:
+            heapq.heappop(self.schedule)
+            self._removed -= 1
+
+    def addEvent(self, f, t, name=None, args=[], kwargs={}, executor='inline'):
         """Schedules an event f to run at time t.
 
-        name must be hashable and not an int.
+        name must be hashable and not an int.  executor is 'inline' (the
+        default) or 'thread'; the latter should be used for functions which
+        may take a while to run, and lock what they share with the main
+        loop.
         """
-        if name is None:
-            name = self.counter
-            self.counter += 1
-        assert name not in self.events, \
-               'An event with the same name has already been scheduled.'
+        if executor not in EXECUTORS:
+            raise ValueError('Unknown executor: %r' % (executor,))
         with self.lock:
-            self.events[name] = f
-            heapq.heappush(self.schedule, mytuple((t, name, args, kwargs)))
+            if name is None:
+                name = self.counter
+                self.counter += 1
+            self._push(f, t, name, args, kwargs, executor)
         return name
 
     def removeEvent(self, name):
-        """Removes the event with the given name from the schedule."""
-        f = self.events.pop(name)
-        # We must heapify here because the heap property may not be preserved
-        # by the above list comprehension.  We could, conceivably, just mark
-        # the elements of the heap as removed and ignore them when we heappop,
-        # but that would only save a constant factor (we're already linear for
-        # the listcomp) so I'm not worried about it right now.
+        """Removes the event with the given name from the schedule.  If it is
+        running, it is not run again, even if it is periodic."""
         with self.lock:
-            self.schedule = [x for x in self.schedule if x[1] != name]
-            heapq.heapify(self.schedule)
-        return f
+            entry = self._running.get(name)
+            if name not in self.events and entry is not None and \
+                    entry[_F] is not None:
+                (f, entry[_F]) = (entry[_F], None)
+                return f
+            return self._remove(name)[0]
 
     def rescheduleEvent(self, name, t):
-        f = self.removeEvent(name)
-        self.addEvent(f, t, name=name)
+        with self.lock:
+            (f, args, kwargs, executor) = self._remove(name)
+            self._push(f, t, name, args, kwargs, executor)
+
+    def nextEventTime(self):
+        """Returns the time the next event is scheduled at, or None if there
+        is no event."""
+        with self.lock:
+            self._dropRemoved()
+            if self.schedule:
+                return self.schedule[0][_TIME]
+            else:
+                return None
+
+    def stats(self):
+        """Returns the number of pending events, of removed events still
+        taking space in the schedule, of events run, and the average and
+        maximum time they were run after the time they were scheduled at."""
+        with self.lock:
+            return {'pending': len(self.events), 'removed': self._removed,
+                    'ran': self._ran,
+                    'averageLateness': self._totalLateness / (self._ran or 1),
+                    'maxLateness': self._maxLateness}
+
+    def eventStats(self):
+        """Returns a dictionary of the statistics of the events run, by
+        function: their executor, how many times they ran, and the average
+        and maximum time they started after the time they were scheduled
+        at, and of their duration.  Events run inline with a long duration
+        delay the other events and block the main loop."""
+        with self.lock:
+            return {label: stats.asDict()
+                    for (label, stats) in self._eventStats.items()}
 
-    def makePeriodicWrapper(
-            self, f, t, name=None, args=[], kwargs={}, count=None):
+    def _runEvent(self, entry):
+        (t, sequence, name, f, args, kwargs, executor) = entry
+        if f is None:
+            # Removed while waiting for a thread
+            with self.lock:
+                if self._running.get(name) is entry:
+                    del self._running[name]
+            return
+        start = time.time()
+        try:
+            f(*args, **kwargs)
+        except Exception:
+            log.exception('Uncaught exception in scheduled function:')
+        finally:
+            duration = time.time() - start
+            lateness = start - t
+            label = _label(f)
+            with self.lock:
+                if self._running.get(name) is entry:
+                    del self._running[name]
+                self._ran += 1
+                self._totalLateness += lateness
+                self._maxLateness = max(self._maxLateness, lateness)
+                stats = self._eventStats.get(label)
+                if stats is None:
+                    stats = self._eventStats[label] = _EventStats(executor)
+                stats.executor = executor
+                stats.add(lateness, duration)
+
+    def makePeriodicWrapper(self, f, t, name=None, args=[], kwargs={},
+                            count=None, executor='inline'):
         """Returns a function that will run and re-schedule itself every t
-        seconds."""
+        seconds, unless it was removed while running."""
+        @functools.wraps(f)
         def wrapper():
             nonlocal count
             try:
@@ -121,18 +295,37 @@ class Schedule(drivers.IrcDriver):
                 if count is not None:
                     count -= 1
                 if count is None or count > 0:
-                    return self.addEvent(wrapper, time.time() + t, name)
+                    return self._readdPeriodic(wrapper, time.time() + t,
+                                               name, executor)
         return wrapper
 
-    def addPeriodicEvent(
-            self, f, t, name=None, now=True, args=[], kwargs={}, count=None):
+    def _readdPeriodic(self, wrapper, t, name, executor):
+        with self.lock:
+            entry = self._running.get(name)
+            if entry is not None and entry[_F] is None:
+                return None
+            if name is None:
+                name = self.counter
+                self.counter += 1
+            self._push(wrapper, t, name, [], {}, executor)
+        return name
+
+    def addPeriodicEvent(self, f, t, name=None, now=True, args=[], kwargs={},
+                         count=None, executor='inline'):
         """Adds a periodic event that is called every t seconds."""
+        if name is None:
+            with self.lock:
+                # So it keeps the same name when it is rescheduled, and can
+                # be removed with the name returned here.
+                name = self.counter
+                self.counter += 1
         wrapper = self.makePeriodicWrapper(
-            f, t, name, args, kwargs, count)
+            f, t, name, args, kwargs, count, executor)
         if now:
             return wrapper()
         else:
-            return self.addEvent(wrapper, time.time() + t, name)
+            return self.addEvent(wrapper, time.time() + t, name,
+                                 executor=executor)
 
     removePeriodicEvent = removeEvent
 
@@ -141,14 +334,19 @@ class Schedule(drivers.IrcDriver):
             log.error('Schedule is the only remaining driver, '
                       'why do we continue to live?')
             time.sleep(1) # We're the only driver; let's pause to think.
-        while self.schedule and self.schedule[0][0] < time.time():
+        while True:
             with self.lock:
-                (t, name, args, kwargs) = heapq.heappop(self.schedule)
-                f = self.events.pop(name)
-            try:
-                f(*args, **kwargs)
-            except Exception:
-                log.exception('Uncaught exception in scheduled function:')
+                self._dropRemoved()
+                if not self.schedule or self.schedule[0][_TIME] >= time.time():
+                    break
+                entry = heapq.heappop(self.schedule)
+                name = entry[_NAME]
+                del self.events[name]
+                self._running[name] = entry
+            if entry[_EXECUTOR] == 'inline':
+                self._runEvent(entry)
+            else:
+                self._threads.submit(entry)
 
 
 schedule = Schedule()
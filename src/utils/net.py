@@ -170,9 +170,11 @@ def _prefix_ssl_error(prefix):
             e.args[0], '%s failed: %s' % (prefix, e.args[1]), *e.args[2:]) \
             from None
 
-def ssl_wrap_socket(conn, hostname, logger, certfile=None,
-        trusted_fingerprints=None, verify=True, ca_file=None,
-        **kwargs):
+def ssl_context(certfile=None, trusted_fingerprints=None, verify=True,
+        ca_file=None, **kwargs):
+    """Returns an SSL context for a client connection.  If
+    trusted_fingerprints is given, the caller must check the peer certificate
+    with check_certificate_fingerprint once connected."""
     with _prefix_ssl_error('creating SSL context'):
         context = ssl.create_default_context(**kwargs)
 
@@ -188,6 +190,15 @@ def ssl_wrap_socket(conn, hostname, logger, certfile=None,
         with _prefix_ssl_error('loading client certfile'):
             context.load_cert_chain(certfile)
 
+    return context
+
+def ssl_wrap_socket(conn, hostname, logger, certfile=None,
+        trusted_fingerprints=None, verify=True, ca_file=None,
+        **kwargs):
+    context = ssl_context(certfile=certfile,
+            trusted_fingerprints=trusted_fingerprints, verify=verify,
+            ca_file=ca_file, **kwargs)
+
     with _prefix_ssl_error('establishing TLS connection'):
         conn = context.wrap_socket(conn, server_hostname=hostname)
 
@@ -87,7 +87,7 @@ class MetaSynchronized(type):
                     lock = getattr(self, MetaSynchronized.LOCK)
                     lock.acquire()
                     try:
-                        f(self, *args, **kwargs)
+                        return f(self, *args, **kwargs)
                     finally:
                         lock.release()
                 return changeFunctionName(g, f.__name__, f.__doc__)
@@ -37,6 +37,7 @@ import re
 import sys
 import time
 import string
+import functools
 import textwrap
 
 from . import minisix
@@ -245,21 +246,31 @@ def perlReToPythonRe(s, allowG=False):
     else:
         return r
 
+def _searchGroup0(r, s):
+    m = r.search(s)
+    return m and m.group(0) or ''
+
 def perlReToFindall(s):
     """Converts a string representation of a Perl regular expression (i.e.,
     m/^foo$/i or /foo|bar/) to a Python regular expression, with support for
     G flag
+
+    The returned function can be pickled, so it can be run by
+    commands.process in its pool of processes.
     """
     (r, g) = perlReToPythonRe(s, allowG=True)
     if g:
-        return lambda s: r.findall(s)
+        return r.findall
     else:
-        return lambda s: r.search(s) and r.search(s).group(0) or ''
+        return functools.partial(_searchGroup0, r)
 
 def perlReToReplacer(s):
     """Converts a string representation of a Perl regular expression (i.e.,
     s/foo/bar/g or s/foo/bar/i) to a Python function doing the equivalent
     replacement.
+
+    The returned function can be pickled, so it can be run by
+    commands.process in its pool of processes.
     """
     sep = _getSep(s)
     escaped = re.escape(sep)
@@ -281,9 +292,9 @@ def perlReToReplacer(s):
         flags = ''.join(flags)
     r = perlReToPythonRe(sep.join(('', regexp, flags)))
     if g:
-        return lambda s: r.sub(replace, s)
+        return functools.partial(r.sub, replace)
     else:
-        return lambda s: r.sub(replace, s, 1)
+        return functools.partial(r.sub, replace, count=1)
 
 _perlVarSubstituteRe = re.compile(r'\$\{([^}]+)\}|\$([a-zA-Z][a-zA-Z0-9]*)')
 def perlVariableSubstitute(vars, text):
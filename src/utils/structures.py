@@ -33,6 +33,7 @@ Data structures for Python.
 
 import time
 import threading
+import collections
 import collections.abc
 
 
@@ -431,6 +432,9 @@ class MultiSet(object):
 
 
 class CacheDict(collections.abc.MutableMapping):
+    """A dictionary holding at most `max` items, which drops all of them when
+    it is full.  LRUCache should be used instead, as it keeps the items
+    used the most recently."""
     __slots__ = ('d', 'max')
     def __init__(self, max, **kwargs):
         self.d = dict(**kwargs)
@@ -460,6 +464,74 @@ class CacheDict(collections.abc.MutableMapping):
         return len(self.d)
 
 
+class LRUCache(collections.abc.MutableMapping):
+    """A dictionary holding at most `max` items, which drops the least
+    recently used item when a new one is added while it is full.
+
+    If given, onEvict is called with the key and value of each item dropped
+    this way.
+
+    Counts its hits and misses (lookups of keys in the cache or not), and
+    evictions."""
+    __slots__ = ('d', 'max', 'onEvict', 'hits', 'misses', 'evictions')
+    def __init__(self, max, onEvict=None, **kwargs):
+        self.d = collections.OrderedDict(**kwargs)
+        self.max = max
+        self.onEvict = onEvict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return 'LRUCache(%s, %r)' % (self.max, dict(self.d))
+
+    def __getitem__(self, key):
+        try:
+            value = self.d[key]
+            # May raise KeyError too, if another thread removed it.
+            self.d.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        return value
+
+    def __contains__(self, key):
+        return key in self.d
+
+    def __setitem__(self, key, value):
+        d = self.d
+        d[key] = value
+        try:
+            d.move_to_end(key)
+            while len(d) > self.max:
+                (oldKey, oldValue) = d.popitem(last=False)
+                self.evictions += 1
+                if self.onEvict is not None:
+                    self.onEvict(oldKey, oldValue)
+        except KeyError:
+            # Another thread removed items in the meantime.
+            pass
+
+    def __delitem__(self, key):
+        del self.d[key]
+
+    def __iter__(self):
+        return iter(self.d)
+
+    def __len__(self):
+        return len(self.d)
+
+    def clear(self):
+        self.d.clear()
+
+    def stats(self):
+        """Returns the number of hits, misses, and evictions, and the
+        size of the cache."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self.d)}
+
+
 class ExpiringDict(collections.abc.MutableMapping):
     """An efficient dictionary that MAY drop its items when they are too old.
     For guaranteed expiry, use TimeoutDict.
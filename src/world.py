@@ -96,15 +96,41 @@ if sys.version_info[0:3] == (3, 3, 1) and hasattr(select, 'poll'):
 
 commandsProcessed = 0
 
-ircs = [] # A list of all the IRCs.
+class IrcList(list):
+    """A list of Irc objects, which also indexes them by network."""
+    def __init__(self, *args, **kwargs):
+        super(IrcList, self).__init__(*args, **kwargs)
+        self._reindex()
+
+    def _reindex(self):
+        byNetwork = {}
+        for irc in self:
+            byNetwork.setdefault(irc.network.lower(), irc)
+        self.byNetwork = byNetwork
+        # Registry.Value.getSpecific ignores networks which are not in there.
+        registry.incrementGeneration()
+
+def _reindexing(name):
+    method = getattr(list, name)
+    def newMethod(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._reindex()
+    newMethod.__name__ = name
+    newMethod.__doc__ = method.__doc__
+    return newMethod
+
+for name in ('append', 'extend', 'insert', 'remove', 'pop', 'clear', 'sort',
+             'reverse', '__setitem__', '__delitem__', '__iadd__'):
+    setattr(IrcList, name, _reindexing(name))
+del name
+
+ircs = IrcList() # A list of all the IRCs.
 
 def getIrc(network):
     """Returns Irc object of the given network. <network> is string and not case-sensitive."""
-    network = network.lower()
-    for irc in ircs:
-        if irc.network.lower() == network:
-            return irc
-    return None
+    return ircs.byNetwork.get(network.lower())
 
 def _flushUserData():
     userdataFilename = os.path.join(conf.supybot.directories.conf(),
@@ -0,0 +1,57 @@
+###
+# Copyright (c) 2026, agent
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""Plugins with 'async def' commands, for test_callbacks.  They are in their
+own module because 'async def' is a syntax error before Python 3.5."""
+
+import asyncio
+
+import supybot.callbacks as callbacks
+from supybot.commands import wrap
+
+class AsyncCommands(callbacks.Plugin):
+    async def asyncecho(self, irc, msg, args, text):
+        """<text>"""
+        await asyncio.sleep(0)
+        irc.reply(text)
+    asyncecho = wrap(asyncecho, ['text'])
+
+    async def asyncerror(self, irc, msg, args):
+        """takes no arguments"""
+        await asyncio.sleep(0)
+        irc.error('async error')
+    asyncerror = wrap(asyncerror)
+
+    async def asyncraise(self, irc, msg, args):
+        """takes no arguments"""
+        await asyncio.sleep(0)
+        raise callbacks.ArgumentError()
+    asyncraise = wrap(asyncraise)
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -28,13 +28,23 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import sys
+import random
+
 from supybot.test import *
 
 import supybot.conf as conf
 import supybot.utils as utils
 import supybot.ircmsgs as ircmsgs
 import supybot.utils.minisix as minisix
+import supybot.plugin as plugin
 import supybot.callbacks as callbacks
+from supybot.commands import wrap
+
+if sys.version_info >= (3, 5):
+    from asynccommands import AsyncCommands
+else:
+    AsyncCommands = None
 
 tokenize = callbacks.tokenize
 
@@ -160,6 +170,38 @@ def testUnicode(self):
         s = s[:-1] + '\x0f'
         self.assertEqual(tokenize(s), [s])
 
+    def testCache(self):
+        tokens = tokenize('foo [bar baz]')
+        tokens[1].append('quux')
+        self.assertEqual(tokenize('foo [bar baz]'), ['foo', ['bar', 'baz']])
+        with conf.supybot.commands.nested.brackets.context('()'):
+            self.assertEqual(tokenize('foo [bar baz]'),
+                             ['foo', '[bar', 'baz]'])
+
+    def testSameAsShlexTokenizer(self):
+        # Random strings of characters that mean something to either
+        # tokenizer, compared with random settings.
+        alphabet = ['a', 'b', '0', 'n', 'x', 'u', ' ', ' ', '\t', '\r', '\n',
+                    '\x00', '"', "'", '`', '\\', '\\', '[', ']', '(', ')',
+                    '<', '>', '|', '\x02', '\xe9', '\u597d']
+        rng = random.Random(42)
+        def run(tokenizer, s):
+            try:
+                return tokenizer.tokenize(s)
+            except (SyntaxError, ValueError) as e:
+                return (type(e), str(e))
+        for i in range(3000):
+            s = ''.join(rng.choice(alphabet)
+                        for j in range(rng.randint(0, 20)))
+            kwargs = {
+                'brackets': rng.choice(['', '[]', '<>', '{}', '()']),
+                'pipe': rng.choice([True, False]),
+                'quotes': rng.choice(['"', '\'', '`\'', '"`\'']),
+            }
+            self.assertEqual(run(callbacks.Tokenizer(**kwargs), s),
+                             run(callbacks.ShlexTokenizer(**kwargs), s),
+                             (s, kwargs))
+
 
 class FunctionsTestCase(SupyTestCase):
     def testCanonicalName(self):
@@ -355,6 +397,71 @@ class AmbiguityTestCase(PluginTestCase):
         self.irc.addCallback(self.Bar(self.irc))
         self.assertResponse('bar', 'bar.bar')
 
+class CommandIndexTestCase(PluginTestCase):
+    plugins = ('Misc',)
+    class Foo(callbacks.Plugin):
+        def bar(self, irc, msg, args):
+            irc.reply('foo.bar')
+        class sub(callbacks.Commands):
+            def baz(self, irc, msg, args):
+                irc.reply('foo.sub.baz')
+    class Dynamic(callbacks.Plugin):
+        names = set()
+        def isCommandMethod(self, name):
+            return name in self.names or \
+                super(CommandIndexTestCase.Dynamic, self).isCommandMethod(name)
+        def getCommandMethod(self, command):
+            if command[-1] in self.names:
+                return lambda irc, msg, args: irc.reply('dynamic')
+            return super(CommandIndexTestCase.Dynamic, self) \
+                .getCommandMethod(command)
+
+    def testNested(self):
+        self.irc.addCallback(self.Foo(self.irc))
+        self.assertResponse('bar', 'foo.bar')
+        self.assertResponse('foo bar', 'foo.bar')
+        self.assertResponse('sub baz', 'foo.sub.baz')
+        self.assertResponse('foo sub baz', 'foo.sub.baz')
+
+    def testDisabled(self):
+        self.irc.addCallback(self.Foo(self.irc))
+        self.assertResponse('bar', 'foo.bar')
+        callbacks.Plugin._disabled.add('bar', 'Foo')
+        try:
+            self.assertNotRegexp('bar', 'foo.bar')
+        finally:
+            callbacks.Plugin._disabled.remove('bar', 'Foo')
+        self.assertResponse('bar', 'foo.bar')
+
+    def testRenamed(self):
+        cb = self.Foo(self.irc)
+        self.irc.addCallback(cb)
+        self.assertResponse('bar', 'foo.bar')
+        plugin.renameCommand(cb, 'bar', 'qux')
+        try:
+            self.assertResponse('qux', 'foo.bar')
+            self.assertNotRegexp('bar', 'foo.bar')
+        finally:
+            plugin.renameCommand(cb, 'qux', 'bar')
+        self.assertResponse('bar', 'foo.bar')
+
+    def testDynamic(self):
+        self.irc.addCallback(self.Foo(self.irc))
+        self.irc.addCallback(self.Dynamic(self.irc))
+        self.assertNotRegexp('qux', 'dynamic')
+        self.Dynamic.names.add('qux')
+        try:
+            self.assertResponse('qux', 'dynamic')
+            self.assertResponse('bar', 'foo.bar')
+        finally:
+            self.Dynamic.names.remove('qux')
+
+    def testRemoveCallback(self):
+        self.irc.addCallback(self.Foo(self.irc))
+        self.assertResponse('bar', 'foo.bar')
+        self.irc.removeCallback('Foo')
+        self.assertNotRegexp('bar', 'foo.bar')
+
 class ProperStringificationOfReplyArgs(PluginTestCase):
     plugins = ('Misc',) # Same as above.
     class NonString(callbacks.Plugin):
@@ -635,6 +742,14 @@ class PrivmsgTestCase(ChannelPluginTestCase):
     def testNoEscapingAttributeErrorFromTokenizeWithFirstElementList(self):
         self.assertError('[plugin list] list')
 
+    @unittest.skipIf(AsyncCommands is None, "'async def' needs Python 3.5")
+    def testAsyncCommand(self):
+        self.irc.addCallback(AsyncCommands(self.irc))
+        self.assertResponse('asyncecho foo bar', 'foo bar')
+        self.assertResponse('echo [asyncecho foo] bar', 'foo bar')
+        self.assertError('asyncerror')
+        self.assertResponse('asyncraise', 'asyncraise takes no arguments')
+
     class InvalidCommand(callbacks.Plugin):
         def invalidCommand(self, irc, msg, tokens):
             irc.reply('foo')
@@ -676,6 +791,49 @@ class PluginRegexpTestCase(PluginTestCase):
         self.irc.addCallback(self.PCAR(self.irc))
         self.assertResponse('test', 'test <foo>')
 
+class RegexpPrefilterTestCase(ChannelPluginTestCase):
+    plugins = ()
+    class Snarfer(callbacks.PluginRegexp):
+        regexps = ('fooSnarfer', 'barSnarfer', 'backrefSnarfer')
+        addressedRegexps = ('bazSnarfer',)
+        def fooSnarfer(self, irc, msg, match):
+            r'(?P<word>foo\w*)'
+            irc.reply('foo: %s' % match.group('word'), prefixNick=False)
+        def barSnarfer(self, irc, msg, match):
+            r'(?P<word>bar\w*)'
+            irc.reply('bar: %s' % match.group('word'), prefixNick=False)
+        def backrefSnarfer(self, irc, msg, match):
+            r'(\w)\1{3}'
+            irc.reply('backref: %s' % match.group(0), prefixNick=False)
+        def bazSnarfer(self, irc, msg, match):
+            r'^baz$'
+            irc.reply('baz', prefixNick=False)
+
+    def testRegexpPrefilter(self):
+        cb = self.Snarfer(self.irc)
+        self.assertFalse(callbacks.regexpPrefilter.search('qux'))
+        self.irc.addCallback(cb)
+        try:
+            self.assertEqual(cb.unfilteredRes, set([cb.res[2][0]]))
+            self.assertTrue(callbacks.regexpPrefilter.search('x foobar'))
+            self.assertFalse(callbacks.regexpPrefilter.search('qux'))
+
+            self.assertSnarfNoResponse('qux')
+            self.assertSnarfResponse('a FOOx b', 'foo: FOOx')
+            # In the order of the regexps, then of the matches
+            self.assertSnarfResponse('barfoo bar', 'foo: foo')
+            self.assertEqual(self.irc.takeMsg().args[1], 'bar: barfoo')
+            self.assertEqual(self.irc.takeMsg().args[1], 'bar: bar')
+            self.assertSnarfResponse('xxxx', 'backref: xxxx')
+            self.assertResponse('baz', 'baz')
+            self.assertEqual(cb.regexpMatches,
+                             {'fooSnarfer': 2, 'barSnarfer': 2,
+                              'backrefSnarfer': 1, 'bazSnarfer': 1})
+        finally:
+            self.irc.removeCallback(cb.name())
+            cb.die()
+        self.assertFalse(callbacks.regexpPrefilter.search('x foobar'))
+
 class RichReplyMethodsTestCase(PluginTestCase):
     plugins = ('Config',)
     class NoCapability(callbacks.Plugin):
@@ -28,7 +28,10 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import os
+import re
 import sys
+import time
 import getopt
 
 from supybot.test import *
@@ -218,5 +221,124 @@ class GetoptTestCase(PluginTestCase):
         self.assertResponse('bar --f 3 --fb 5',
                 'Error: Invalid arguments for bar.')
 
+def slowCount(n):
+    for i in range(n):
+        yield i
+    time.sleep(10)
+
+class ProcessTestCase(SupyTestCase):
+    def setUp(self):
+        if world.disableMultiprocessing:
+            self.skipTest('Test requires multiprocessing to be enabled')
+        SupyTestCase.setUp(self)
+
+    def testProcess(self):
+        self.assertEqual(process(pow, 2, 10), 1024)
+        self.assertRaises(ValueError, process, int, 'foo')
+        self.assertEqual(process(lambda: 42), 42) # Can't be pickled
+
+    def testPoolReusesProcesses(self):
+        with conf.supybot.commands.process.poolSize.context(1):
+            pid = process(os.getpid)
+            self.assertNotEqual(pid, os.getpid())
+            self.assertEqual(process(os.getpid), pid)
+        with conf.supybot.commands.process.poolSize.context(0):
+            self.assertNotEqual(process(os.getpid), process(os.getpid))
+
+    def testPoolKeptWhenRegistryChanges(self):
+        import supybot.commands as commands
+        chars = conf.supybot.reply.whenAddressedBy.chars
+        with conf.supybot.commands.process.poolSize.context(1):
+            pid = process(os.getpid)
+            forks = commands.processPoolsStats()['forks']
+            with chars.context('!'):
+                self.assertEqual(process(os.getpid), pid)
+            self.assertEqual(commands.processPoolsStats()['forks'], forks)
+
+    def testPoolTimeoutExcludesWaiting(self):
+        import threading
+        with conf.supybot.commands.process.poolSize.context(1):
+            process(os.getpid) # Forks the process
+            t = threading.Thread(target=process, args=(time.sleep, 0.5))
+            t.start()
+            time.sleep(0.1)
+            try:
+                # Waits about 0.4s for the process, then runs for 0.5s.
+                self.assertEqual(process(time.sleep, 0.5, timeout=0.8),
+                                 None)
+            finally:
+                t.join()
+
+    def testPoolWaitTimeout(self):
+        import threading
+        import supybot.commands as commands
+        with conf.supybot.commands.process.poolSize.context(1):
+            process(os.getpid) # Forks the process
+            t = threading.Thread(target=process, args=(time.sleep, 1))
+            t.start()
+            time.sleep(0.1)
+            try:
+                self.assertRaises(commands.ProcessTimeoutError,
+                                  process, os.getpid, timeout=0.2)
+            finally:
+                t.join()
+
+    def testPoolTimeout(self):
+        import supybot.commands as commands
+        with conf.supybot.commands.process.poolSize.context(1):
+            pid = process(os.getpid)
+            timeouts = commands.processPoolsStats()['timeouts']
+            self.assertRaises(commands.ProcessTimeoutError,
+                              process, time.sleep, 10, timeout=0.1)
+            self.assertEqual(commands.processPoolsStats()['timeouts'],
+                             timeouts + 1)
+            # It was replaced
+            newPid = process(os.getpid)
+            self.assertNotEqual(newPid, pid)
+            self.assertEqual(process(os.getpid), newPid)
+
+    def testProcessIter(self):
+        import supybot.commands as commands
+        for size in (0, 1):
+            with conf.supybot.commands.process.poolSize.context(size):
+                self.assertEqual(list(commands.processIter(range, 3)),
+                                 [0, 1, 2])
+                self.assertEqual(list(commands.processIter(
+                    lambda: iter('ab'))), ['a', 'b']) # Can't be pickled
+                self.assertRaises(ValueError, list,
+                                  commands.processIter(int, 'foo'))
+
+    def testProcessIterStop(self):
+        import supybot.commands as commands
+        with conf.supybot.commands.process.poolSize.context(1):
+            pid = process(os.getpid)
+            items = commands.processIter(slowCount, 3, timeout=5)
+            self.assertEqual(next(items), 0)
+            items.close()
+            # The process did not have to be killed
+            self.assertEqual(process(os.getpid), pid)
+
+    def testProcessIterTimeout(self):
+        import supybot.commands as commands
+        with conf.supybot.commands.process.poolSize.context(1):
+            items = []
+            def f():
+                for item in commands.processIter(slowCount, 3, timeout=0.5):
+                    items.append(item)
+            self.assertRaises(commands.ProcessTimeoutError, f)
+            self.assertEqual(items, [0, 1, 2])
+
+    def testRegexpFilter(self):
+        import supybot.commands as commands
+        strings = ['foo', 'bar', 'baz', 'qux']
+        self.assertEqual(list(commands.regexp_filter(
+            strings, [re.compile('a')], 1, 'Test', 'test')), [1, 2])
+        self.assertEqual(list(commands.regexp_filter(
+            strings, [re.compile('a'), re.compile('z')], 1, 'Test', 'test')),
+            [2])
+        self.assertRaises(commands.ProcessTimeoutError, list,
+            commands.regexp_filter(['a'*30], [re.compile('(a*)*b')], 0.2,
+                                   'Test', 'test'))
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
@@ -27,6 +27,9 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import sys
+import socket
+
 from supybot.test import *
 import supybot.ircdb as ircdb
 import supybot.irclib as irclib
@@ -106,3 +109,75 @@ class DriversTestCase(SupyTestCase):
             self.assertEqual(
                 driver._getNextServer(),
                 drivers.Server('example.com', 6697, True))
+
+
+class DriverTestCase(SupyTestCase):
+    driverModule = 'Socket'
+
+    def setUp(self):
+        super(DriverTestCase, self).setUp()
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.irc = None
+
+    def tearDown(self):
+        if self.irc is not None and self.irc.driver is not None:
+            self.irc.driver.die()
+            self.irc.driver._reallyDie()
+        self.listener.close()
+        ircdb.networks.networks = {}
+        super(DriverTestCase, self).tearDown()
+
+    def _accept(self):
+        self.listener.settimeout(0.1)
+        for _ in range(50):
+            drivers.run()
+            try:
+                return self.listener.accept()[0]
+            except socket.timeout:
+                pass
+        self.fail('The driver did not connect.')
+
+    def _runUntil(self, server, needle):
+        data = b''
+        for _ in range(50):
+            drivers.run()
+            try:
+                data += server.recv(4096)
+            except socket.timeout:
+                pass
+            if needle in data:
+                break
+        return data
+
+    def testPingPong(self):
+        port = self.listener.getsockname()[1]
+        with conf.supybot.networks.test.servers.context(
+                    ['127.0.0.1:%s' % port]), \
+                conf.supybot.networks.test.ssl.context(False):
+            self.irc = irclib.Irc('test')
+            drivers.newDriver(self.irc, self.driverModule)
+            server = self._accept()
+            server.settimeout(0.1)
+            try:
+                self.assertIn(b'NICK ', self._runUntil(server, b'NICK '))
+
+                # Message split across two reads
+                server.sendall(b'PING :f')
+                drivers.run()
+                server.sendall(b'oo\r\n')
+                self.assertIn(b'PONG :foo\r\n',
+                              self._runUntil(server, b'PONG :foo'))
+            finally:
+                server.close()
+
+
+class SelectorDriverTestCase(DriverTestCase):
+    driverModule = 'Selector'
+
+
+@unittest.skipIf(sys.version_info < (3, 5),
+                 "the Asyncio driver needs Python 3.5")
+class AsyncioDriverTestCase(DriverTestCase):
+    driverModule = 'Asyncio'
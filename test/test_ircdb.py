@@ -349,6 +349,79 @@ class IrcChannelTestCase(IrcdbTestCase):
         c.removeBan(banmask)
         self.assertFalse(c.checkIgnored(prefix))
 
+    def testBanExpiration(self):
+        c = ircdb.IrcChannel()
+        now = time.time()
+        c.addBan('*!*@*.example.org', now + 100)
+        c.addBan('*!*@spammer.example.org', now - 1)
+        c.addBan('foo!bar@baz', 0)
+        self.assertTrue(c.checkBan('foo!bar@BAZ'))
+        self.assertTrue(c.checkBan('foo!bar@spammer.example.org'))
+        self.assertEqual(c.expiredBans,
+                         [('*!*@spammer.example.org', int(now - 1))])
+        self.assertEqual(c.bans, {'*!*@*.example.org': int(now + 100),
+                                  'foo!bar@baz': 0})
+        # Changing the expiration of a ban
+        c.addBan('*!*@*.example.org', now - 1)
+        self.assertFalse(c.checkBan('foo!bar@spammer.example.org'))
+        self.assertEqual(list(c.bans), ['foo!bar@baz'])
+
+class HostmaskMatcherTestCase(IrcdbTestCase):
+    def testMatch(self):
+        patterns = ['foo!bar@baz', '*!*@*.example.org', 'nick[away]*!*@*',
+                    '*!user@10.0.0.*', '*!*@*', 'a*!*@*', 'f\u00f6\u00f6!*@*']
+        hostmasks = ['FOO!bar@baz', 'foo!bar@baz2', 'a!b@c.example.org',
+                     'a!b@example.org', 'NICK{AWAY}!b@c', 'nick!user@10.0.0.1',
+                     'nick!user@10.0.1.1', 'abc!d@e', 'F\u00d6\u00d6!b@c',
+                     'f\u00f6\u00f6!b@c', 'foo']
+        for pattern in patterns:
+            matcher = ircdb.HostmaskMatcher({pattern: 0})
+            for hostmask in hostmasks:
+                self.assertEqual(
+                    matcher.match(hostmask) is not None,
+                    ircutils.hostmaskPatternEqual(pattern, hostmask),
+                    (pattern, hostmask))
+            del matcher[pattern]
+            for hostmask in hostmasks:
+                self.assertIsNone(matcher.match(hostmask))
+
+    def testExpiration(self):
+        expired = []
+        matcher = ircdb.HostmaskMatcher(
+            onExpire=lambda *args: expired.append(args))
+        for i in range(100):
+            matcher['*!*@host%s' % i] = 1000 + i
+        matcher['*!*@host0'] = 0
+        matcher.expire(now=1050)
+        self.assertEqual(len(matcher), 50)
+        self.assertEqual(expired, [('*!*@host%s' % i, 1000 + i)
+                                   for i in range(1, 51)])
+        self.assertIsNotNone(matcher.match('a!b@host0', now=2000))
+        self.assertIsNone(matcher.match('a!b@host99', now=2000))
+        self.assertEqual(list(matcher), ['*!*@host0'])
+
+    def testCopyOnExpire(self):
+        expired = []
+        copyExpired = []
+        matcher = ircdb.HostmaskMatcher(
+            onExpire=lambda *args: expired.append(args))
+        matcher['*!*@host'] = 1000
+        matcher.copy().expire(now=2000)
+        matcher.copy(onExpire=lambda *args: copyExpired.append(args)) \
+            .expire(now=2000)
+        self.assertEqual(expired, [])
+        self.assertEqual(copyExpired, [('*!*@host', 1000)])
+        matcher.expire(now=2000)
+        self.assertEqual(expired, [('*!*@host', 1000)])
+
+    def testChannelBansOfOtherChannel(self):
+        c = ircdb.IrcChannel()
+        c.addBan('*!*@host', 1000)
+        c2 = ircdb.IrcChannel(bans=c.bans)
+        self.assertFalse(c2.checkBan('foo!bar@host'))
+        self.assertEqual(c2.expiredBans, [('*!*@host', 1000)])
+        self.assertEqual(c.expiredBans, [])
+
 class IrcNetworkTestCase(IrcdbTestCase):
     def testDefaults(self):
         n = ircdb.IrcNetwork()
@@ -445,6 +518,184 @@ class UsersDictionaryTestCase(IrcdbTestCase):
         u2.addHostmask('*!xyzzy@baz.domain.c?m')
         self.assertRaises(ValueError, self.users.setUser, u2)
 
+    def testGetUserIdIndex(self):
+        patterns = {
+            'foo': ['foo!bar@baz.example.org'],
+            'suffix': ['*!*@*.some-long-domain.example.net'],
+            'prefix': ['nick[away]*!*@*'],
+            'other': ['*!user@10.0.0.*'],
+        }
+        ids = {}
+        for (name, hostmasks) in patterns.items():
+            u = self.users.newUser()
+            u.name = name
+            for hostmask in hostmasks:
+                u.addHostmask(hostmask)
+            self.users.setUser(u)
+            ids[name] = u.id
+        self.assertEqual(self.users.getUserId('FOO!bar@baz.example.org'),
+                         ids['foo'])
+        self.assertEqual(
+            self.users.getUserId('a!b@c.some-long-domain.example.net'),
+            ids['suffix'])
+        self.assertEqual(
+            self.users.getUserId('NICK{AWAY}!b@c.example.com'),
+            ids['prefix'])
+        self.assertEqual(self.users.getUserId('nick!user@10.0.0.42'),
+                         ids['other'])
+        for hostmask in ('foo!bar@baz.example.com', 'nick!user@10.0.1.42',
+                         'a!b@some-long-domain.example.net',
+                         'nick!b@c.example.com'):
+            self.assertRaises(KeyError, self.users.getUserId, hostmask)
+
+        u = self.users.getUser(ids['suffix'])
+        u.removeHostmask('*!*@*.some-long-domain.example.net')
+        u.addHostmask('*!*@*.other.example.net')
+        self.users.setUser(u)
+        self.assertRaises(KeyError, self.users.getUserId,
+                          'a!b@c.some-long-domain.example.net')
+        self.assertEqual(self.users.getUserId('a!b@c.other.example.net'),
+                         ids['suffix'])
+
+        self.users.delUser(ids['other'])
+        self.assertRaises(KeyError, self.users.getUserId,
+                          'nick!user@10.0.0.42')
+
+    def testCacheEviction(self):
+        self.users._hostmaskCache.max = 5
+        self.users._nameCache.max = 5
+        ids = []
+        for i in range(10):
+            u = self.users.newUser()
+            u.name = 'user%s' % i
+            u.addHostmask('*!*@host%s' % i)
+            self.users.setUser(u)
+            ids.append(u.id)
+        for i in range(10):
+            for j in range(3):
+                self.assertEqual(
+                    self.users.getUserId('nick%s!user@host%s' % (j, i)),
+                    ids[i])
+            self.assertEqual(self.users.getUserId('user%s' % i), ids[i])
+        self.assertTrue(self.users._hostmaskCache.evictions)
+        # Both directions of the mappings are evicted together, so changes
+        # still invalidate the cache.
+        for i in range(10):
+            u = self.users.getUser(ids[i])
+            u.removeHostmask('*!*@host%s' % i)
+            u.addHostmask('*!*@newhost%s' % i)
+            u.name = 'newuser%s' % i
+            self.users.setUser(u)
+            for j in range(3):
+                self.assertRaises(KeyError, self.users.getUserId,
+                                  'nick%s!user@host%s' % (j, i))
+            self.assertRaises(KeyError, self.users.getUserId, 'user%s' % i)
+
+    def testGetUserIdAuth(self):
+        u = self.users.newUser()
+        u.name = 'foo'
+        u.addHostmask('foo!bar@baz.example.org')
+        self.users.setUser(u)
+        u.addAuth('other!nick@elsewhere.example.org')
+        self.users.setUser(u)
+        self.assertEqual(
+            self.users.getUserId('other!nick@elsewhere.example.org'), u.id)
+        u.clearAuth()
+        self.users.setUser(u)
+        self.assertRaises(KeyError, self.users.getUserId,
+                          'other!nick@elsewhere.example.org')
+
+
+class SqliteUsersDictionaryTestCase(UsersDictionaryTestCase):
+    """Runs the UsersDictionary tests on the SQLite backend."""
+    filename = os.path.join(conf.supybot.directories.conf(),
+                            'SqliteUsersDictionaryTestCase.sqlite3')
+    def setUp(self):
+        UsersDictionaryTestCase.setUp(self)
+        self.users = ircdb.SqliteUsersDictionary()
+        self.users.open(self.filename)
+
+    def tearDown(self):
+        self.users.close()
+        UsersDictionaryTestCase.tearDown(self)
+
+    def reopen(self):
+        self.users.close()
+        self.users = ircdb.SqliteUsersDictionary()
+        self.users.open(self.filename)
+
+    def testPersistance(self):
+        u = self.users.newUser()
+        u.name = 'foo'
+        u.addCapability('owner')
+        u.addHostmask('foo!bar@baz.example.org')
+        u.addHostmask('*!*@*.some-long-domain.example.net')
+        u.addNick('testnet', 'foonick')
+        u.setPassword('secret')
+        self.users.setUser(u)
+        u2 = self.users.newUser()
+        u2.name = 'bar'
+        self.users.setUser(u2)
+        self.reopen()
+        self.assertEqual(self.users.users, {})
+        self.assertEqual(self.users.numUsers(), 2)
+        self.assertEqual(self.users.getUserId('FOO'), u.id)
+        self.assertEqual(self.users.getUserId('foo!bar@baz.example.org'),
+                         u.id)
+        self.assertEqual(
+            self.users.getUserId('a!b@c.some-long-domain.example.net'), u.id)
+        self.assertEqual(self.users.getUserFromNick('testnet', 'foonick').id,
+                         u.id)
+        self.assertEqual(self.users.getUserFromNick('othernet', 'foonick'),
+                         None)
+        loaded = self.users.getUser(u.id)
+        self.assertTrue(loaded.checkPassword('secret'))
+        self.assertEqual(set(loaded.capabilities), set(u.capabilities))
+        self.assertEqual(loaded.hostmasks, u.hostmasks)
+        # Loaded only once, so authentications are kept.
+        self.assertIs(self.users.getUser('foo'), loaded)
+
+        # Ids are not reused.
+        self.assertEqual(self.users.newUser().id, 3)
+
+        self.users.delUser(u.id)
+        self.reopen()
+        self.assertEqual(self.users.numUsers(), 1)
+        self.assertRaises(KeyError, self.users.getUserId, 'foo')
+        self.assertRaises(KeyError, self.users.getUserId,
+                          'a!b@c.some-long-domain.example.net')
+
+    def testFlushOnlyChangedUsers(self):
+        for name in ('foo', 'bar'):
+            u = self.users.newUser()
+            u.name = name
+            self.users.setUser(u)
+        self.reopen()
+        foo = self.users.getUser('foo')
+        self.users.getUser('bar')
+        changes = self.users.db.total_changes
+        self.users.flush()
+        self.assertEqual(self.users.db.total_changes, changes)
+        foo.addCapability('owner') # Without setUser
+        self.users.flush()
+        self.assertGreater(self.users.db.total_changes, changes)
+        changes = self.users.db.total_changes
+        self.users.flush()
+        self.assertEqual(self.users.db.total_changes, changes)
+        self.reopen()
+        self.assertIn('owner', self.users.getUser('foo').capabilities)
+
+    def testHostmaskCollisionNotLoaded(self):
+        u = self.users.newUser()
+        u.name = 'foo'
+        u.addHostmask('foo!bar@baz.example.org')
+        self.users.setUser(u)
+        self.reopen()
+        u2 = self.users.newUser()
+        u2.name = 'bar'
+        u2.addHostmask('*!bar@*.example.org')
+        self.assertRaises(ValueError, self.users.setUser, u2)
+
 
 class NetworksDictionaryTestCase(IrcdbTestCase):
     filename = os.path.join(conf.supybot.directories.conf(),
@@ -538,6 +789,7 @@ class CheckCapabilityTestCase(IrcdbTestCase):
     justchanfoo = 'justchanfoo!justchanfoo@justchanfoo'
     antichanfoo = 'antichanfoo!antichanfoo@antichanfoo'
     securefoo = 'securefoo!securefoo@securefoo'
+    nonexistent = 'nonexistent!nonexistent@nonexistent'
     channel = '#channel'
     cap = 'foo'
     anticap = ircdb.makeAntiCapability(cap)
@@ -689,15 +941,64 @@ class CheckCapabilityTestCase(IrcdbTestCase):
         finally:
             conf.supybot.capabilities.default.set(str(originalConfDefaultAllow))
 
+    def testCache(self):
+        cache = ircdb.capabilityCache
+        cache.clear()
+        hits = cache.hits
+        misses = cache.misses
+        invalidations = cache.invalidations
+        self.assertTrue(self.checkCapability(self.nothing, self.cap))
+        self.assertTrue(self.checkCapability(self.nothing, self.cap))
+        self.assertEqual(cache.hits - hits, 1)
+        self.assertEqual(cache.misses - misses, 1)
+
+        # Changes of the user's capabilities
+        u = self.users.getUser(self.nothing)
+        u.addCapability(self.anticap)
+        self.assertFalse(self.checkCapability(self.nothing, self.cap))
+        self.assertEqual(cache.invalidations - invalidations, 1)
+        u.removeCapability(self.anticap)
+        self.assertTrue(self.checkCapability(self.nothing, self.cap))
+
+        # Changes of the default capabilities
+        with conf.supybot.capabilities.default.context(False):
+            self.assertFalse(self.checkCapability(self.nothing, self.cap))
+            self.assertFalse(self.checkCapability(self.nonexistent, self.cap))
+        self.assertTrue(self.checkCapability(self.nothing, self.cap))
+        conf.supybot.capabilities().add(self.anticap)
+        try:
+            self.assertFalse(self.checkCapability(self.nonexistent, self.cap))
+        finally:
+            conf.supybot.capabilities().remove(self.anticap)
+        self.assertTrue(self.checkCapability(self.nonexistent, self.cap))
+
+        # Changes of the channel's capabilities
+        self.assertTrue(self.checkCapability(self.nothing, self.chancap))
+        channel = self.channels.getChannel(self.channel)
+        channel.addCapability(self.anticap)
+        self.assertFalse(self.checkCapability(self.nothing, self.chancap))
+        channel.setDefaultCapability(False)
+        self.assertTrue(self.checkCapability(self.nothing, self.antichancap))
+        self.channels.setChannel(self.channel, ircdb.IrcChannel())
+        self.assertTrue(self.checkCapability(self.nothing, self.chancap))
+
+        # Changes of the users' hostmasks
+        self.assertTrue(self.checkCapability(self.nonexistent, self.cap))
+        u = self.users.getUser('antifoo')
+        u.addHostmask(self.nonexistent)
+        self.users.setUser(u)
+        self.assertFalse(self.checkCapability(self.nonexistent, self.cap))
+
 class PersistanceTestCase(IrcdbTestCase):
     filename = os.path.join(conf.supybot.directories.conf(),
                             'PersistanceTestCase.conf')
     def setUp(self):
         IrcdbTestCase.setUp(self)
-        try:
-            os.remove(self.filename)
-        except OSError:
-            pass
+        for filename in (self.filename, self.filename + '.journal'):
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
         super(PersistanceTestCase, self).setUp()
 
     def testAddUser(self):
@@ -738,6 +1039,146 @@ class PersistanceTestCase(IrcdbTestCase):
         db2.open(self.filename)
         self.assertEqual(list(db.users), [])
 
+    def testUsersJournal(self):
+        db = ircdb.UsersDictionary()
+        db.open(self.filename)
+        for name in ('foouser', 'baruser'):
+            u = db.newUser()
+            u.name = name
+            u.addHostmask('*!%s@host' % name)
+            db.setUser(u)
+        with open(self.filename) as fd:
+            snapshot = fd.read()
+        u = db.getUser('foouser')
+        u.addCapability('foocapa')
+        db.setUser(u)
+        db.delUser(db.getUserId('baruser'))
+        # Changes are only appended to the journal
+        with open(self.filename) as fd:
+            self.assertEqual(fd.read(), snapshot)
+        self.assertTrue(os.path.exists(db.journalFilename()))
+
+        db2 = ircdb.UsersDictionary()
+        db2.open(self.filename)
+        self.assertEqual(list(db2.users), [1])
+        self.assertEqual(db2.users[1].name, 'foouser')
+        self.assertIn('foocapa', db2.users[1].capabilities)
+        # Opening merges the journal
+        self.assertFalse(os.path.exists(db.journalFilename()))
+        with open(self.filename) as fd:
+            self.assertNotEqual(fd.read(), snapshot)
+
+        u = db2.getUser('foouser')
+        u.addCapability('barcapa')
+        db2.setUser(u)
+        db2.flush()
+        self.assertFalse(os.path.exists(db2.journalFilename()))
+        db3 = ircdb.UsersDictionary()
+        db3.open(self.filename)
+        self.assertIn('barcapa', db3.users[1].capabilities)
+
+    def testJournalSize(self):
+        db = ircdb.UsersDictionary()
+        db.open(self.filename)
+        with conf.supybot.databases.journalSize.context(100):
+            for i in range(10):
+                u = db.newUser()
+                u.name = 'user%s' % i
+                u.addHostmask('*!user%s@host' % i)
+                db.setUser(u)
+                size = os.path.getsize(db.journalFilename()) \
+                    if os.path.exists(db.journalFilename()) else 0
+                self.assertLess(size, 200)
+        db2 = ircdb.UsersDictionary()
+        db2.open(self.filename)
+        self.assertEqual(len(db2.users), 10)
+
+    def testChannelsJournal(self):
+        db = ircdb.ChannelsDictionary()
+        db.open(self.filename)
+        db.flush() # The journal is only used once the database file exists
+        c = db.getChannel('#foo')
+        c.addBan('*!*@spammer', 0)
+        db.setChannel('#foo', c)
+        self.assertTrue(os.path.exists(db.journalFilename()))
+        db2 = ircdb.ChannelsDictionary()
+        db2.open(self.filename)
+        self.assertEqual(db2.getChannel('#foo').bans, {'*!*@spammer': 0})
+
+
+class SqliteTestCase(IrcdbTestCase):
+    filename = os.path.join(conf.supybot.directories.conf(),
+                            'SqliteTestCase.sqlite3')
+    def setUp(self):
+        IrcdbTestCase.setUp(self)
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(self.filename + suffix)
+            except OSError:
+                pass
+
+    def testChannels(self):
+        db = ircdb.SqliteChannelsDictionary()
+        db.open(self.filename)
+        c = db.getChannel('#foo')
+        c.addBan('*!*@spammer', 0)
+        c.addIgnore('*!*@troll', 42)
+        c.addCapability('-op')
+        c.lobotomized = True
+        db.setChannel('#foo', c)
+        db.close()
+        db = ircdb.SqliteChannelsDictionary()
+        db.open(self.filename)
+        self.assertEqual(db.channels, {})
+        c = db.getChannel('#FOO')
+        self.assertEqual(c.bans, {'*!*@spammer': 0})
+        self.assertEqual(c.ignores, {'*!*@troll': 42})
+        self.assertTrue(c.lobotomized)
+        self.assertIn('-op', c.capabilities)
+        self.assertEqual([name for (name, _) in db.items()], ['#foo'])
+        db.close()
+
+    def testIgnores(self):
+        db = ircdb.SqliteIgnoresDB()
+        db.open(self.filename)
+        db.add('foo!bar@baz')
+        db.add('*!*@expired', 1)
+        db.add('*!*@*.example.org', time.time() + 1000)
+        db.remove('foo!bar@baz')
+        db.close()
+        db = ircdb.SqliteIgnoresDB()
+        db.open(self.filename)
+        self.assertEqual(list(db.hostmasks), ['*!*@*.example.org'])
+        self.assertTrue(db.checkIgnored('a!b@c.example.org'))
+        db.close()
+
+    def testCopyToSqlite(self):
+        users = ircdb.UsersDictionary()
+        u = users.newUser()
+        u.name = 'foo'
+        u.addHostmask('*!bar@baz.example.org')
+        users.setUser(u, flush=False)
+        channels = ircdb.ChannelsDictionary()
+        c = channels.getChannel('#foo')
+        c.addBan('*!*@spammer', 0)
+        ignores = ircdb.IgnoresDB()
+        ignores.add('*!*@troll')
+        ircdb.copyToSqlite(self.filename, users, channels, ignores)
+
+        sqliteUsers = ircdb.SqliteUsersDictionary()
+        sqliteUsers.open(self.filename)
+        self.assertEqual(sqliteUsers.getUserId('a!bar@baz.example.org'), u.id)
+        sqliteUsers.close()
+        sqliteChannels = ircdb.SqliteChannelsDictionary()
+        sqliteChannels.open(self.filename)
+        self.assertEqual(sqliteChannels.getChannel('#foo').bans,
+                         {'*!*@spammer': 0})
+        sqliteChannels.close()
+        sqliteIgnores = ircdb.SqliteIgnoresDB()
+        sqliteIgnores.open(self.filename)
+        self.assertEqual(sqliteIgnores.hostmasks, {'*!*@troll': 0})
+        sqliteIgnores.close()
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
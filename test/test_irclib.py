@@ -34,6 +34,7 @@ import unittest.mock
 from supybot.test import *
 
 import supybot.conf as conf
+import supybot.registry as registry
 import supybot.irclib as irclib
 import supybot.drivers as drivers
 import supybot.ircmsgs as ircmsgs
@@ -162,6 +163,31 @@ class IrcCommandDispatcherTestCase(SupyTestCase):
                 dispatcher.dispatchCommand('foobar'),
                 None)
 
+class TokenBucketTestCase(SupyTestCase):
+    def testBurst(self):
+        bucket = irclib.TokenBucket()
+        self.assertTrue(bucket.take(100, 2, 3))
+        self.assertTrue(bucket.take(100, 2, 3))
+        self.assertTrue(bucket.take(100, 2, 3))
+        self.assertFalse(bucket.take(100, 2, 3))
+        self.assertEqual(bucket.delay(100, 2, 3), 2)
+        self.assertEqual(bucket.delay(101, 2, 3), 1)
+        self.assertTrue(bucket.take(102, 2, 3))
+        self.assertFalse(bucket.take(102, 2, 3))
+
+        # Refills up to the capacity only
+        self.assertTrue(bucket.take(200, 2, 3))
+        self.assertTrue(bucket.take(200, 2, 3))
+        self.assertTrue(bucket.take(200, 2, 3))
+        self.assertFalse(bucket.take(200, 2, 3))
+
+    def testNoInterval(self):
+        bucket = irclib.TokenBucket()
+        for _ in range(10):
+            self.assertTrue(bucket.take(100, 0, 1))
+        self.assertEqual(bucket.delay(100, 0, 1), 0)
+
+
 class IrcMsgQueueTestCase(SupyTestCase):
     mode = ircmsgs.op('#foo', 'jemfinch')
     msg = ircmsgs.privmsg('#foo', 'hey, you')
@@ -273,6 +299,47 @@ class IrcMsgQueueTestCase(SupyTestCase):
         finally:
             configVar.setValue(original)
 
+    def testRateLimitedJoinStaysQueued(self):
+        join2 = ircmsgs.join('#bar')
+        with conf.supybot.protocols.irc.queuing.rateLimit.join.context(100):
+            q = irclib.IrcMsgQueue()
+            q.enqueue(self.join)
+            q.enqueue(join2)
+            self.assertEqual(self.join, q.dequeue())
+            self.assertIsNone(q.dequeue())
+            self.assertFalse(self.join in q)
+            self.assertTrue(join2 in q)
+            self.assertEqual(len(q), 1)
+
+    def testRoundRobinTargets(self):
+        q = irclib.IrcMsgQueue()
+        foo = [ircmsgs.privmsg('#foo', str(i)) for i in range(3)]
+        bar = ircmsgs.privmsg('#bar', 'hi')
+        for msg in foo:
+            q.enqueue(msg)
+        q.enqueue(bar)
+        q.enqueue(ircmsgs.privmsg('#FOO', 'last'))
+        self.assertEqual(q.dequeue(), foo[0])
+        self.assertEqual(q.dequeue(), bar)
+        self.assertEqual(q.dequeue(), foo[1])
+        self.assertEqual(q.dequeue(), foo[2])
+        self.assertEqual(q.dequeue(), ircmsgs.privmsg('#FOO', 'last'))
+        self.assertFalse(q)
+
+    def testTargetStats(self):
+        q = irclib.IrcMsgQueue()
+        q.enqueue(ircmsgs.privmsg('#foo', 'a'))
+        timeFastForward(5)
+        q.enqueue(ircmsgs.privmsg('#Foo', 'b'))
+        q.enqueue(ircmsgs.privmsg('nick', 'c'))
+        q.enqueue(self.ping)
+        stats = q.targetStats()
+        self.assertEqual(set(stats), {'#foo', 'nick', None})
+        self.assertEqual(stats['#foo'][0], 2)
+        self.assertGreaterEqual(stats['#foo'][1], 5)
+        self.assertEqual(stats['nick'][0], 1)
+        self.assertLess(stats['nick'][1], 5)
+
     def testJoinBeforeWho(self):
         q = irclib.IrcMsgQueue()
         q.enqueue(self.join)
@@ -346,6 +413,93 @@ class ChannelStateTestCase(SupyTestCase):
         self.assertFalse('quuz' in c.voices)
 
 
+    def testViews(self):
+        c = irclib.ChannelState()
+        c.addUser('@Foo')
+        c.addUser('+bar')
+        c.addUser('baz')
+        self.assertEqual(len(c.users), 3)
+        self.assertEqual(len(c.ops), 1)
+        self.assertEqual(c.users, ircutils.IrcSet(['foo', 'BAR', 'baz']))
+        self.assertEqual(sorted(c.users), ['Foo', 'bar', 'baz'])
+        self.assertEqual(list(c.voices), ['bar'])
+        self.assertEqual(c.users - c.ops, ircutils.IrcSet(['bar', 'baz']))
+        c.ops.add('baz')
+        c.ops.discard('FOO')
+        self.assertRaises(KeyError, c.ops.remove, 'foo')
+        self.assertEqual(list(c.ops), ['baz'])
+        self.assertTrue(c.isOp('BAZ'))
+        self.assertNotIn(None, c.users)
+        c.removeUser('bar')
+        self.assertEqual(len(c.users), 2)
+        self.assertEqual(len(c.voices), 0)
+
+    def testNickTable(self):
+        table = irclib.NickTable()
+        c1 = irclib.ChannelState(table)
+        c2 = irclib.ChannelState(table)
+        c1.addUser('@Foo')
+        c2.addUser('foo')
+        self.assertIs(list(c1.users)[0], list(c2.users)[0])
+        self.assertEqual(len(table), 1)
+        c1.removeUser('foo')
+        self.assertIn('foo', table)
+        c2.replaceUser('foo', 'bar')
+        self.assertNotIn('foo', table)
+        self.assertEqual(table.released, ['Foo'])
+        c2.removeAllUsers()
+        self.assertEqual(len(table), 0)
+
+class HistoryTestCase(SupyTestCase):
+    def msgs(self):
+        return [ircmsgs.privmsg('#foo', 'a', prefix='foo!u@h'),
+                ircmsgs.privmsg('#bar', 'b', prefix='foo!u@h'),
+                ircmsgs.privmsg('#Foo', 'c', prefix='bar!u@h'),
+                ircmsgs.quit(prefix='foo!u@h'),
+                ircmsgs.privmsg('#foo', 'd', prefix='BAR!u@h'),
+                ircmsgs.privmsg('#foo', 'e')]
+
+    def testSearch(self):
+        L = self.msgs()
+        h = irclib.History(10, L)
+        self.assertEqual(list(h.search()), L[::-1])
+        self.assertEqual(list(h.search(channel='#FOO')), [L[5], L[4], L[2], L[0]])
+        self.assertEqual(list(h.search(nick='foo')), [L[3], L[1], L[0]])
+        self.assertEqual(list(h.search('#foo', 'bar')), [L[4], L[2]])
+        self.assertEqual(list(h.search('#foo', 'foo')), [L[0]])
+        self.assertEqual(list(h.search('#baz')), [])
+        self.assertEqual(list(h.search('#baz', 'foo')), [])
+
+    def testDropsFromIndexes(self):
+        L = self.msgs()
+        h = irclib.History(3, L)
+        self.assertEqual(list(h), L[3:])
+        self.assertEqual(list(h.search(channel='#foo')), [L[5], L[4]])
+        self.assertEqual(list(h.search(nick='foo')), [L[3]])
+        self.assertNotIn('#bar', h.channels)
+        h.extend(self.msgs()[:3])
+        self.assertEqual(len(list(h.search(nick='foo'))), 2)
+        self.assertEqual(sum(map(len, h.channels.values())), 3)
+        h.resize(2)
+        self.assertEqual(sum(map(len, h.nicks.values())), 2)
+        h.reset()
+        self.assertEqual((h.channels, h.nicks), ({}, {}))
+
+    def testSearchWhileAppending(self):
+        L = self.msgs()
+        h = irclib.History(3, L)
+        it = h.search(channel='#foo')
+        h.extend(L)
+        self.assertEqual(list(it), [L[5], L[4]])
+
+    def testPickleCopy(self):
+        L = self.msgs()
+        h = irclib.History(4, L)
+        for h2 in (pickle.loads(pickle.dumps(h)), copy.deepcopy(h)):
+            self.assertEqual(h, h2)
+            self.assertEqual(list(h2.search('#foo', 'bar')),
+                             list(h.search('#foo', 'bar')))
+
 class IrcStateTestCase(SupyTestCase):
     class FakeIrc:
         nick = 'nick'
@@ -398,6 +552,22 @@ class IrcStateTestCase(SupyTestCase):
             self.assertEqual(list(state.history),
                              msgs[len(msgs) - maxHistoryLength():])
 
+    def testHistoryLengthOfNetwork(self):
+        maxHistoryLength = conf.supybot.protocols.irc.maxHistoryLength
+        conf.registerNetwork('historytest')
+        with maxHistoryLength.get(':historytest').context(5):
+            irc = getTestIrc('historytest')
+            try:
+                self.assertEqual(irc.state.history.maxSize, 5)
+                self.assertEqual(irc.state.copy().history.maxSize, 5)
+                self.assertEqual(irclib.IrcState().history.maxSize,
+                                 maxHistoryLength())
+                irc.state.history.resize(10)
+                irc.reset()
+                self.assertEqual(irc.state.history.maxSize, 5)
+            finally:
+                irc._reallyDie()
+
     def testWasteland005(self):
         state = irclib.IrcState()
         # Here we're testing if PREFIX works without the (ov) there.
@@ -405,6 +575,19 @@ class IrcStateTestCase(SupyTestCase):
         self.assertEqual(state.supported['prefix']['o'], '@')
         self.assertEqual(state.supported['prefix']['v'], '+')
 
+    def testChantypesIncrementsRegistryGeneration(self):
+        state = irclib.IrcState()
+        generation = registry.generation
+        state.addMsg(self.irc, ircmsgs.IrcMsg(':irc.example.org 005 nick NETWORK=Example :are supported by this server'))
+        self.assertEqual(registry.generation, generation)
+        state.addMsg(self.irc, ircmsgs.IrcMsg(':irc.example.org 005 nick CHANTYPES=# :are supported by this server'))
+        self.assertGreater(registry.generation, generation)
+        generation = registry.generation
+        state.addMsg(self.irc, ircmsgs.IrcMsg(':irc.example.org 005 nick CHANTYPES=# :are supported by this server'))
+        self.assertEqual(registry.generation, generation)
+        state.reset()
+        self.assertGreater(registry.generation, generation)
+
     def testIRCNet005(self):
         state = irclib.IrcState()
         # Testing IRCNet's misuse of MAXBANS
@@ -468,6 +651,101 @@ class IrcStateTestCase(SupyTestCase):
         self.assertTrue('foo' in st2.channels['#foo'].users)
 
 
+    def testForgetHostmasks(self):
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.join('#bar', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix='foo!bar@baz'))
+        st.addMsg(self.irc, ircmsgs.join('#bar', prefix='foo!bar@baz'))
+        st.addMsg(self.irc, ircmsgs.part('#foo', prefix='foo!bar@baz'))
+        st.addMsg(self.irc, ircmsgs.ping('x'))
+        self.assertEqual(st.nickToHostmask('foo'), 'foo!bar@baz')
+        st.addMsg(self.irc, ircmsgs.kick('#bar', 'foo',
+                                         prefix=self.irc.prefix))
+        # Still available to the callbacks handling the KICK
+        self.assertEqual(st.nickToHostmask('foo'), 'foo!bar@baz')
+        st.addMsg(self.irc, ircmsgs.ping('x'))
+        self.assertRaises(KeyError, st.nickToHostmask, 'foo')
+        # Also when the bot leaves the channel
+        st.addMsg(self.irc, ircmsgs.join('#bar', prefix='foo!bar@baz'))
+        st.addMsg(self.irc, ircmsgs.part('#bar', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.ping('x'))
+        self.assertRaises(KeyError, st.nickToHostmask, 'foo')
+        self.assertEqual(st.nickToHostmask(self.irc.nick), self.irc.prefix)
+
+    def testForgetHostmasksOutsideChannels(self):
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.privmsg(self.irc.nick, 'hi',
+                                            prefix='foo!bar@baz'))
+        # Still available to the callbacks handling the PRIVMSG
+        self.assertEqual(st.nickToHostmask('foo'), 'foo!bar@baz')
+        st.addMsg(self.irc, ircmsgs.privmsg('#elsewhere', 'hi',
+                                            prefix='qux!bar@baz'))
+        self.assertRaises(KeyError, st.nickToHostmask, 'foo')
+        st.addMsg(self.irc, ircmsgs.nick('quux', prefix='qux!bar@baz'))
+        st.addMsg(self.irc, ircmsgs.ping('x'))
+        self.assertRaises(KeyError, st.nickToHostmask, 'qux')
+        self.assertRaises(KeyError, st.nickToHostmask, 'quux')
+        self.assertEqual(st.nickToHostmask(self.irc.nick), self.irc.prefix)
+        # Users in our channels are kept.
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix='foo!bar@baz'))
+        st.addMsg(self.irc, ircmsgs.privmsg(self.irc.nick, 'hi',
+                                            prefix='foo!bar@baz'))
+        st.addMsg(self.irc, ircmsgs.ping('x'))
+        self.assertEqual(st.nickToHostmask('foo'), 'foo!bar@baz')
+
+    def testCopySharesNickTable(self):
+        st = irclib.IrcState()
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.join('#bar', prefix=self.irc.prefix))
+        for st2 in (st.copy(), pickle.loads(pickle.dumps(st))):
+            self.assertEqual(st, st2)
+            self.assertIs(st2.channels['#foo'].nickTable, st2.nickTable)
+            self.assertIs(st2.channels['#bar'].nickTable, st2.nickTable)
+            self.assertIsNot(st2.nickTable, st.nickTable)
+            self.assertEqual(st2.channelsOf(self.irc.nick), {'#foo', '#bar'})
+
+    def testChannelsOf(self):
+        st = irclib.IrcState()
+        for channel in ('#foo', '#bar', '#baz'):
+            st.addMsg(self.irc, ircmsgs.join(channel, prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix='foo!bar@baz'))
+        st.addMsg(self.irc, ircmsgs.join('#bar', prefix='foo!bar@baz'))
+        self.assertEqual(st.channelsOf('FOO'), {'#foo', '#bar'})
+        self.assertEqual(st.channelsOf('nobody'), set())
+        st.addMsg(self.irc, ircmsgs.part('#foo', prefix='foo!bar@baz'))
+        self.assertEqual(st.channelsOf('foo'), {'#bar'})
+        m = ircmsgs.IrcMsg(':foo!bar@baz NICK qux')
+        st.addMsg(self.irc, m)
+        self.assertEqual(m.tagged('channels'), {'#bar'})
+        self.assertEqual(st.channelsOf('foo'), set())
+        self.assertEqual(st.channelsOf('qux'), {'#bar'})
+        m = ircmsgs.quit(prefix='qux!bar@baz')
+        st.addMsg(self.irc, m)
+        self.assertEqual(m.tagged('channels'), {'#bar'})
+        self.assertEqual(st.channelsOf('qux'), set())
+        self.assertNotIn('qux', st.channels['#bar'].users)
+        self.assertEqual(st.channelsOf(self.irc.nick),
+                         {'#foo', '#bar', '#baz'})
+
+    def testChannelsOfAssignedChannels(self):
+        st = irclib.IrcState()
+        c = irclib.ChannelState()
+        c.addUser('@foo')
+        st.channels['#foo'] = c
+        self.assertEqual(c.name, '#foo')
+        self.assertIs(c.nickTable, st.nickTable)
+        self.assertIn('foo', st.nickTable)
+        self.assertTrue(c.isOp('foo'))
+        self.assertEqual(st.channelsOf('foo'), {'#foo'})
+        st.channels['#foo'] = irclib.ChannelState()
+        self.assertEqual(st.channelsOf('foo'), set())
+        st.channels['#foo'].addUser('foo')
+        del st.channels['#foo']
+        self.assertEqual(st.channelsOf('foo'), set())
+        self.assertNotIn('foo', st.nickTable)
+
     def testEq(self):
         state1 = irclib.IrcState()
         state2 = irclib.IrcState()
@@ -968,6 +1246,43 @@ class IrcTestCase(SupyTestCase):
             self.irc.removeCallback(c.name())
         self.assertEqual(c.batch, irclib.Batch('netjoin', (), [m1, m2, m3, m4]))
 
+    def testDispatchTable(self):
+        calls = []
+        class Handler(irclib.IrcCallback):
+            def name(self):
+                return 'handler'
+            def doJoin(self, irc, msg):
+                calls.append(('handler', msg.command))
+        class Filter(irclib.IrcCallback):
+            def name(self):
+                return 'filter'
+            def inFilter(self, irc, msg):
+                calls.append(('filter', msg.command))
+                return msg
+        class Caller(irclib.IrcCallback):
+            def name(self):
+                return 'caller'
+            def __call__(self, irc, msg):
+                calls.append(('caller', msg.command))
+        callbacks = [Handler(), Filter(), Caller()]
+        for cb in callbacks:
+            self.irc.addCallback(cb)
+        try:
+            table = self.irc._getDispatchTable()
+            self.assertEqual(table.inFilters, [callbacks[1]])
+            self.assertEqual(set(table.get('JOIN')),
+                             set([callbacks[0], callbacks[2]]))
+            self.assertEqual(table.get('PART'), [callbacks[2]])
+            self.irc.feedMsg(ircmsgs.IrcMsg(':someuser JOIN #foo'))
+            self.irc.feedMsg(ircmsgs.IrcMsg(':someuser PART #foo'))
+            self.assertEqual(sorted(calls), sorted([
+                ('handler', 'JOIN'), ('filter', 'JOIN'), ('caller', 'JOIN'),
+                ('filter', 'PART'), ('caller', 'PART')]))
+        finally:
+            for cb in callbacks:
+                self.irc.removeCallback(cb.name())
+        self.assertEqual(self.irc._getDispatchTable().get('JOIN'), [])
+
 class SaslTestCase(SupyTestCase, CapNegMixin):
     def setUp(self):
         pass
@@ -206,6 +206,36 @@ class IrcMsgTestCase(SupyTestCase):
                              ':Angel!angel@example.org PRIVMSG Wiz :Hello')
         self.assertEqual(msg.time, 1319042451.62)
 
+        before = time.time()
+        msg = ircmsgs.IrcMsg('@time=garbage '
+                             ':Angel!angel@example.org PRIVMSG Wiz :Hello')
+        after = time.time()
+        self.assertEqual(msg.server_tags, {'time': 'garbage'})
+        self.assertTrue(before <= msg.time <= after)
+
+    def testTimeSetBeforeTagsParsed(self):
+        msg = ircmsgs.IrcMsg('@time=2011-10-19T16:40:51.620Z '
+                             ':Angel!angel@example.org PRIVMSG Wiz :Hello')
+        msg.time = 24
+        self.assertEqual(msg.time, 24)
+        self.assertEqual(msg.server_tags,
+                         {'time': '2011-10-19T16:40:51.620Z'})
+        self.assertEqual(msg.time, 24)
+
+    def testHostmaskParts(self):
+        msg = ircmsgs.IrcMsg(':nick!ident@host.com PRIVMSG me :Hello')
+        self.assertEqual((msg.nick, msg.user, msg.host),
+                         ('nick', 'ident', 'host.com'))
+        msg = ircmsgs.IrcMsg(':irc.example.org NOTICE me :Hello')
+        self.assertEqual((msg.nick, msg.user, msg.host),
+                         ('irc.example.org',)*3)
+        msg = ircmsgs.IrcMsg('PING :irc.example.org')
+        self.assertEqual((msg.nick, msg.user, msg.host), ('', '', ''))
+
+    def testSlots(self):
+        msg = ircmsgs.IrcMsg(':nick!ident@host.com PRIVMSG me :Hello')
+        self.assertFalse(hasattr(msg, '__dict__'))
+
 class FunctionsTestCase(SupyTestCase):
     def testIsAction(self):
         L = [':jemfinch!~jfincher@ts26-2.homenet.ohio-state.edu PRIVMSG'
@@ -285,4 +285,34 @@ class InheritanceTestCase(SupyTestCase):
         self.assertTrue(child._wasSet)
         self.assertEqual(child(), 'baz') # Keeps its own value
 
+class SpecificTestCase(SupyTestCase):
+    def testCacheInvalidation(self):
+        group = registry.Group()
+        group.setName('group')
+        value = registry.String('foo', 'help')
+        conf.registerChannelValue(group, 'val', value)
+        # Cached before the network exists and before any value is set
+        self.assertEqual(value.getSpecific('specnet', '#chan')(), 'foo')
+        self.assertEqual(value.getSpecific(channel='#chan')(), 'foo')
+
+        value.get('#chan').setValue('bar')
+        self.assertEqual(value.getSpecific(channel='#chan')(), 'bar')
+        self.assertEqual(value.getSpecific('specnet', '#chan')(), 'bar')
+        self.assertEqual(value.getSpecific('specnet', '#other')(), 'foo')
+
+        # 'specnet' is ignored until there is an Irc object for it.
+        value.get(':specnet').setValue('baz')
+        self.assertEqual(value.getSpecific('specnet', '#other')(), 'foo')
+        conf.registerNetwork('specnet')
+        irc = getTestIrc('specnet')
+        try:
+            self.assertEqual(value.getSpecific('specnet', '#other')(), 'baz')
+            self.assertEqual(value.getSpecific('specnet')(), 'baz')
+        finally:
+            irc._reallyDie()
+        self.assertEqual(value.getSpecific('specnet', '#other')(), 'foo')
+
+        value.setValue('qux')
+        self.assertEqual(value.getSpecific('specnet', '#other')(), 'qux')
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
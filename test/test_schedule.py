@@ -30,6 +30,7 @@
 from supybot.test import *
 
 import time
+import threading
 
 import supybot.schedule as schedule
 
@@ -127,6 +128,141 @@ class TestSchedule(SupyTestCase):
         sched.run() # 3.4
         self.assertEqual(i[0], 3)
 
+    def testRescheduleKeepsArguments(self):
+        sched = FakeSchedule()
+        L = []
+        n = sched.addEvent(L.append, time.time() + 1, args=['foo'])
+        sched.rescheduleEvent(n, time.time() + 2)
+        timeFastForward(2.2)
+        sched.run()
+        self.assertEqual(L, ['foo'])
+
+    def testRemoveMany(self):
+        sched = FakeSchedule()
+        L = []
+        names = [sched.addEvent(L.append, time.time() + 1 + i/1000, args=[i])
+                 for i in range(1000)]
+        for name in names[:750]:
+            sched.removeEvent(name)
+        self.assertRaises(KeyError, sched.removeEvent, names[0])
+        # Removed events are dropped from the heap, eventually.
+        self.assertLess(len(sched.schedule), 1000)
+        self.assertEqual(sched.stats()['pending'], 250)
+        self.assertEqual(sched.nextEventTime(), sched.schedule[0][0])
+        timeFastForward(3)
+        sched.run()
+        self.assertEqual(L, list(range(750, 1000)))
+        self.assertEqual(sched.schedule, [])
+        self.assertIsNone(sched.nextEventTime())
+
+    def testStats(self):
+        sched = FakeSchedule()
+        sched.addEvent(lambda: None, time.time() + 1)
+        sched.addEvent(lambda: None, time.time() + 2)
+        self.assertEqual(sched.stats()['pending'], 2)
+        timeFastForward(3)
+        sched.run()
+        stats = sched.stats()
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['ran'], 2)
+        self.assertAlmostEqual(stats['maxLateness'], 2, places=1)
+        self.assertAlmostEqual(stats['averageLateness'], 1.5, places=1)
+
+    def testThreadExecutor(self):
+        sched = FakeSchedule()
+        done = threading.Event()
+        threads = []
+        def f():
+            threads.append(threading.current_thread())
+            done.set()
+        sched.addEvent(f, time.time() + 1, executor='thread')
+        timeFastForward(1.2)
+        sched.run()
+        self.assertTrue(done.wait(5))
+        self.assertNotEqual(threads, [threading.current_thread()])
+        self.assertRaises(ValueError, sched.addEvent, f, time.time(),
+                          executor='foo')
+
+    def testPeriodicThreadExecutor(self):
+        sched = FakeSchedule()
+        sem = threading.Semaphore(0)
+        n = sched.addPeriodicEvent(sem.release, 1, name='test_periodic',
+                                   now=False, executor='thread')
+        for i in range(2):
+            timeFastForward(1.2)
+            sched.run()
+            self.assertTrue(sem.acquire(timeout=5))
+            # Wait for it to be rescheduled by the thread.
+            for j in range(500):
+                if n in sched.events:
+                    break
+                time.sleep(0.01)
+            self.assertIn(n, sched.events)
+        sched.removePeriodicEvent(n)
+
+    def testRemoveRunningPeriodic(self):
+        sched = FakeSchedule()
+        L = []
+        def f():
+            L.append(1)
+            sched.removePeriodicEvent('test_periodic')
+        sched.addPeriodicEvent(f, 1, name='test_periodic', now=False)
+        timeFastForward(1.2)
+        sched.run()
+        self.assertEqual(L, [1])
+        self.assertNotIn('test_periodic', sched.events)
+        timeFastForward(1.2)
+        sched.run()
+        self.assertEqual(L, [1])
+
+    def testRemoveRunningPeriodicThread(self):
+        sched = FakeSchedule()
+        started = threading.Event()
+        removed = threading.Event()
+        def f():
+            started.set()
+            removed.wait(5)
+        n = sched.addPeriodicEvent(f, 1, now=False, executor='thread')
+        timeFastForward(1.2)
+        sched.run()
+        self.assertTrue(started.wait(5))
+        self.assertIs(sched.removePeriodicEvent(n).__wrapped__, f)
+        removed.set()
+        for i in range(500):
+            if not sched._running:
+                break
+            time.sleep(0.01)
+        self.assertEqual(sched._running, {})
+        self.assertEqual(sched.events, {})
+
+    def testUnnamedPeriodicKeepsName(self):
+        sched = FakeSchedule()
+        i = [0]
+        def inc():
+            i[0] += 1
+        n = sched.addPeriodicEvent(inc, 1, now=False)
+        timeFastForward(1.2)
+        sched.run()
+        self.assertEqual(i[0], 1)
+        sched.removePeriodicEvent(n)
+        timeFastForward(1.2)
+        sched.run()
+        self.assertEqual(i[0], 1)
+
+    def testEventStats(self):
+        sched = FakeSchedule()
+        def f():
+            timeFastForward(0.5)
+        sched.addEvent(f, time.time() + 1)
+        timeFastForward(2)
+        sched.run()
+        (label, stats) = list(sched.eventStats().items())[0]
+        self.assertTrue(label.endswith('testEventStats.<locals>.f'), label)
+        self.assertEqual(stats['executor'], 'inline')
+        self.assertEqual(stats['runs'], 1)
+        self.assertAlmostEqual(stats['maxLateness'], 1, places=1)
+        self.assertAlmostEqual(stats['maxDuration'], 0.5, places=1)
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
@@ -1166,6 +1166,42 @@ class TestCacheDict(SupyTestCase):
             self.assertTrue(i in d)
             self.assertTrue(d[i] == i)
 
+class TestLRUCache(SupyTestCase):
+    def testMaxNeverExceeded(self):
+        max = 10
+        d = LRUCache(10)
+        for i in range(max**2):
+            d[i] = i
+            self.assertTrue(len(d) <= max)
+            self.assertTrue(i in d)
+            self.assertTrue(d[i] == i)
+        self.assertEqual(d.evictions, max**2 - max)
+
+    def testLeastRecentlyUsedEvicted(self):
+        evicted = []
+        d = LRUCache(3, onEvict=lambda *args: evicted.append(args))
+        d['a'] = 1
+        d['b'] = 2
+        d['c'] = 3
+        self.assertEqual(d['a'], 1)
+        d['d'] = 4
+        self.assertEqual(evicted, [('b', 2)])
+        d['c'] = 5
+        d['e'] = 6
+        self.assertEqual(evicted, [('b', 2), ('a', 1)])
+        self.assertEqual(sorted(d), ['c', 'd', 'e'])
+
+    def testStats(self):
+        d = LRUCache(10)
+        d['a'] = 1
+        self.assertEqual(d['a'], 1)
+        self.assertRaises(KeyError, d.__getitem__, 'b')
+        self.assertEqual(d.get('b'), None)
+        # Membership tests are not lookups.
+        self.assertFalse('b' in d)
+        self.assertEqual(d.stats(),
+                         {'hits': 1, 'misses': 2, 'evictions': 0, 'size': 1})
+
 class TestExpiringDict(SupyTestCase):
     def testInit(self):
         d = ExpiringDict(10)